@@ -2,6 +2,8 @@ class Book:
     """
     Represents a book in the library
     """
+    __slots__ = ("_book_id", "_title", "_author", "_is_available")
+
     def __init__(self, book_id: str, title: str, author: str, is_available: bool):
         self._book_id = book_id
         self._title = title
@@ -28,6 +30,16 @@ class Book:
     def get_is_available(self, value: bool):
         self._is_available = value
 
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        """
+        Accepts the __dict__ state pickled before the class had __slots__.
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __str__(self):
         return f"ID: {self.get_book_id}| {self.get_title} by {self.get_author}"
 
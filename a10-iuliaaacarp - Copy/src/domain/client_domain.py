@@ -2,6 +2,8 @@ class Client:
     """
     Represents a client in the library
     """
+    __slots__ = ("_client_id", "_client_name")
+
     def __init__(self, client_id: str, client_name: str):
         """
         Initialize the client
@@ -25,6 +27,19 @@ class Client:
         """
         return self._client_name
 
+    def __getstate__(self):
+        """
+        :return: the fields as a dict, the same state older pickles of the client hold
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        """
+        :param state: the dict produced by __getstate__ or by the old __dict__ pickling
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __str__(self):
         """
         :return: a string representation of the client
@@ -1,10 +1,30 @@
+from datetime import date
+
+
+def day_ordinal(value):
+    """
+    :return: the day ordinal of a "YYYY-MM-DD" date, or None for "", "Not returned" and any
+             other text, which callers have to handle the way they did before
+    """
+    try:
+        ordinal = date.fromisoformat(value).toordinal()
+    except (TypeError, ValueError):
+        return None
+    return ordinal if date.fromordinal(ordinal).isoformat() == value else None
+
+
 class Rental:
+    __slots__ = ("_rental_id", "_book_id", "_client_id", "_rented_date", "_returned_date",
+                 "_rented_day", "_returned_day")
+
     def __init__(self, rental_id: str, book_id: str, client_id: str, rented_date: str, returned_date: str):
         self._rental_id = rental_id
         self._book_id = book_id
         self._client_id = client_id
         self._rented_date = rented_date
         self._returned_date = returned_date
+        self._rented_day = day_ordinal(rented_date)
+        self._returned_day = day_ordinal(returned_date)
 
     @property
     def get_rental_id(self):
@@ -26,6 +46,29 @@ class Rental:
     def get_returned_date(self):
         return self._returned_date
 
+    @get_returned_date.setter
+    def get_returned_date(self, value: str):
+        self._returned_date = value
+        self._returned_day = day_ordinal(value)
+
+    @property
+    def get_rented_day(self):
+        return self._rented_day
+
+    @property
+    def get_returned_day(self):
+        return self._returned_day
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        if "_rented_day" not in state:
+            self._rented_day = day_ordinal(self._rented_date)
+            self._returned_day = day_ordinal(self._returned_date)
+
     def __str__(self):
         return f"ID:{self.get_rental_id} | {self.get_book_id} | {self.get_client_id} | {self.get_rented_date} {self.get_returned_date}\n"
 
@@ -1,8 +1,23 @@
 class RentalStats:
-    def __init__(self, name: str, value: int, second_value: str = None):
+    __slots__ = ("name", "value", "second_value", "error")
+
+    def __init__(self, name: str, value: int, second_value: str = None, error: int = None):
+        """
+        :param error: for an estimated value, how far it can be from the true one
+        """
         self.name = name
         self.value = value
         self.second_value = second_value
+        self.error = error
+
+    @property
+    def formatted_value(self) -> str:
+        """
+        The value, with its error when it is an estimate.
+        """
+        if self.error:
+            return f"~{self.value} (± {self.error})"
+        return str(self.value)
 
     def __lt__(self, other):
         return self.value < other.value
@@ -1,5 +1,12 @@
 import pickle
+import sqlite3
 from src.domain.book_domain import Book
+from src.repository.journal import JournalFile, DEFAULT_COMPACT_THRESHOLD
+from src.repository.unit_of_work import TransactionalRepository
+from src.repository.repository_iterator import RepositoryIterator
+from src.repository.sqlite_repository import SqliteRepository
+from src.repository.record_file import RecordFileRepository
+from src.repository.trigram_index import TrigramIndex
 
 
 class BookError(Exception):
@@ -14,30 +21,33 @@ class BookNotFoundError(BookError):
     pass
 
 
-class RepositoryIterator:
-    def __init__(self, elements):
-        self._elements = elements
-        self.__pos = -1
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        self.__pos += 1
-        if self.__pos == len(self._elements):
-            raise StopIteration()
-        return self._elements[self.__pos]
-
-
-class BookMemoryRepository:
+class BookMemoryRepository(TransactionalRepository):
     def __init__(self):
-        self._data = {}
+        super().__init__()
+        self._catalog_version = 0
+        self._title_index = {}
+        self._id_trigrams = TrigramIndex()
+        self._title_trigrams = TrigramIndex()
+        self._author_trigrams = TrigramIndex()
 
     def get_book(self, book_id: str) -> Book:
         if book_id not in self._data:
             raise BookNotFoundError(f"Book ID '{book_id}' not found.")
         return self._data[book_id]
 
+    def get_books(self, book_ids) -> dict:
+        """
+        :return: book id -> Book for every id in book_ids
+        :raises BookNotFoundError: for the first id that has no book
+        """
+        return {book_id: self.get_book(book_id) for book_id in book_ids}
+
+    def find_existing(self, book_ids) -> set:
+        """
+        :return: the ids in book_ids that already have a book
+        """
+        return {book_id for book_id in book_ids if book_id in self._data}
+
     def is_available(self, book_id: str) -> bool:
         if book_id not in self._data:
             raise BookNotFoundError(f"Book ID '{book_id}' not found.")
@@ -46,38 +56,108 @@ class BookMemoryRepository:
     def set_availability(self, book_id: str, is_available: bool):
         if book_id not in self._data:
             raise BookNotFoundError(f"Book ID '{book_id}' not found.")
+        self._remember(book_id)
         self._data[book_id].get_is_available = is_available
 
     def add_book(self, book: Book):
         if book.get_book_id in self._data:
             raise DuplicateIDError("Duplicate Book ID")
+        self._remember(book.get_book_id)
+        self._catalog_version += 1
         self._data[book.get_book_id] = book
+        self._index_item(book)
 
     def remove_book(self, title: str) -> Book:
         """
         Removes a book by title and returns the removed Book object.
         """
-        to_delete_id = None
-        deleted_book = None
-
-        for book in self._data.values():
-            if title.lower() == book.get_title.lower():
-                to_delete_id = book.get_book_id
-                deleted_book = book
-                break
-
+        to_delete_id = self.find_book_id_by_title(title)
         if to_delete_id is None:
             raise BookNotFoundError(f"No book with title '{title}' found.")
+        return self._pop_book(to_delete_id)
 
-        del self._data[to_delete_id]
+    def remove_book_by_id(self, book_id: str) -> Book:
+        """
+        Removes the book with book_id, whatever its title, and returns it.
+        """
+        if book_id not in self._data:
+            raise BookNotFoundError(f"Book ID '{book_id}' not found.")
+        return self._pop_book(book_id)
+
+    def _pop_book(self, book_id: str) -> Book:
+        self._remember(book_id)
+        self._catalog_version += 1
+        deleted_book = self._data.pop(book_id)
+        self._unindex_item(deleted_book)
         return deleted_book
 
     def update_book(self, book_id: str, title: str, author: str):
         if book_id not in self._data:
             raise BookNotFoundError(f"Book ID '{book_id}' not found.")
+        self._remember(book_id)
+        self._catalog_version += 1
         book = self._data[book_id]
+        self._unindex_title(book)
         book._title = title
         book._author = author
+        self._index_item(book)
+
+    @property
+    def catalog_version(self) -> int:
+        """
+        :return: a counter that grows when a book is added, removed or edited, or a unit of
+                 work is rolled back, but not when the availability of a book changes
+        """
+        return self._catalog_version
+
+    def rollback(self):
+        self._catalog_version += 1
+        super().rollback()
+
+    def find_book_id_by_title(self, title: str):
+        """
+        :return: the id of the first book with the given title, ignoring case, or None
+        """
+        book_ids = self._title_index.get(str(title).lower())
+        return book_ids[0] if book_ids else None
+
+    def search_by_id(self, text: str) -> list[Book]:
+        return [self._data[book_id] for book_id in self._id_trigrams.search(text)]
+
+    def search_by_title(self, text: str) -> list[Book]:
+        return [self._data[book_id] for book_id in self._title_trigrams.search(text)]
+
+    def search_by_author(self, text: str) -> list[Book]:
+        return [self._data[book_id] for book_id in self._author_trigrams.search(text)]
+
+    def _clear_indexes(self):
+        self._title_index = {}
+        for index in (self._id_trigrams, self._title_trigrams, self._author_trigrams):
+            index.clear()
+
+    def _index_item(self, book: Book):
+        book_id = book.get_book_id
+        self._title_index.setdefault(book.get_title.lower(), []).append(book_id)
+        self._id_trigrams.add(book_id, str(book_id))
+        self._title_trigrams.add(book_id, book.get_title)
+        self._author_trigrams.add(book_id, book.get_author)
+
+    def _unindex_item(self, book: Book):
+        self._unindex_title(book)
+        for index in (self._id_trigrams, self._title_trigrams, self._author_trigrams):
+            index.remove(book.get_book_id)
+
+    def _unindex_title(self, book: Book):
+        title_key = book.get_title.lower()
+        book_ids = self._title_index[title_key]
+        book_ids.remove(book.get_book_id)
+        if not book_ids:
+            del self._title_index[title_key]
+
+    def _restore_item(self, item: Book, saved: Book):
+        item._title = saved.get_title
+        item._author = saved.get_author
+        item._is_available = saved.get_is_available
 
     def display_all_books(self) -> list[Book]:
         return list(self._data.values())
@@ -86,7 +166,13 @@ class BookMemoryRepository:
         return len(self._data)
 
     def __iter__(self):
-        return RepositoryIterator(list(self._data.values()))
+        return RepositoryIterator(self)
+
+    def snapshot(self) -> list:
+        """
+        :return: a copy of the stored objects, for loops that mutate the repository
+        """
+        return list(self._data.values())
 
 
 class BookBinaryFileRepository(BookMemoryRepository):
@@ -97,34 +183,43 @@ class BookBinaryFileRepository(BookMemoryRepository):
 
     def set_availability(self, book_id: str, is_available: bool):
         super().set_availability(book_id, is_available)
-        self.__save_file()
+        self._save()
 
     def add_book(self, book: Book):
         super().add_book(book)
-        self.__save_file()
+        self._save()
 
     def remove_book(self, title: str) -> Book:
         deleted_book = super().remove_book(title)
-        self.__save_file()
+        self._save()
+        return deleted_book
+
+    def remove_book_by_id(self, book_id: str) -> Book:
+        deleted_book = super().remove_book_by_id(book_id)
+        self._save()
         return deleted_book
 
     def update_book(self, book_id: str, title: str, author: str):
         super().update_book(book_id, title, author)
-        self.__save_file()
+        self._save()
 
-    def __save_file(self):
+    def _save(self):
         try:
-            with open(self._filename, "wb") as fout:
-                pickle.dump(self._data, fout)
+            super()._save()
         except Exception:
             pass
 
+    def _flush(self):
+        with open(self._filename, "wb") as fout:
+            pickle.dump(self._data, fout)
+
     def __load_file(self):
         try:
             with open(self._filename, "rb") as fin:
                 self._data = pickle.load(fin)
         except FileNotFoundError:
             self._data = {}
+        self._rebuild_indexes()
 
 
 class BookTextFileRepository(BookMemoryRepository):
@@ -135,20 +230,25 @@ class BookTextFileRepository(BookMemoryRepository):
 
     def set_availability(self, book_id: str, is_available: bool):
         super().set_availability(book_id, is_available)
-        self.__save_file()
+        self._save()
 
     def add_book(self, book: Book):
         super().add_book(book)
-        self.__save_file()
+        self._save()
 
     def remove_book(self, title: str) -> Book:
         deleted_book = super().remove_book(title)
-        self.__save_file()
+        self._save()
+        return deleted_book
+
+    def remove_book_by_id(self, book_id: str) -> Book:
+        deleted_book = super().remove_book_by_id(book_id)
+        self._save()
         return deleted_book
 
     def update_book(self, book_id: str, title: str, author: str):
         super().update_book(book_id, title, author)
-        self.__save_file()
+        self._save()
 
     def __load_file(self):
         try:
@@ -166,10 +266,398 @@ class BookTextFileRepository(BookMemoryRepository):
                 is_available = False
             self._data[book_id] = Book(book_id, title, author, is_available)
         fin.close()
+        self._rebuild_indexes()
 
-    def __save_file(self):
+    def _flush(self):
         fout = open(self._filename, "w")
         for book in self._data.values():
             avail_str = "1" if book.get_is_available else "0"
             fout.write(f"{book.get_book_id}, {book.get_title}, {book.get_author}, {avail_str}\n")
-        fout.close()
\ No newline at end of file
+        fout.close()
+
+
+class BookJournalFileRepository(BookMemoryRepository):
+    """
+    Keeps books.txt as a snapshot and appends one journal record per mutation instead of
+    rewriting the whole file.
+    """
+    def __init__(self, filename: str = "books.txt", compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        super().__init__()
+        self._filename = filename
+        self._journal = JournalFile(filename, self._format_book, self._parse_book,
+                                    lambda: self._data.values(), compact_threshold)
+        self._data = self._journal.load()
+        self._rebuild_indexes()
+        self._pending = {}
+
+    def set_availability(self, book_id: str, is_available: bool):
+        super().set_availability(book_id, is_available)
+        self._record(book_id)
+
+    def add_book(self, book: Book):
+        super().add_book(book)
+        self._record(book.get_book_id)
+
+    def remove_book(self, title: str) -> Book:
+        deleted_book = super().remove_book(title)
+        self._record(deleted_book.get_book_id)
+        return deleted_book
+
+    def remove_book_by_id(self, book_id: str) -> Book:
+        deleted_book = super().remove_book_by_id(book_id)
+        self._record(book_id)
+        return deleted_book
+
+    def update_book(self, book_id: str, title: str, author: str):
+        super().update_book(book_id, title, author)
+        self._record(book_id)
+
+    def _record(self, book_id):
+        self._pending[book_id] = None
+        self._save()
+
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._journal.record_many(pending, self._data)
+
+    def _resync(self, keys):
+        self._pending.update(dict.fromkeys(keys))
+        self._flush()
+
+    def rollback(self):
+        self._pending = {}
+        super().rollback()
+
+    def compact(self):
+        self._journal.compact()
+
+    def close(self):
+        self._journal.close()
+
+    @staticmethod
+    def _format_book(book: Book) -> str:
+        avail_str = "1" if book.get_is_available else "0"
+        return f"{book.get_book_id}, {book.get_title}, {book.get_author}, {avail_str}"
+
+    @staticmethod
+    def _parse_book(line: str):
+        part = line.strip().split(", ")
+        if len(part) < 3:
+            return None
+        book_id, title, author = part[0:3]
+        is_available = not (len(part) > 3 and part[3] == '0')
+        return book_id, Book(book_id, title, author, is_available)
+
+
+
+class BookSqliteRepository(SqliteRepository):
+    """
+    Stores the books in an SQLite table; title_key holds the lowercase title for the
+    case-insensitive lookups and books_search the trigrams of the id, title and author for
+    the substring searches. Availability changes do not touch books_search.
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS books (book_id TEXT PRIMARY KEY, title TEXT NOT NULL, "
+        "title_key TEXT NOT NULL, author TEXT NOT NULL, is_available INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS books_title_key ON books (title_key)",
+        "CREATE INDEX IF NOT EXISTS books_author ON books (author)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS books_search USING fts5(book_id, title, author, content='books', "
+        "content_rowid='rowid', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS books_search_insert AFTER INSERT ON books BEGIN "
+        "INSERT INTO books_search (rowid, book_id, title, author) VALUES (new.rowid, new.book_id, new.title, new.author); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS books_search_delete AFTER DELETE ON books BEGIN "
+        "INSERT INTO books_search (books_search, rowid, book_id, title, author) "
+        "VALUES ('delete', old.rowid, old.book_id, old.title, old.author); END",
+        "CREATE TRIGGER IF NOT EXISTS books_search_update AFTER UPDATE OF book_id, title, author ON books BEGIN "
+        "INSERT INTO books_search (books_search, rowid, book_id, title, author) "
+        "VALUES ('delete', old.rowid, old.book_id, old.title, old.author); "
+        "INSERT INTO books_search (rowid, book_id, title, author) VALUES (new.rowid, new.book_id, new.title, new.author); "
+        "END",
+    )
+    SEARCH_TABLE = "books_search"
+    COLUMNS = "book_id, title, author, is_available"
+
+    def __init__(self, filename: str = "books.db"):
+        super().__init__(filename)
+        self._catalog_version = 0
+
+    @property
+    def catalog_version(self) -> int:
+        return self._catalog_version
+
+    def rollback(self):
+        self._catalog_version += 1
+        super().rollback()
+
+    def get_book(self, book_id: str) -> Book:
+        row = self._query(f"SELECT {self.COLUMNS} FROM books WHERE book_id = ?", (book_id,)).fetchone()
+        if row is None:
+            raise BookNotFoundError(f"Book ID '{book_id}' not found.")
+        return self._to_book(row)
+
+    def get_books(self, book_ids) -> dict:
+        """
+        Reads the books with one query per chunk of ids instead of one per id.
+        """
+        book_ids = list(dict.fromkeys(book_ids))
+        found = {row[0]: self._to_book(row)
+                 for row in self._query_in(f"SELECT {self.COLUMNS} FROM books WHERE book_id IN ({{}})", book_ids)}
+        for book_id in book_ids:
+            if book_id not in found:
+                raise BookNotFoundError(f"Book ID '{book_id}' not found.")
+        return {book_id: found[book_id] for book_id in book_ids}
+
+    def find_existing(self, book_ids) -> set:
+        return {row[0] for row in self._query_in("SELECT book_id FROM books WHERE book_id IN ({})",
+                                                 list(dict.fromkeys(book_ids)))}
+
+    def is_available(self, book_id: str) -> bool:
+        return self.get_book(book_id).get_is_available
+
+    def set_availability(self, book_id: str, is_available: bool):
+        cursor = self._write("UPDATE books SET is_available = ? WHERE book_id = ?", (int(is_available), book_id))
+        if cursor.rowcount == 0:
+            raise BookNotFoundError(f"Book ID '{book_id}' not found.")
+
+    def add_book(self, book: Book):
+        self._catalog_version += 1
+        try:
+            self._write("INSERT INTO books (book_id, title, title_key, author, is_available) VALUES (?, ?, ?, ?, ?)",
+                        (book.get_book_id, book.get_title, book.get_title.lower(), book.get_author,
+                         int(book.get_is_available)))
+        except sqlite3.IntegrityError:
+            raise DuplicateIDError("Duplicate Book ID")
+
+    def remove_book(self, title: str) -> Book:
+        """
+        Removes a book by title and returns the removed Book object.
+        """
+        row = self._query(f"SELECT {self.COLUMNS} FROM books WHERE title_key = ? ORDER BY rowid LIMIT 1",
+                          (title.lower(),)).fetchone()
+        if row is None:
+            raise BookNotFoundError(f"No book with title '{title}' found.")
+        self._catalog_version += 1
+        self._write("DELETE FROM books WHERE book_id = ?", (row[0],))
+        return self._to_book(row)
+
+    def remove_book_by_id(self, book_id: str) -> Book:
+        """
+        Removes the book with book_id, whatever its title, and returns it.
+        """
+        deleted_book = self.get_book(book_id)
+        self._catalog_version += 1
+        self._write("DELETE FROM books WHERE book_id = ?", (book_id,))
+        return deleted_book
+
+    def find_book_id_by_title(self, title: str):
+        row = self._query("SELECT book_id FROM books WHERE title_key = ? ORDER BY rowid LIMIT 1",
+                          (str(title).lower(),)).fetchone()
+        return row[0] if row else None
+
+    def search_by_id(self, text: str) -> list[Book]:
+        return self._search("book_id", text)
+
+    def search_by_title(self, text: str) -> list[Book]:
+        return self._search("title", text)
+
+    def search_by_author(self, text: str) -> list[Book]:
+        return self._search("author", text)
+
+    def _search(self, column: str, text: str) -> list[Book]:
+        return [self._to_book(row) for row in self._search_rows(self.COLUMNS, "books", column, text)]
+
+    def update_book(self, book_id: str, title: str, author: str):
+        self._catalog_version += 1
+        cursor = self._write("UPDATE books SET title = ?, title_key = ?, author = ? WHERE book_id = ?",
+                             (title, title.lower(), author, book_id))
+        if cursor.rowcount == 0:
+            raise BookNotFoundError(f"Book ID '{book_id}' not found.")
+
+    def display_all_books(self) -> list[Book]:
+        return list(self)
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def __iter__(self):
+        return (self._to_book(row) for row in self._query(f"SELECT {self.COLUMNS} FROM books ORDER BY rowid"))
+
+    def snapshot(self) -> list:
+        return list(self)
+
+    @staticmethod
+    def _to_book(row) -> Book:
+        book_id, title, author, is_available = row
+        return Book(book_id, title, author, bool(is_available))
+
+
+class BookRecordFileRepository(RecordFileRepository):
+    """
+    Stores the books in a memory-mapped record file (see RecordFile); only the requested
+    book is decoded. The title index and the search indexes are each built the first
+    time a lookup by title or a search needs them.
+    """
+    FIELD_COUNT = 4
+    RECORD_SIZE = 256
+
+    def __init__(self, filename: str = "books.rec"):
+        super().__init__(filename)
+        self._title_index = None
+        self._searchable = False
+        self._catalog_version = 0
+        self._id_trigrams = TrigramIndex()
+        self._title_trigrams = TrigramIndex()
+        self._author_trigrams = TrigramIndex()
+
+    @classmethod
+    def from_pickle(cls, pickle_filename: str, filename: str = "books.rec"):
+        """
+        Converts a books.bin file written by BookBinaryFileRepository.
+        """
+        repo = cls(filename)
+        with open(pickle_filename, "rb") as fin:
+            for book in pickle.load(fin).values():
+                repo.add_book(book)
+        repo.flush()
+        return repo
+
+    def get_book(self, book_id: str) -> Book:
+        fields = self._records.get(book_id)
+        if fields is None:
+            raise BookNotFoundError(f"Book ID '{book_id}' not found.")
+        return self._to_book(fields)
+
+    def get_books(self, book_ids) -> dict:
+        return {book_id: self.get_book(book_id) for book_id in book_ids}
+
+    def find_existing(self, book_ids) -> set:
+        return {book_id for book_id in book_ids if book_id in self._records}
+
+    def is_available(self, book_id: str) -> bool:
+        return self.get_book(book_id).get_is_available
+
+    def set_availability(self, book_id: str, is_available: bool):
+        book = self.get_book(book_id)
+        book.get_is_available = is_available
+        self._put(self._to_fields(book))
+
+    def add_book(self, book: Book):
+        if book.get_book_id in self._records:
+            raise DuplicateIDError("Duplicate Book ID")
+        self._put(self._to_fields(book))
+        self._catalog_version += 1
+        self._index_item(book)
+
+    def remove_book(self, title: str) -> Book:
+        """
+        Removes a book by title and returns the removed Book object.
+        """
+        to_delete_id = self.find_book_id_by_title(title)
+        if to_delete_id is None:
+            raise BookNotFoundError(f"No book with title '{title}' found.")
+        return self.remove_book_by_id(to_delete_id)
+
+    def remove_book_by_id(self, book_id: str) -> Book:
+        """
+        Removes the book with book_id, whatever its title, and returns it.
+        """
+        deleted_book = self.get_book(book_id)
+        self._delete(book_id)
+        self._catalog_version += 1
+        self._unindex_item(deleted_book)
+        return deleted_book
+
+    def update_book(self, book_id: str, title: str, author: str):
+        book = self.get_book(book_id)
+        self._unindex_title(book)
+        book._title = title
+        book._author = author
+        self._put(self._to_fields(book))
+        self._catalog_version += 1
+        self._index_item(book)
+
+    @property
+    def catalog_version(self) -> int:
+        return self._catalog_version
+
+    def find_book_id_by_title(self, title: str):
+        """
+        :return: the id of the first book with the given title, ignoring case, or None
+        """
+        book_ids = self._titles().get(str(title).lower())
+        return book_ids[0] if book_ids else None
+
+    def search_by_id(self, text: str) -> list[Book]:
+        self._build_search_indexes()
+        return [self.get_book(book_id) for book_id in self._id_trigrams.search(text)]
+
+    def search_by_title(self, text: str) -> list[Book]:
+        self._build_search_indexes()
+        return [self.get_book(book_id) for book_id in self._title_trigrams.search(text)]
+
+    def search_by_author(self, text: str) -> list[Book]:
+        self._build_search_indexes()
+        return [self.get_book(book_id) for book_id in self._author_trigrams.search(text)]
+
+    def display_all_books(self) -> list[Book]:
+        return list(self)
+
+    def __iter__(self):
+        return self._iterate(self._to_book)
+
+    def _titles(self) -> dict:
+        """
+        :return: the title index, read from the file the first time
+        """
+        if self._title_index is None:
+            self._title_index = {}
+            for book_id, title, _, _ in self._records.values():
+                self._title_index.setdefault(title.lower(), []).append(book_id)
+        return self._title_index
+
+    def _build_search_indexes(self):
+        if not self._searchable:
+            self._searchable = True
+            for fields in self._records.values():
+                self._index_item(self._to_book(fields), titles=False)
+
+    def _drop_indexes(self):
+        self._catalog_version += 1
+        self._title_index = None
+        self._searchable = False
+        for index in (self._id_trigrams, self._title_trigrams, self._author_trigrams):
+            index.clear()
+
+    def _index_item(self, book: Book, titles: bool = True):
+        book_id = book.get_book_id
+        if titles and self._title_index is not None:
+            self._title_index.setdefault(book.get_title.lower(), []).append(book_id)
+        if self._searchable:
+            self._id_trigrams.add(book_id, str(book_id))
+            self._title_trigrams.add(book_id, book.get_title)
+            self._author_trigrams.add(book_id, book.get_author)
+
+    def _unindex_item(self, book: Book):
+        self._unindex_title(book)
+        if self._searchable:
+            for index in (self._id_trigrams, self._title_trigrams, self._author_trigrams):
+                index.remove(book.get_book_id)
+
+    def _unindex_title(self, book: Book):
+        if self._title_index is None:
+            return
+        title_key = book.get_title.lower()
+        book_ids = self._title_index[title_key]
+        book_ids.remove(book.get_book_id)
+        if not book_ids:
+            del self._title_index[title_key]
+
+    @staticmethod
+    def _to_fields(book: Book) -> tuple:
+        return book.get_book_id, book.get_title, book.get_author, "1" if book.get_is_available else "0"
+
+    @staticmethod
+    def _to_book(fields) -> Book:
+        book_id, title, author, is_available = fields
+        return Book(book_id, title, author, is_available == "1")
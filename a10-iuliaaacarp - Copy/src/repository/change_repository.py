@@ -27,6 +27,63 @@ class RepositoryChange:
     def __init__(self, setting_file):
         self.settings = SettingsManager(setting_file)
 
+    def journal_compact_threshold(self) -> int:
+        return int(self.settings.get("journal_compact_threshold", DEFAULT_COMPACT_THRESHOLD))
+
+    def statistics_ranked(self) -> bool:
+        return self.settings.get("statistics", "heap").lower() == "ranked"
+
+    def statistics_backend(self) -> str:
+        return self.settings.get("statistics_backend", "python").lower()
+
+    def statistics_workers(self):
+        workers = self.settings.get("statistics_workers", "")
+        return int(workers) if workers else None
+
+    def undo_max_operations(self):
+        value = self.settings.get("undo_max_operations", "")
+        return int(value) if value else None
+
+    def undo_max_bytes(self):
+        value = self.settings.get("undo_max_bytes", "")
+        return int(value) if value else None
+
+    def undo_coalesce_window(self):
+        value = self.settings.get("undo_coalesce_window", "")
+        return float(value) if value else None
+
+    def undo_log(self):
+        """
+        :return: the file the undo history is kept in across runs, or None to keep it in memory;
+                 always None for the memory repositories, whose data does not outlive the run
+        """
+        value = self.settings.get("undo_log", "")
+        if not value or self.settings.get("repository", "text").lower() == "memory":
+            return None
+        return value
+
+    def statistics_approximate(self) -> bool:
+        return self.settings.get("statistics_mode", "exact").lower() == "approximate"
+
+    def statistics_error_bounds(self) -> tuple:
+        """
+        :return: (epsilon, delta) of the approximate statistics
+        """
+        return float(self.settings.get("statistics_epsilon", 0.001)), float(self.settings.get("statistics_delta", 0.01))
+
+    def statistics_parallel_threshold(self):
+        threshold = self.settings.get("statistics_parallel_threshold", "")
+        return int(threshold) if threshold else None
+
+    @staticmethod
+    def open_record_file(repository_class, filename: str, pickle_filename: str):
+        """
+        Opens a record file repository, converting the pickled .bin file the first time.
+        """
+        if not os.path.exists(filename) and os.path.exists(pickle_filename):
+            return repository_class.from_pickle(pickle_filename, filename)
+        return repository_class(filename)
+
     def create_repo_book(self):
         repo = self.settings.get("repository","text").lower()
         if repo == "text":
@@ -35,6 +92,12 @@ class RepositoryChange:
             return BookMemoryRepository()
         elif repo == "binary":
             return BookBinaryFileRepository("books.bin")
+        elif repo == "journal":
+            return BookJournalFileRepository("books.txt", self.journal_compact_threshold())
+        elif repo == "sqlite":
+            return BookSqliteRepository("books.db")
+        elif repo == "mmap":
+            return self.open_record_file(BookRecordFileRepository, "books.rec", "books.bin")
         else:
             raise ValueError("Repository not supported")
 
@@ -46,6 +109,12 @@ class RepositoryChange:
             return ClientMemoryRepository()
         elif repo == "binary":
             return ClientBinaryFileRepository("clients.bin")
+        elif repo == "journal":
+            return ClientJournalFileRepository("clients.txt", self.journal_compact_threshold())
+        elif repo == "sqlite":
+            return ClientSqliteRepository("clients.db")
+        elif repo == "mmap":
+            return self.open_record_file(ClientRecordFileRepository, "clients.rec", "clients.bin")
         else:
             raise ValueError("Repository not supported")
 
@@ -54,8 +123,16 @@ class RepositoryChange:
         if repo == "text":
             return RentalTextFileRepository("rentals.txt")
         elif repo == "memory":
+            if self.settings.get("rental_store", "objects").lower() == "columnar":
+                return RentalColumnarRepository()
             return RentalMemoryRepository()
         elif repo == "binary":
             return RentalBinaryFileRepository("rentals.bin")
+        elif repo == "journal":
+            return RentalJournalFileRepository("rentals.txt", self.journal_compact_threshold())
+        elif repo == "sqlite":
+            return RentalSqliteRepository("rentals.db")
+        elif repo == "mmap":
+            return self.open_record_file(RentalRecordFileRepository, "rentals.rec", "rentals.bin")
         else:
             raise ValueError("Repository not supported")
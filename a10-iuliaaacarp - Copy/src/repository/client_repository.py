@@ -1,5 +1,12 @@
 import pickle
+import sqlite3
 from src.domain.client_domain import Client
+from src.repository.journal import JournalFile, DEFAULT_COMPACT_THRESHOLD
+from src.repository.unit_of_work import TransactionalRepository
+from src.repository.repository_iterator import RepositoryIterator
+from src.repository.sqlite_repository import SqliteRepository
+from src.repository.record_file import RecordFileRepository
+from src.repository.trigram_index import TrigramIndex
 
 
 class ClientError(Exception):
@@ -14,34 +21,36 @@ class ClientNotFoundError(ClientError):
     pass
 
 
-class RepositoryIterator:
-    def __init__(self, elements):
-        self._elements = elements
-        self.__pos = -1
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        self.__pos += 1
-        if self.__pos == len(self._elements):
-            raise StopIteration()
-        return self._elements[self.__pos]
-
-
-class ClientMemoryRepository:
+class ClientMemoryRepository(TransactionalRepository):
     def __init__(self):
-        self._data = {}
+        super().__init__()
+        self._id_trigrams = TrigramIndex()
+        self._name_trigrams = TrigramIndex()
 
     def get_client(self, client_id: str) -> Client:
         if client_id not in self._data:
             raise ClientNotFoundError(f"Client {client_id} not found")
         return self._data[client_id]
 
+    def get_clients(self, client_ids) -> dict:
+        """
+        :return: client id -> Client for every id in client_ids
+        :raises ClientNotFoundError: for the first id that has no client
+        """
+        return {client_id: self.get_client(client_id) for client_id in client_ids}
+
+    def find_existing(self, client_ids) -> set:
+        """
+        :return: the ids in client_ids that already have a client
+        """
+        return {client_id for client_id in client_ids if client_id in self._data}
+
     def add_client(self, client: Client):
         if client.get_client_id in self._data:
             raise DuplicateIDError("Duplicate Client ID")
+        self._remember(client.get_client_id)
         self._data[client.get_client_id] = client
+        self._index_item(client)
 
     def remove_client(self, client_id: str) -> Client:
         """
@@ -56,14 +65,36 @@ class ClientMemoryRepository:
                 deleted_client = client
                 break
 
+        self._remember(client_id)
         del self._data[client_id]
+        self._unindex_item(deleted_client)
         return deleted_client
 
 
     def update_client(self, client_id: str, client_name: str):
         if client_id not in self._data:
             raise ClientNotFoundError(f"Client ID '{client_id}' not found.")
+        self._remember(client_id)
         self._data[client_id] = Client(client_id, client_name)
+        self._index_item(self._data[client_id])
+
+    def search_by_id(self, text: str) -> list[Client]:
+        return [self._data[client_id] for client_id in self._id_trigrams.search(text)]
+
+    def search_by_name(self, text: str) -> list[Client]:
+        return [self._data[client_id] for client_id in self._name_trigrams.search(text)]
+
+    def _clear_indexes(self):
+        self._id_trigrams.clear()
+        self._name_trigrams.clear()
+
+    def _index_item(self, client: Client):
+        self._id_trigrams.add(client.get_client_id, str(client.get_client_id))
+        self._name_trigrams.add(client.get_client_id, client.get_client_name)
+
+    def _unindex_item(self, client: Client):
+        self._id_trigrams.remove(client.get_client_id)
+        self._name_trigrams.remove(client.get_client_id)
 
     def display_all_clients(self) -> list[Client]:
         return list(self._data.values())
@@ -72,7 +103,13 @@ class ClientMemoryRepository:
         return len(self._data)
 
     def __iter__(self):
-        return RepositoryIterator(list(self._data.values()))
+        return RepositoryIterator(self)
+
+    def snapshot(self) -> list:
+        """
+        :return: a copy of the stored objects, for loops that mutate the repository
+        """
+        return list(self._data.values())
 
 
 class ClientBinaryFileRepository(ClientMemoryRepository):
@@ -83,30 +120,34 @@ class ClientBinaryFileRepository(ClientMemoryRepository):
 
     def add_client(self, client: Client):
         super().add_client(client)
-        self.__save_file()
+        self._save()
 
     def remove_client(self, client_id: str) -> Client:
         deleted_client = super().remove_client(client_id)
-        self.__save_file()
+        self._save()
         return deleted_client
 
     def update_client(self, client_id: str, client_name: str):
         super().update_client(client_id, client_name)
-        self.__save_file()
+        self._save()
 
-    def __save_file(self):
+    def _save(self):
         try:
-            with open(self._filename, "wb") as fout:
-                pickle.dump(self._data, fout)
+            super()._save()
         except Exception:
             pass
 
+    def _flush(self):
+        with open(self._filename, "wb") as fout:
+            pickle.dump(self._data, fout)
+
     def __load_file(self):
         try:
             with open(self._filename, "rb") as fin:
                 self._data = pickle.load(fin)
         except FileNotFoundError:
             self._data = {}
+        self._rebuild_indexes()
 
 
 class ClientTextFileRepository(ClientMemoryRepository):
@@ -117,16 +158,16 @@ class ClientTextFileRepository(ClientMemoryRepository):
 
     def add_client(self, client: Client):
         super().add_client(client)
-        self.__save_file()
+        self._save()
 
     def remove_client(self, client_id: str) -> Client:
         deleted_client = super().remove_client(client_id)
-        self.__save_file()
+        self._save()
         return deleted_client
 
     def update_client(self, client_id: str, client_name: str):
         super().update_client(client_id, client_name)
-        self.__save_file()
+        self._save()
 
     def __load_file(self):
         try:
@@ -140,8 +181,259 @@ class ClientTextFileRepository(ClientMemoryRepository):
                     self._data[client_id] = Client(client_id, client_name)
         except FileNotFoundError:
             self._data = {}
+        self._rebuild_indexes()
 
-    def __save_file(self):
+    def _flush(self):
         with open(self._filename, "w") as fout:
             for client in self._data.values():
-                fout.write(f"{client.get_client_id}, {client.get_client_name}\n")
\ No newline at end of file
+                fout.write(f"{client.get_client_id}, {client.get_client_name}\n")
+
+
+class ClientJournalFileRepository(ClientMemoryRepository):
+    """
+    Keeps clients.txt as a snapshot and appends one journal record per mutation instead of
+    rewriting the whole file.
+    """
+    def __init__(self, filename: str = "clients.txt", compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        super().__init__()
+        self._filename = filename
+        self._journal = JournalFile(filename, self._format_client, self._parse_client,
+                                    lambda: self._data.values(), compact_threshold)
+        self._data = self._journal.load()
+        self._rebuild_indexes()
+        self._pending = {}
+
+    def add_client(self, client: Client):
+        super().add_client(client)
+        self._record(client.get_client_id)
+
+    def remove_client(self, client_id: str) -> Client:
+        deleted_client = super().remove_client(client_id)
+        self._record(client_id)
+        return deleted_client
+
+    def update_client(self, client_id: str, client_name: str):
+        super().update_client(client_id, client_name)
+        self._record(client_id)
+
+    def _record(self, client_id):
+        self._pending[client_id] = None
+        self._save()
+
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._journal.record_many(pending, self._data)
+
+    def _resync(self, keys):
+        self._pending.update(dict.fromkeys(keys))
+        self._flush()
+
+    def rollback(self):
+        self._pending = {}
+        super().rollback()
+
+    def compact(self):
+        self._journal.compact()
+
+    def close(self):
+        self._journal.close()
+
+    @staticmethod
+    def _format_client(client: Client) -> str:
+        return f"{client.get_client_id}, {client.get_client_name}"
+
+    @staticmethod
+    def _parse_client(line: str):
+        part = line.strip().split(", ")
+        if len(part) != 2:
+            return None
+        client_id, client_name = part
+        return client_id, Client(client_id, client_name)
+
+
+
+class ClientSqliteRepository(SqliteRepository):
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS clients (client_id TEXT PRIMARY KEY, client_name TEXT NOT NULL)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS clients_search USING fts5(client_id, client_name, content='clients', "
+        "content_rowid='rowid', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS clients_search_insert AFTER INSERT ON clients BEGIN "
+        "INSERT INTO clients_search (rowid, client_id, client_name) VALUES (new.rowid, new.client_id, new.client_name); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS clients_search_delete AFTER DELETE ON clients BEGIN "
+        "INSERT INTO clients_search (clients_search, rowid, client_id, client_name) "
+        "VALUES ('delete', old.rowid, old.client_id, old.client_name); END",
+        "CREATE TRIGGER IF NOT EXISTS clients_search_update AFTER UPDATE ON clients BEGIN "
+        "INSERT INTO clients_search (clients_search, rowid, client_id, client_name) "
+        "VALUES ('delete', old.rowid, old.client_id, old.client_name); "
+        "INSERT INTO clients_search (rowid, client_id, client_name) VALUES (new.rowid, new.client_id, new.client_name); "
+        "END",
+    )
+    SEARCH_TABLE = "clients_search"
+
+    def __init__(self, filename: str = "clients.db"):
+        super().__init__(filename)
+
+    def get_client(self, client_id: str) -> Client:
+        row = self._query("SELECT client_id, client_name FROM clients WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None:
+            raise ClientNotFoundError(f"Client {client_id} not found")
+        return Client(*row)
+
+    def get_clients(self, client_ids) -> dict:
+        """
+        Reads the clients with one query per chunk of ids instead of one per id.
+        """
+        client_ids = list(dict.fromkeys(client_ids))
+        found = {row[0]: Client(*row)
+                 for row in self._query_in("SELECT client_id, client_name FROM clients WHERE client_id IN ({})",
+                                           client_ids)}
+        for client_id in client_ids:
+            if client_id not in found:
+                raise ClientNotFoundError(f"Client {client_id} not found")
+        return {client_id: found[client_id] for client_id in client_ids}
+
+    def find_existing(self, client_ids) -> set:
+        return {row[0] for row in self._query_in("SELECT client_id FROM clients WHERE client_id IN ({})",
+                                                 list(dict.fromkeys(client_ids)))}
+
+    def add_client(self, client: Client):
+        try:
+            self._write("INSERT INTO clients (client_id, client_name) VALUES (?, ?)",
+                        (client.get_client_id, client.get_client_name))
+        except sqlite3.IntegrityError:
+            raise DuplicateIDError("Duplicate Client ID")
+
+    def remove_client(self, client_id: str) -> Client:
+        """
+        Removes a client by id and returns the removed Client object.
+        """
+        row = self._query("SELECT client_id, client_name FROM clients WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None:
+            raise ClientNotFoundError(f"Client with id '{client_id}' not found.")
+        self._write("DELETE FROM clients WHERE client_id = ?", (client_id,))
+        return Client(*row)
+
+    def search_by_id(self, text: str) -> list[Client]:
+        return self._search("client_id", text)
+
+    def search_by_name(self, text: str) -> list[Client]:
+        return self._search("client_name", text)
+
+    def _search(self, column: str, text: str) -> list[Client]:
+        return [Client(*row) for row in self._search_rows("client_id, client_name", "clients", column, text)]
+
+    def update_client(self, client_id: str, client_name: str):
+        cursor = self._write("UPDATE clients SET client_name = ? WHERE client_id = ?", (client_name, client_id))
+        if cursor.rowcount == 0:
+            raise ClientNotFoundError(f"Client ID '{client_id}' not found.")
+
+    def display_all_clients(self) -> list[Client]:
+        return list(self)
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM clients").fetchone()[0]
+
+    def __iter__(self):
+        return (Client(*row) for row in self._query("SELECT client_id, client_name FROM clients ORDER BY rowid"))
+
+    def snapshot(self) -> list:
+        return list(self)
+
+
+class ClientRecordFileRepository(RecordFileRepository):
+    """
+    Stores the clients in a memory-mapped record file (see RecordFile); only the requested
+    client is decoded and the search indexes are built on the first search.
+    """
+    FIELD_COUNT = 2
+    RECORD_SIZE = 128
+
+    def __init__(self, filename: str = "clients.rec"):
+        super().__init__(filename)
+        self._indexed = False
+        self._id_trigrams = TrigramIndex()
+        self._name_trigrams = TrigramIndex()
+
+    @classmethod
+    def from_pickle(cls, pickle_filename: str, filename: str = "clients.rec"):
+        """
+        Converts a clients.bin file written by ClientBinaryFileRepository.
+        """
+        repo = cls(filename)
+        with open(pickle_filename, "rb") as fin:
+            for client in pickle.load(fin).values():
+                repo.add_client(client)
+        repo.flush()
+        return repo
+
+    def get_client(self, client_id: str) -> Client:
+        fields = self._records.get(client_id)
+        if fields is None:
+            raise ClientNotFoundError(f"Client {client_id} not found")
+        return Client(*fields)
+
+    def get_clients(self, client_ids) -> dict:
+        return {client_id: self.get_client(client_id) for client_id in client_ids}
+
+    def find_existing(self, client_ids) -> set:
+        return {client_id for client_id in client_ids if client_id in self._records}
+
+    def add_client(self, client: Client):
+        if client.get_client_id in self._records:
+            raise DuplicateIDError("Duplicate Client ID")
+        self._put((client.get_client_id, client.get_client_name))
+        self._index_item(client)
+
+    def remove_client(self, client_id: str) -> Client:
+        """
+        Removes a client by id and returns the removed Client object.
+        """
+        fields = self._records.get(client_id)
+        if fields is None:
+            raise ClientNotFoundError(f"Client with id '{client_id}' not found.")
+        self._delete(client_id)
+        deleted_client = Client(*fields)
+        self._unindex_item(deleted_client)
+        return deleted_client
+
+    def update_client(self, client_id: str, client_name: str):
+        if client_id not in self._records:
+            raise ClientNotFoundError(f"Client ID '{client_id}' not found.")
+        self._put((client_id, client_name))
+        self._index_item(Client(client_id, client_name))
+
+    def search_by_id(self, text: str) -> list[Client]:
+        self._build_indexes()
+        return [self.get_client(client_id) for client_id in self._id_trigrams.search(text)]
+
+    def search_by_name(self, text: str) -> list[Client]:
+        self._build_indexes()
+        return [self.get_client(client_id) for client_id in self._name_trigrams.search(text)]
+
+    def display_all_clients(self) -> list[Client]:
+        return list(self)
+
+    def __iter__(self):
+        return self._iterate(lambda fields: Client(*fields))
+
+    def _build_indexes(self):
+        if not self._indexed:
+            self._indexed = True
+            for fields in self._records.values():
+                self._index_item(Client(*fields))
+
+    def _drop_indexes(self):
+        self._indexed = False
+        self._id_trigrams.clear()
+        self._name_trigrams.clear()
+
+    def _index_item(self, client: Client):
+        if self._indexed:
+            self._id_trigrams.add(client.get_client_id, str(client.get_client_id))
+            self._name_trigrams.add(client.get_client_id, client.get_client_name)
+
+    def _unindex_item(self, client: Client):
+        if self._indexed:
+            self._id_trigrams.remove(client.get_client_id)
+            self._name_trigrams.remove(client.get_client_id)
@@ -0,0 +1,170 @@
+import os
+import threading
+
+
+DEFAULT_COMPACT_THRESHOLD = 1024 * 1024
+
+
+class JournalFile:
+    """
+    Append-only log of repository mutations kept next to a snapshot file.
+
+    The snapshot uses the same line format as the text repositories, preceded by a
+    "#journal-seq N" header that the text loaders skip. Every journal record carries a
+    sequence number and is either a full "set" of one record or a "del" of one id, so
+    replaying a record whose effect is already in the snapshot is harmless.
+    """
+    HEADER = "#journal-seq"
+
+    def __init__(self, filename: str, format_item, parse_item, snapshot_items,
+                 compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        """
+        :param filename: the snapshot file; the journal is stored in filename + ".journal"
+        :param format_item: item -> snapshot line (without the newline)
+        :param parse_item: snapshot line -> (key, item), or None for a malformed line
+        :param snapshot_items: callable returning the items currently held by the repository
+        :param compact_threshold: journal size in bytes after which a background compaction starts
+        """
+        self._filename = filename
+        self._journal_filename = filename + ".journal"
+        self._format_item = format_item
+        self._parse_item = parse_item
+        self._snapshot_items = snapshot_items
+        self._compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._size = 0
+        self._fout = None
+        self._compactor = None
+
+    def load(self) -> dict:
+        """
+        Reads the snapshot and replays the journal records that are newer than it.
+        :return: the replayed data, keyed by id
+        """
+        data = {}
+        snapshot_seq = 0
+        try:
+            with open(self._filename, "r") as fin:
+                for line in fin:
+                    line = line.rstrip("\n")
+                    if line.startswith(self.HEADER):
+                        snapshot_seq = int(line[len(self.HEADER):].strip() or 0)
+                        continue
+                    parsed = self._parse_item(line)
+                    if parsed is not None:
+                        data[parsed[0]] = parsed[1]
+        except FileNotFoundError:
+            pass
+
+        self._seq = snapshot_seq
+        self._size = 0
+        try:
+            with open(self._journal_filename, "rb") as fin:
+                for raw in fin:
+                    self._size += len(raw)
+                    part = raw.decode("utf-8").rstrip("\n").split(", ", 2)
+                    if len(part) != 3 or not part[0].isdigit():
+                        continue
+                    seq = int(part[0])
+                    self._seq = max(self._seq, seq)
+                    if seq <= snapshot_seq:
+                        continue
+                    if part[1] == "set":
+                        parsed = self._parse_item(part[2])
+                        if parsed is not None:
+                            data[parsed[0]] = parsed[1]
+                    elif part[1] == "del":
+                        data.pop(part[2], None)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def record_many(self, keys, data: dict):
+        """
+        Appends, in a single write, the current state of every key: a "set" record if it
+        is still in data, a "del" record otherwise.
+        """
+        records = [("set", self._format_item(data[key])) if key in data else ("del", str(key))
+                   for key in keys]
+        if records:
+            self.__append(records)
+
+    def compact(self, wait: bool = True):
+        """
+        Writes a fresh snapshot and drops the journal records it contains.
+        :param wait: block until the compaction has finished
+        """
+        with self._lock:
+            compactor = self._compactor or self.__start_compaction()
+        if wait:
+            compactor.join()
+
+    def close(self):
+        """
+        Waits for a running compaction and closes the journal file.
+        """
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            if self._fout is not None:
+                self._fout.close()
+                self._fout = None
+
+    def __append(self, records):
+        with self._lock:
+            lines = []
+            for op, payload in records:
+                self._seq += 1
+                lines.append(f"{self._seq}, {op}, {payload}\n")
+            record = "".join(lines).encode("utf-8")
+            if self._fout is None:
+                self._fout = open(self._journal_filename, "ab")
+            self._fout.write(record)
+            self._fout.flush()
+            self._size += len(record)
+            if self._size >= self._compact_threshold and self._compactor is None:
+                self.__start_compaction()
+
+    def __start_compaction(self):
+        """
+        Captures the current state and hands the snapshot writing to a worker thread.
+        Must be called with the lock held.
+        """
+        items = list(self._snapshot_items())
+        self._compactor = threading.Thread(target=self.__compact, args=(items, self._seq, self._size),
+                                           daemon=True)
+        self._compactor.start()
+        return self._compactor
+
+    def __compact(self, items, seq: int, offset: int):
+        """
+        Items mutated in place after the capture may already show newer state; every such
+        mutation has a journal record newer than seq, which is kept and replayed on load.
+        """
+        try:
+            tmp_filename = self._filename + ".tmp"
+            with open(tmp_filename, "w") as fout:
+                fout.write(f"{self.HEADER} {seq}\n")
+                for item in items:
+                    fout.write(self._format_item(item) + "\n")
+            os.replace(tmp_filename, self._filename)
+
+            with self._lock:
+                if self._fout is not None:
+                    self._fout.close()
+                    self._fout = None
+                tail = b""
+                if self._seq != seq:
+                    with open(self._journal_filename, "rb") as fin:
+                        fin.seek(offset)
+                        tail = fin.read()
+                tmp_journal = self._journal_filename + ".tmp"
+                with open(tmp_journal, "wb") as fout:
+                    fout.write(tail)
+                os.replace(tmp_journal, self._journal_filename)
+                self._size = len(tail)
+        finally:
+            with self._lock:
+                self._compactor = None
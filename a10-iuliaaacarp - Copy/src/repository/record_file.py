@@ -0,0 +1,327 @@
+import mmap
+import os
+import struct
+import zlib
+
+from src.repository.repository_iterator import ConcurrentModificationError
+
+
+MAGIC = b"LIBREC01"
+HEADER = struct.Struct("<8sIIIII")
+HEADER_SIZE = 32
+SLOT = struct.Struct("<I")
+FIELD_LENGTH = struct.Struct("<H")
+EMPTY_SLOT = 0
+DELETED_SLOT = 0xFFFFFFFF
+LIVE_RECORD = 1
+DEAD_RECORD = 0
+MIN_TABLE_SLOTS = 64
+MIN_CAPACITY = 16
+
+
+class RecordFileError(Exception):
+    pass
+
+
+class RecordFile:
+    """
+    Fixed-size records in a memory-mapped file, addressed through an on-disk hash table.
+
+    Layout: a 32 byte header (magic, record size, table slots, records written, live
+    records, used table slots), an open-addressing table of record numbers keyed by the
+    crc32 of the first field, then the records. A record is a live/dead flag followed by
+    its fields, each one a 2 byte length and UTF-8 text. Reading a key decodes only that
+    record and writing an existing key overwrites its slot in place; the file is only
+    rewritten when a record outgrows the slot size, the table fills up or more than half
+    of the records are dead. Records keep the order in which their keys were added.
+    """
+    def __init__(self, filename: str, field_count: int, record_size: int = 256):
+        self._filename = filename
+        self._field_count = field_count
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+            self.__write_file(filename, record_size, MIN_TABLE_SLOTS, [])
+        self._file = None
+        self._mm = None
+        self.__open()
+
+    def __len__(self):
+        return self._live_count
+
+    def __contains__(self, key):
+        return self.__find(str(key))[1] is not None
+
+    def get(self, key):
+        """
+        :return: the fields stored under key, or None
+        """
+        record_no = self.__find(str(key))[1]
+        return None if record_no is None else self.__decode(record_no)
+
+    def put(self, fields):
+        """
+        Stores fields under fields[0], overwriting the record that key already has.
+        """
+        fields = tuple(str(field) for field in fields)
+        record = self.__encode(fields)
+        if len(record) > self._record_size:
+            record_size = self._record_size
+            while record_size < len(record):
+                record_size *= 2
+            self.__rebuild(record_size, self._table_slots)
+
+        slot, record_no = self.__find(fields[0])
+        if record_no is None:
+            if (self._used_slots + 1) * 2 > self._table_slots:
+                self.__rebuild(self._record_size, self.__table_slots_for(self._live_count + 1))
+                slot, record_no = self.__find(fields[0])
+            if self._record_count == self._capacity:
+                self.__grow()
+            record_no = self._record_count
+            if SLOT.unpack_from(self._mm, HEADER_SIZE + slot * SLOT.size)[0] == EMPTY_SLOT:
+                self._used_slots += 1
+            self._record_count += 1
+            self._live_count += 1
+            self.__write_record(record_no, record)
+            SLOT.pack_into(self._mm, HEADER_SIZE + slot * SLOT.size, record_no + 1)
+            self.__write_header()
+        else:
+            self.__write_record(record_no, record)
+
+    def delete(self, key) -> bool:
+        """
+        :return: False if there was no record under key
+        """
+        slot, record_no = self.__find(str(key))
+        if record_no is None:
+            return False
+        self._mm[self.__record_offset(record_no)] = DEAD_RECORD
+        SLOT.pack_into(self._mm, HEADER_SIZE + slot * SLOT.size, DELETED_SLOT)
+        self._live_count -= 1
+        self.__write_header()
+        if self._record_count >= MIN_CAPACITY and self._live_count * 2 < self._record_count:
+            self.__rebuild(self._record_size, self.__table_slots_for(self._live_count))
+        return True
+
+    def values(self):
+        """
+        Yields the fields of every live record, in insertion order.
+        """
+        record_no = 0
+        while record_no < self._record_count:
+            if self._mm[self.__record_offset(record_no)] == LIVE_RECORD:
+                yield self.__decode(record_no)
+            record_no += 1
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+            self._mm = None
+
+    def __open(self):
+        self._file = open(self._filename, "r+b")
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        magic, self._record_size, self._table_slots, self._record_count, self._live_count, self._used_slots = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise RecordFileError(f"'{self._filename}' is not a record file")
+        self._records_offset = HEADER_SIZE + self._table_slots * SLOT.size
+        self._capacity = (len(self._mm) - self._records_offset) // self._record_size
+
+    def __write_header(self):
+        HEADER.pack_into(self._mm, 0, MAGIC, self._record_size, self._table_slots, self._record_count,
+                         self._live_count, self._used_slots)
+
+    def __record_offset(self, record_no: int) -> int:
+        return self._records_offset + record_no * self._record_size
+
+    def __find(self, key: str):
+        """
+        :return: (table slot, record number); the record number is None when key is missing
+                 and the slot is then where the key would be inserted
+        """
+        mask = self._table_slots - 1
+        slot = zlib.crc32(key.encode("utf-8")) & mask
+        free_slot = None
+        while True:
+            entry = SLOT.unpack_from(self._mm, HEADER_SIZE + slot * SLOT.size)[0]
+            if entry == EMPTY_SLOT:
+                return (slot if free_slot is None else free_slot), None
+            if entry == DELETED_SLOT:
+                if free_slot is None:
+                    free_slot = slot
+            elif self.__decode(entry - 1, 1)[0] == key:
+                return slot, entry - 1
+            slot = (slot + 1) & mask
+
+    def __encode(self, fields) -> bytes:
+        if len(fields) != self._field_count:
+            raise RecordFileError(f"Expected {self._field_count} fields, got {len(fields)}")
+        parts = [bytes((LIVE_RECORD,))]
+        for field in fields:
+            data = field.encode("utf-8")
+            parts.append(FIELD_LENGTH.pack(len(data)))
+            parts.append(data)
+        return b"".join(parts)
+
+    def __decode(self, record_no: int, field_count: int = None) -> tuple:
+        offset = self.__record_offset(record_no) + 1
+        fields = []
+        for _ in range(self._field_count if field_count is None else field_count):
+            length = FIELD_LENGTH.unpack_from(self._mm, offset)[0]
+            offset += FIELD_LENGTH.size
+            fields.append(self._mm[offset:offset + length].decode("utf-8"))
+            offset += length
+        return tuple(fields)
+
+    def __write_record(self, record_no: int, record: bytes):
+        offset = self.__record_offset(record_no)
+        self._mm[offset:offset + len(record)] = record
+
+    def __grow(self):
+        """
+        Doubles the room for records at the end of the file; nothing is moved.
+        """
+        self._mm.close()
+        self._file.truncate(self._records_offset + self._capacity * 2 * self._record_size)
+        self._file.close()
+        self.__open()
+
+    def __rebuild(self, record_size: int, table_slots: int):
+        """
+        Rewrites the file with the live records only, in their order.
+        """
+        records = [self.__encode(fields) for fields in self.values()]
+        self.close()
+        self.__write_file(self._filename, record_size, table_slots, records)
+        self.__open()
+
+    @staticmethod
+    def __table_slots_for(count: int) -> int:
+        table_slots = MIN_TABLE_SLOTS
+        while table_slots < count * 4:
+            table_slots *= 2
+        return table_slots
+
+    @staticmethod
+    def __write_file(filename: str, record_size: int, table_slots: int, records: list):
+        capacity = max(MIN_CAPACITY, len(records) * 2)
+        table = bytearray(table_slots * SLOT.size)
+        mask = table_slots - 1
+        body = bytearray(capacity * record_size)
+        for record_no, record in enumerate(records):
+            key_length = FIELD_LENGTH.unpack_from(record, 1)[0]
+            key = record[1 + FIELD_LENGTH.size:1 + FIELD_LENGTH.size + key_length]
+            slot = zlib.crc32(key) & mask
+            while SLOT.unpack_from(table, slot * SLOT.size)[0] != EMPTY_SLOT:
+                slot = (slot + 1) & mask
+            SLOT.pack_into(table, slot * SLOT.size, record_no + 1)
+            body[record_no * record_size:record_no * record_size + len(record)] = record
+
+        header = bytearray(HEADER_SIZE)
+        HEADER.pack_into(header, 0, MAGIC, record_size, table_slots, len(records), len(records), len(records))
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as fout:
+            fout.write(header)
+            fout.write(table)
+            fout.write(body)
+        os.replace(tmp_filename, filename)
+
+
+class RecordFileRepository:
+    """
+    Unit of work handling shared by the memory-mapped repositories.
+
+    Writes go straight to the mapped file. Inside a unit of work the first state of every
+    touched key is remembered, so rollback() can write it back; flush() syncs the mapping.
+    Secondary indexes are built on first use, so opening a repository reads only the header.
+    """
+    FIELD_COUNT = 0
+    RECORD_SIZE = 256
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._records = RecordFile(filename, self.FIELD_COUNT, self.RECORD_SIZE)
+        self._version = 0
+        self.__depth = 0
+        self.__rollback_log = None
+
+    def begin(self):
+        if self.__depth == 0:
+            self.__rollback_log = {}
+        self.__depth += 1
+
+    def end(self) -> bool:
+        self.__depth -= 1
+        return self.__depth == 0
+
+    def flush(self):
+        self._records.flush()
+
+    def commit(self):
+        self.__rollback_log = None
+
+    def rollback(self):
+        log = self.__rollback_log or {}
+        self.__rollback_log = None
+        for key, fields in log.items():
+            if fields is None:
+                self._records.delete(key)
+            else:
+                self._records.put(fields)
+        if log:
+            self._version += 1
+            self._drop_indexes()
+
+    def in_unit_of_work(self) -> bool:
+        return self.__depth > 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def close(self):
+        self._records.close()
+
+    def __len__(self):
+        return len(self._records)
+
+    def snapshot(self) -> list:
+        return list(self)
+
+    def _put(self, fields):
+        self._remember(fields[0])
+        self._records.put(fields)
+
+    def _delete(self, key):
+        self._remember(key)
+        self._records.delete(key)
+
+    def _remember(self, key):
+        self._version += 1
+        key = str(key)
+        if self.__rollback_log is not None and key not in self.__rollback_log:
+            self.__rollback_log[key] = self._records.get(key)
+
+    def _iterate(self, to_item):
+        """
+        Decodes the records one at a time; a mutation made during the loop raises
+        ConcurrentModificationError, like the dictionary repositories do.
+        """
+        version = self._version
+        records = self._records.values()
+        while True:
+            if self._version != version:
+                raise ConcurrentModificationError("Repository changed during iteration")
+            fields = next(records, None)
+            if fields is None:
+                return
+            yield to_item(fields)
+
+    def _drop_indexes(self):
+        pass
@@ -0,0 +1,167 @@
+from array import array
+from collections import namedtuple
+from datetime import date
+
+from src.domain.rental_domain import Rental
+
+
+RentalColumnSet = namedtuple("RentalColumnSet", "rental_ids book_codes client_codes rented returned book_ids client_ids")
+
+NOT_RETURNED = -1
+EMPTY_DATE = 0
+RAW_DATE = -2
+
+
+class RentalColumns:
+    """
+    Dictionary-like rental storage kept as parallel columns instead of Rental objects.
+
+    Book and client ids are interned into integer codes and dates are stored as day
+    ordinals; "Not returned" and "" keep their own sentinels so every rental reads back
+    exactly as it was stored. Deleted rows are tombstoned and compacted later, which keeps
+    the insertion order a dict would have.
+    """
+    def __init__(self, rentals=()):
+        self._rental_ids = []
+        self._rows = {}
+        self._alive = bytearray()
+        self._book_codes = array("l")
+        self._client_codes = array("l")
+        self._rented = array("l")
+        self._returned = array("l")
+        self._book_ids = []
+        self._book_lookup = {}
+        self._client_ids = []
+        self._client_lookup = {}
+        self._raw_dates = {}
+        for rental in rentals:
+            self[rental.get_rental_id] = rental
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, rental_id):
+        return rental_id in self._rows
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, rental_id) -> Rental:
+        return self._rental_at(self._rows[rental_id])
+
+    def __setitem__(self, rental_id, rental: Rental):
+        book_code = self.__intern(rental.get_book_id, self._book_ids, self._book_lookup)
+        client_code = self.__intern(rental.get_client_id, self._client_ids, self._client_lookup)
+        row = self._rows.get(rental_id)
+        if row is None:
+            row = len(self._rental_ids)
+            self._rows[rental_id] = row
+            self._rental_ids.append(rental_id)
+            self._alive.append(1)
+            self._book_codes.append(book_code)
+            self._client_codes.append(client_code)
+            self._rented.append(0)
+            self._returned.append(0)
+        else:
+            self._book_codes[row] = book_code
+            self._client_codes[row] = client_code
+        self.__drop_raw_dates(row)
+        self._rented[row] = self.__encode_date(row, 0, rental.get_rented_date)
+        self._returned[row] = self.__encode_date(row, 1, rental.get_returned_date)
+
+    def __delitem__(self, rental_id):
+        row = self._rows.pop(rental_id)
+        self._alive[row] = 0
+        self.__drop_raw_dates(row)
+        if len(self._rows) * 2 < len(self._rental_ids):
+            self.compact()
+
+    def get(self, rental_id, default=None):
+        row = self._rows.get(rental_id)
+        return default if row is None else self._rental_at(row)
+
+    def pop(self, rental_id, *default):
+        if rental_id not in self._rows:
+            if default:
+                return default[0]
+            raise KeyError(rental_id)
+        rental = self[rental_id]
+        del self[rental_id]
+        return rental
+
+    def keys(self):
+        return [rental_id for row, rental_id in enumerate(self._rental_ids) if self._alive[row]]
+
+    def values(self):
+        for row in range(len(self._rental_ids)):
+            if self._alive[row]:
+                yield self._rental_at(row)
+
+    def items(self):
+        for rental in self.values():
+            yield rental.get_rental_id, rental
+
+    def compact(self):
+        """
+        Drops the tombstoned rows, keeping the order of the live ones.
+        """
+        live = [row for row in range(len(self._rental_ids)) if self._alive[row]]
+        if len(live) == len(self._rental_ids):
+            return
+        self._rental_ids = [self._rental_ids[row] for row in live]
+        self._rows = {rental_id: row for row, rental_id in enumerate(self._rental_ids)}
+        self._alive = bytearray(b"\x01" * len(live))
+        for name in ("_book_codes", "_client_codes", "_rented", "_returned"):
+            column = getattr(self, name)
+            setattr(self, name, array("l", (column[row] for row in live)))
+        new_rows = {old: new for new, old in enumerate(live)}
+        self._raw_dates = {(new_rows[row], field): value for (row, field), value in self._raw_dates.items()}
+
+    def column_set(self) -> RentalColumnSet:
+        """
+        :return: the compacted columns; one entry per live rental, in insertion order
+        """
+        self.compact()
+        return RentalColumnSet(self._rental_ids, self._book_codes, self._client_codes, self._rented, self._returned,
+                               self._book_ids, self._client_ids)
+
+    def _rental_at(self, row: int) -> Rental:
+        return Rental(self._rental_ids[row], self._book_ids[self._book_codes[row]],
+                      self._client_ids[self._client_codes[row]],
+                      self.__decode_date(row, 0, self._rented[row]), self.__decode_date(row, 1, self._returned[row]))
+
+    @staticmethod
+    def __intern(value, values: list, lookup: dict) -> int:
+        code = lookup.get(value)
+        if code is None:
+            code = len(values)
+            lookup[value] = code
+            values.append(value)
+        return code
+
+    def __encode_date(self, row: int, field: int, value: str) -> int:
+        if value == "":
+            return EMPTY_DATE
+        if value == "Not returned":
+            return NOT_RETURNED
+        try:
+            ordinal = date.fromisoformat(value).toordinal()
+            if date.fromordinal(ordinal).isoformat() == value:
+                return ordinal
+        except (TypeError, ValueError):
+            pass
+        self._raw_dates[(row, field)] = value
+        return RAW_DATE
+
+    def __drop_raw_dates(self, row: int):
+        self._raw_dates.pop((row, 0), None)
+        self._raw_dates.pop((row, 1), None)
+
+    def __decode_date(self, row: int, field: int, ordinal: int):
+        if ordinal > 0:
+            return date.fromordinal(ordinal).isoformat()
+        if ordinal == EMPTY_DATE:
+            return ""
+        if ordinal == NOT_RETURNED:
+            return "Not returned"
+        return self._raw_dates[(row, field)]
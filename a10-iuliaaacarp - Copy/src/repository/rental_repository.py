@@ -1,5 +1,11 @@
 import pickle
 from src.domain.rental_domain import Rental
+from src.repository.journal import JournalFile, DEFAULT_COMPACT_THRESHOLD
+from src.repository.unit_of_work import TransactionalRepository
+from src.repository.repository_iterator import RepositoryIterator
+from src.repository.sqlite_repository import SqliteRepository
+from src.repository.rental_columns import RentalColumns, RentalColumnSet
+from src.repository.record_file import RecordFileRepository
 
 class RentalError(Exception):
     pass
@@ -10,52 +16,110 @@ class DuplicateIDError(RentalError):
 class RentalNotFoundError(RentalError):
     pass
 
-class RepositoryIterator:
-    def __init__(self, elements):
-        self._elements = elements
-        self.__pos = -1
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        self.__pos += 1
-        if self.__pos == len(self._elements):
-            raise StopIteration()
-        return self._elements[self.__pos]
-
-class RentalMemoryRepository:
+class RentalMemoryRepository(TransactionalRepository):
     def __init__(self):
-        self._data = {}
+        super().__init__()
+        self._book_index = {}
+        self._client_index = {}
 
     def add_rental(self, rental: Rental):
         if rental.get_rental_id in self._data:
             raise DuplicateIDError("Duplicate Rental ID")
-        for r in self._data.values():
-            if r.get_book_id == rental.get_book_id:
-                raise DuplicateIDError("Book is already rented")
+        if rental.get_book_id in self._book_index:
+            raise DuplicateIDError("Book is already rented")
+        self._remember(rental.get_rental_id)
         self._data[rental.get_rental_id] = rental
+        self._index_item(rental)
+
+    def get_rental(self, rental_id) -> Rental:
+        if rental_id not in self._data:
+            raise RentalNotFoundError("Rental ID not found")
+        return self._data[rental_id]
 
     def return_book(self, rental_id):
         if rental_id in self._data:
-            del self._data[rental_id]
+            self._remember(rental_id)
+            self._unindex_item(self._data.pop(rental_id))
 
     def remove_rental(self, rental_id):
         if rental_id not in self._data:
             raise RentalNotFoundError("Rental ID not found")
-        del self._data[rental_id]
+        self._remember(rental_id)
+        self._unindex_item(self._data.pop(rental_id))
+
+    def get_rentals_for_book(self, book_id) -> list[Rental]:
+        return list(self._book_index.get(book_id, {}).values())
+
+    def get_rentals_for_client(self, client_id) -> list[Rental]:
+        return list(self._client_index.get(client_id, {}).values())
+
+    def _clear_indexes(self):
+        self._book_index = {}
+        self._client_index = {}
+
+    def _index_item(self, rental: Rental):
+        self._book_index.setdefault(rental.get_book_id, {})[rental.get_rental_id] = rental
+        self._client_index.setdefault(rental.get_client_id, {})[rental.get_rental_id] = rental
+
+    def _unindex_item(self, rental: Rental):
+        for index, key in ((self._book_index, rental.get_book_id), (self._client_index, rental.get_client_id)):
+            rentals = index[key]
+            del rentals[rental.get_rental_id]
+            if not rentals:
+                del index[key]
 
     def reset_returned_date(self, rental_id, original_date):
         if rental_id not in self._data:
             raise RentalNotFoundError("Rental ID not found")
 
-        self._data[rental_id].returned_date = original_date
+        self._remember(rental_id)
+        self._data[rental_id].get_returned_date = original_date
+
+    def _restore_item(self, item: Rental, saved: Rental):
+        item.get_returned_date = saved.get_returned_date
 
     def __len__(self):
         return len(self._data)
 
     def __iter__(self):
-        return RepositoryIterator(list(self._data.values()))
+        return RepositoryIterator(self)
+
+    def snapshot(self) -> list:
+        """
+        :return: a copy of the stored objects, for loops that mutate the repository
+        """
+        return list(self._data.values())
+
+class RentalColumnarRepository(RentalMemoryRepository):
+    """
+    In-memory rental repository that keeps the rentals as interned-id and day-ordinal
+    columns and only builds Rental objects when they are read.
+    """
+    def __init__(self):
+        super().__init__()
+        self._data = RentalColumns()
+
+    def reset_returned_date(self, rental_id, original_date):
+        if rental_id not in self._data:
+            raise RentalNotFoundError("Rental ID not found")
+
+        self._remember(rental_id)
+        rental = self._data[rental_id]
+        rental.get_returned_date = original_date
+        self._data[rental_id] = rental
+
+    def get_rentals_for_book(self, book_id) -> list[Rental]:
+        return [self._data[rental_id] for rental_id in self._book_index.get(book_id, {})]
+
+    def get_rentals_for_client(self, client_id) -> list[Rental]:
+        return [self._data[rental_id] for rental_id in self._client_index.get(client_id, {})]
+
+    def rental_columns(self) -> RentalColumnSet:
+        return self._data.column_set()
+
+    def _index_item(self, rental: Rental):
+        self._book_index.setdefault(rental.get_book_id, {})[rental.get_rental_id] = None
+        self._client_index.setdefault(rental.get_client_id, {})[rental.get_rental_id] = None
 
 class RentalBinaryFileRepository(RentalMemoryRepository):
     def __init__(self, filename="rentals.bin"):
@@ -65,25 +129,33 @@ class RentalBinaryFileRepository(RentalMemoryRepository):
 
     def add_rental(self, rental: Rental):
         super().add_rental(rental)
-        self.__save_file()
+        self._save()
 
     def return_book(self, rental_id):
         super().return_book(rental_id)
-        self.__save_file()
+        self._save()
+
+    def remove_rental(self, rental_id):
+        super().remove_rental(rental_id)
+        self._save()
 
-    def __save_file(self):
+    def _save(self):
         try:
-            with open(self._filename, "wb") as f:
-                pickle.dump(self._data, f)
+            super()._save()
         except Exception:
             pass
 
+    def _flush(self):
+        with open(self._filename, "wb") as f:
+            pickle.dump(self._data, f)
+
     def __load_file(self):
         try:
             with open(self._filename, "rb") as f:
                 self._data = pickle.load(f)
         except FileNotFoundError:
             self._data = {}
+        self._rebuild_indexes()
 
 class RentalTextFileRepository(RentalMemoryRepository):
     def __init__(self, filename="rentals.txt"):
@@ -93,11 +165,15 @@ class RentalTextFileRepository(RentalMemoryRepository):
 
     def add_rental(self, rental: Rental):
         super().add_rental(rental)
-        self.__save_file()
+        self._save()
 
     def return_book(self, rental_id):
         super().return_book(rental_id)
-        self.__save_file()
+        self._save()
+
+    def remove_rental(self, rental_id):
+        super().remove_rental(rental_id)
+        self._save()
 
     def __load_file(self):
         try:
@@ -111,8 +187,229 @@ class RentalTextFileRepository(RentalMemoryRepository):
                     self._data[rental_id] = Rental(rental_id, book_id, client_id, rented_date, returned_date)
         except FileNotFoundError:
             self._data = {}
+        self._rebuild_indexes()
 
-    def __save_file(self):
+    def _flush(self):
         with open(self._filename, "w") as f:
             for rental in self._data.values():
                 f.write(f"{rental.get_rental_id}, {rental.get_book_id}, {rental.get_client_id}, {rental.get_rented_date}, {rental.get_returned_date}\n")
+
+class RentalJournalFileRepository(RentalMemoryRepository):
+    """
+    Keeps rentals.txt as a snapshot and appends one journal record per mutation instead of
+    rewriting the whole file.
+    """
+    def __init__(self, filename="rentals.txt", compact_threshold=DEFAULT_COMPACT_THRESHOLD):
+        super().__init__()
+        self._filename = filename
+        self._journal = JournalFile(filename, self._format_rental, self._parse_rental,
+                                    lambda: self._data.values(), compact_threshold)
+        self._data = self._journal.load()
+        self._rebuild_indexes()
+        self._pending = {}
+
+    def add_rental(self, rental: Rental):
+        super().add_rental(rental)
+        self._record(rental.get_rental_id)
+
+    def return_book(self, rental_id):
+        if rental_id in self._data:
+            super().return_book(rental_id)
+            self._record(rental_id)
+
+    def remove_rental(self, rental_id):
+        super().remove_rental(rental_id)
+        self._record(rental_id)
+
+    def _record(self, rental_id):
+        self._pending[rental_id] = None
+        self._save()
+
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._journal.record_many(pending, self._data)
+
+    def _resync(self, keys):
+        self._pending.update(dict.fromkeys(keys))
+        self._flush()
+
+    def rollback(self):
+        self._pending = {}
+        super().rollback()
+
+    def compact(self):
+        self._journal.compact()
+
+    def close(self):
+        self._journal.close()
+
+    @staticmethod
+    def _format_rental(rental: Rental) -> str:
+        return f"{rental.get_rental_id}, {rental.get_book_id}, {rental.get_client_id}, {rental.get_rented_date}, {rental.get_returned_date}"
+
+    @staticmethod
+    def _parse_rental(line: str):
+        parts = line.strip().split(", ")
+        if len(parts) != 5:
+            return None
+        rental_id, book_id, client_id, rented_date, returned_date = parts
+        return rental_id, Rental(rental_id, book_id, client_id, rented_date, returned_date)
+
+class RentalSqliteRepository(SqliteRepository):
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS rentals (rental_id TEXT PRIMARY KEY, book_id TEXT NOT NULL, "
+        "client_id TEXT NOT NULL, rented_date TEXT NOT NULL, returned_date TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS rentals_book_id ON rentals (book_id)",
+        "CREATE INDEX IF NOT EXISTS rentals_client_id ON rentals (client_id)",
+    )
+    COLUMNS = "rental_id, book_id, client_id, rented_date, returned_date"
+
+    def __init__(self, filename="rentals.db"):
+        super().__init__(filename)
+
+    def get_rental(self, rental_id):
+        row = self._query(f"SELECT {self.COLUMNS} FROM rentals WHERE rental_id = ?", (rental_id,)).fetchone()
+        if row is None:
+            raise RentalNotFoundError("Rental ID not found")
+        return Rental(*row)
+
+    def add_rental(self, rental: Rental):
+        if self._query("SELECT 1 FROM rentals WHERE rental_id = ?", (rental.get_rental_id,)).fetchone():
+            raise DuplicateIDError("Duplicate Rental ID")
+        if self._query("SELECT 1 FROM rentals WHERE book_id = ? LIMIT 1", (rental.get_book_id,)).fetchone():
+            raise DuplicateIDError("Book is already rented")
+        self._write(f"INSERT INTO rentals ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                    (rental.get_rental_id, rental.get_book_id, rental.get_client_id,
+                     rental.get_rented_date, rental.get_returned_date))
+
+    def return_book(self, rental_id):
+        self._write("DELETE FROM rentals WHERE rental_id = ?", (rental_id,))
+
+    def get_rentals_for_book(self, book_id) -> list[Rental]:
+        rows = self._query(f"SELECT {self.COLUMNS} FROM rentals WHERE book_id = ? ORDER BY rowid", (book_id,))
+        return [Rental(*row) for row in rows.fetchall()]
+
+    def get_rentals_for_client(self, client_id) -> list[Rental]:
+        rows = self._query(f"SELECT {self.COLUMNS} FROM rentals WHERE client_id = ? ORDER BY rowid", (client_id,))
+        return [Rental(*row) for row in rows.fetchall()]
+
+    def remove_rental(self, rental_id):
+        cursor = self._write("DELETE FROM rentals WHERE rental_id = ?", (rental_id,))
+        if cursor.rowcount == 0:
+            raise RentalNotFoundError("Rental ID not found")
+
+    def reset_returned_date(self, rental_id, original_date):
+        cursor = self._write("UPDATE rentals SET returned_date = ? WHERE rental_id = ?", (original_date, rental_id))
+        if cursor.rowcount == 0:
+            raise RentalNotFoundError("Rental ID not found")
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM rentals").fetchone()[0]
+
+    def __iter__(self):
+        return (Rental(*row) for row in self._query(f"SELECT {self.COLUMNS} FROM rentals ORDER BY rowid"))
+
+    def snapshot(self) -> list:
+        return list(self)
+
+class RentalRecordFileRepository(RecordFileRepository):
+    """
+    Stores the rentals in a memory-mapped record file (see RecordFile). The book and client
+    indexes hold rental ids only and are built the first time they are needed.
+    """
+    FIELD_COUNT = 5
+    RECORD_SIZE = 128
+
+    def __init__(self, filename="rentals.rec"):
+        super().__init__(filename)
+        self._book_index = None
+        self._client_index = None
+
+    @classmethod
+    def from_pickle(cls, pickle_filename, filename="rentals.rec"):
+        """
+        Converts a rentals.bin file written by RentalBinaryFileRepository.
+        """
+        repo = cls(filename)
+        with open(pickle_filename, "rb") as f:
+            for rental in pickle.load(f).values():
+                repo._put(repo._to_fields(rental))
+        repo.flush()
+        return repo
+
+    def get_rental(self, rental_id):
+        fields = self._records.get(rental_id)
+        if fields is None:
+            raise RentalNotFoundError("Rental ID not found")
+        return Rental(*fields)
+
+    def add_rental(self, rental: Rental):
+        if rental.get_rental_id in self._records:
+            raise DuplicateIDError("Duplicate Rental ID")
+        if str(rental.get_book_id) in self._indexes()[0]:
+            raise DuplicateIDError("Book is already rented")
+        fields = self._to_fields(rental)
+        self._put(fields)
+        self._index_item(Rental(*fields))
+
+    def return_book(self, rental_id):
+        fields = self._records.get(rental_id)
+        if fields is not None:
+            self._delete(rental_id)
+            self._unindex_item(Rental(*fields))
+
+    def remove_rental(self, rental_id):
+        fields = self._records.get(rental_id)
+        if fields is None:
+            raise RentalNotFoundError("Rental ID not found")
+        self._delete(rental_id)
+        self._unindex_item(Rental(*fields))
+
+    def reset_returned_date(self, rental_id, original_date):
+        fields = self._records.get(rental_id)
+        if fields is None:
+            raise RentalNotFoundError("Rental ID not found")
+        self._put(fields[:4] + (original_date,))
+
+    def get_rentals_for_book(self, book_id) -> list[Rental]:
+        return [self.get_rental(rental_id) for rental_id in self._indexes()[0].get(str(book_id), {})]
+
+    def get_rentals_for_client(self, client_id) -> list[Rental]:
+        return [self.get_rental(rental_id) for rental_id in self._indexes()[1].get(str(client_id), {})]
+
+    def __iter__(self):
+        return self._iterate(lambda fields: Rental(*fields))
+
+    def _indexes(self):
+        """
+        :return: (book index, client index), after building them from the file if needed
+        """
+        if self._book_index is None:
+            self._book_index = {}
+            self._client_index = {}
+            for fields in self._records.values():
+                self._index_item(Rental(*fields))
+        return self._book_index, self._client_index
+
+    def _drop_indexes(self):
+        self._book_index = None
+        self._client_index = None
+
+    def _index_item(self, rental: Rental):
+        if self._book_index is not None:
+            self._book_index.setdefault(rental.get_book_id, {})[rental.get_rental_id] = None
+            self._client_index.setdefault(rental.get_client_id, {})[rental.get_rental_id] = None
+
+    def _unindex_item(self, rental: Rental):
+        if self._book_index is None:
+            return
+        for index, key in ((self._book_index, rental.get_book_id), (self._client_index, rental.get_client_id)):
+            rentals = index[key]
+            del rentals[rental.get_rental_id]
+            if not rentals:
+                del index[key]
+
+    @staticmethod
+    def _to_fields(rental: Rental) -> tuple:
+        return tuple(str(value) for value in (rental.get_rental_id, rental.get_book_id, rental.get_client_id,
+                                               rental.get_rented_date, rental.get_returned_date))
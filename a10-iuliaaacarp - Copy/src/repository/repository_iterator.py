@@ -0,0 +1,22 @@
+class ConcurrentModificationError(RuntimeError):
+    pass
+
+
+class RepositoryIterator:
+    """
+    Walks a repository's dictionary in place instead of copying it first. The repository
+    version is checked on every step, so a mutation made while the loop is running raises
+    ConcurrentModificationError; loop over repository.snapshot() when that is intended.
+    """
+    def __init__(self, repository):
+        self._repository = repository
+        self._version = repository.version
+        self._values = iter(repository._data.values())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._repository.version != self._version:
+            raise ConcurrentModificationError("Repository changed during iteration")
+        return next(self._values)
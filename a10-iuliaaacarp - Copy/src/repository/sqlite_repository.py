@@ -0,0 +1,98 @@
+import sqlite3
+
+
+class SqliteRepository:
+    """
+    Connection handling shared by the SQLite repositories.
+
+    Outside a unit of work every write is its own transaction. Inside one, writes stay in
+    the open transaction, which is committed once by flush() or discarded by rollback().
+
+    A subclass with searchable columns names an FTS5 table with the trigram tokenizer in
+    SEARCH_TABLE and creates it, and the triggers that keep it in sync, in SCHEMA. The table
+    is filled from the existing rows when a database is opened that does not have it yet.
+    """
+    SCHEMA = ()
+    SEARCH_TABLE = None
+    MAX_PARAMETERS = 500
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._connection = sqlite3.connect(filename)
+        self._connection.create_function("py_lower", 1, lambda text: str(text).lower(), deterministic=True)
+        self._version = 0
+        self.__depth = 0
+        with self._connection:
+            indexed = self.SEARCH_TABLE is None or self._query(
+                "SELECT 1 FROM sqlite_master WHERE name = ?", (self.SEARCH_TABLE,)).fetchone() is not None
+            for statement in self.SCHEMA:
+                self._connection.execute(statement)
+            if not indexed:
+                self._connection.execute(f"INSERT INTO {self.SEARCH_TABLE} ({self.SEARCH_TABLE}) VALUES ('rebuild')")
+
+    def begin(self):
+        self.__depth += 1
+
+    def end(self) -> bool:
+        self.__depth -= 1
+        return self.__depth == 0
+
+    def flush(self):
+        self._connection.commit()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self._connection.rollback()
+        self._version += 1
+
+    def in_unit_of_work(self) -> bool:
+        return self.__depth > 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def close(self):
+        self._connection.close()
+
+    def _query(self, sql: str, params=()):
+        return self._connection.execute(sql, params)
+
+    def _query_in(self, sql: str, keys: list) -> list:
+        """
+        Runs sql, whose "IN ({})" is filled with one placeholder per key, in chunks that stay
+        under SQLite's limit on parameters.
+        :return: the rows of every chunk
+        """
+        rows = []
+        for start in range(0, len(keys), self.MAX_PARAMETERS):
+            chunk = keys[start:start + self.MAX_PARAMETERS]
+            rows.extend(self._query(sql.format(", ".join("?" * len(chunk))), chunk))
+        return rows
+
+    def _search_rows(self, columns: str, table: str, column: str, text: str) -> list:
+        """
+        :return: the columns of the rows whose column contains text, ignoring case, in rowid
+                 order. For text of three or more characters the trigram table yields the
+                 candidates and only they are checked; shorter text scans the table.
+        """
+        text = str(text).lower()
+        if len(text) < 3:
+            return self._query(f"SELECT {columns} FROM {table} WHERE instr(py_lower({column}), ?) > 0 ORDER BY rowid",
+                               (text,)).fetchall()
+        phrase = '"' + text.replace('"', '""') + '"'
+        return self._query(f"SELECT {columns} FROM {table} WHERE rowid IN "
+                           f"(SELECT rowid FROM {self.SEARCH_TABLE} WHERE {column} MATCH ?) "
+                           f"AND instr(py_lower({column}), ?) > 0 ORDER BY rowid", (phrase, text)).fetchall()
+
+    def _write(self, sql: str, params=()):
+        """
+        Runs a single-row statement, committing it right away unless a unit of work is open.
+        """
+        self._version += 1
+        if self.__depth > 0:
+            return self._connection.execute(sql, params)
+        with self._connection:
+            return self._connection.execute(sql, params)
@@ -0,0 +1,76 @@
+class TrigramIndex:
+    """
+    Inverted index from lowercase trigrams to the keys whose text contains them.
+
+    A query of three or more characters intersects the posting lists of its trigrams,
+    smallest first, and then verifies each candidate with a plain substring test, so the
+    answer is exactly the keys whose text contains the query, ignoring case.
+    """
+    def __init__(self):
+        self._postings = {}
+        self._texts = {}
+        self._order = {}
+        self._next_order = 0
+
+    @staticmethod
+    def trigrams(text: str) -> set:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, key, text: str):
+        """
+        Indexes text under key, replacing what key had before; a key keeps its original
+        position in the results.
+        """
+        if key in self._texts:
+            self.__drop_postings(key)
+        else:
+            self._order[key] = self._next_order
+            self._next_order += 1
+        text = str(text).lower()
+        self._texts[key] = text
+        for trigram in self.trigrams(text):
+            self._postings.setdefault(trigram, set()).add(key)
+
+    def remove(self, key):
+        if key not in self._texts:
+            return
+        self.__drop_postings(key)
+        del self._texts[key]
+        del self._order[key]
+
+    def clear(self):
+        self._postings = {}
+        self._texts = {}
+        self._order = {}
+        self._next_order = 0
+
+    def search(self, query: str) -> list:
+        """
+        :return: the keys whose text contains query, in the order they were first added
+        """
+        query = str(query).lower()
+        if len(query) < 3:
+            matches = [key for key, text in self._texts.items() if query in text]
+        else:
+            postings = []
+            for trigram in self.trigrams(query):
+                keys = self._postings.get(trigram)
+                if not keys:
+                    return []
+                postings.append(keys)
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for keys in postings[1:]:
+                candidates &= keys
+                if not candidates:
+                    return []
+            matches = [key for key in candidates if query in self._texts[key]]
+        matches.sort(key=self._order.__getitem__)
+        return matches
+
+    def __drop_postings(self, key):
+        for trigram in self.trigrams(self._texts[key]):
+            keys = self._postings[trigram]
+            keys.discard(key)
+            if not keys:
+                del self._postings[trigram]
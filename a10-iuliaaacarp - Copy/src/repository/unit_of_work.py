@@ -0,0 +1,170 @@
+import copy
+
+
+class TransactionalRepository:
+    """
+    Deferred saving and in-memory rollback shared by the dictionary based repositories.
+
+    Outside a unit of work every mutation is saved right away. Inside one, mutations only
+    mark the repository dirty and remember the first state of every touched key, so the
+    file is written once at commit and the memory can be restored if anything fails.
+    """
+    def __init__(self):
+        self._data = {}
+        self._version = 0
+        self.__depth = 0
+        self.__rollback_log = None
+        self.__dirty = False
+        self.__flushed = False
+
+    def begin(self):
+        """
+        Starts a unit of work, or joins the one that is already open.
+        """
+        if self.__depth == 0:
+            self.__rollback_log = {}
+            self.__dirty = False
+            self.__flushed = False
+        self.__depth += 1
+
+    def end(self) -> bool:
+        """
+        Leaves the unit of work.
+        :return: True if this was the outermost level, which has to commit or roll back
+        """
+        self.__depth -= 1
+        return self.__depth == 0
+
+    def flush(self):
+        """
+        Writes the deferred changes, once.
+        """
+        if self.__dirty:
+            self.__flushed = True
+            self._flush()
+            self.__dirty = False
+
+    def commit(self):
+        self.__rollback_log = None
+        self.__dirty = False
+        self.__flushed = False
+
+    def rollback(self):
+        """
+        Restores every key touched during the unit of work. If the changes were already
+        flushed, the storage is brought back in line with the restored state.
+        """
+        log = self.__rollback_log or {}
+        for key, (item, saved) in log.items():
+            current = self._data.get(key)
+            if current is not None:
+                self._unindex_item(current)
+            if item is None:
+                self._data.pop(key, None)
+            else:
+                self._restore_item(item, saved)
+                self._data[key] = item
+                self._index_item(item)
+        if log:
+            self._version += 1
+        if self.__flushed:
+            self._resync(list(log))
+        self.commit()
+
+    def in_unit_of_work(self) -> bool:
+        return self.__depth > 0
+
+    @property
+    def version(self) -> int:
+        """
+        :return: a counter that grows with every mutation of the repository
+        """
+        return self._version
+
+    def _remember(self, key):
+        """
+        Called before every mutation of key: bumps the version and, inside a unit of work,
+        keeps the state the key had when the unit began.
+        """
+        self._version += 1
+        if self.__rollback_log is None or key in self.__rollback_log:
+            return
+        item = self._data.get(key)
+        self.__rollback_log[key] = (item, copy.copy(item))
+
+    def _restore_item(self, item, saved):
+        """
+        Copies back the fields that the repository mutates in place.
+        """
+        pass
+
+    def _rebuild_indexes(self):
+        """
+        Recomputes the secondary indexes from _data, after a file was loaded.
+        """
+        self._version += 1
+        self._clear_indexes()
+        for item in self._data.values():
+            self._index_item(item)
+
+    def _clear_indexes(self):
+        pass
+
+    def _index_item(self, item):
+        pass
+
+    def _unindex_item(self, item):
+        pass
+
+    def _save(self):
+        if self.__depth > 0:
+            self.__dirty = True
+        else:
+            self._flush()
+
+    def _flush(self):
+        """
+        Persists the repository; the in-memory repositories have nothing to write.
+        """
+        pass
+
+    def _resync(self, keys):
+        self._flush()
+
+
+class UnitOfWork:
+    """
+    Groups mutations over several repositories so that each touched file is written once.
+
+    with UnitOfWork(book_repo, rental_repo):
+        ...
+    """
+    def __init__(self, *repositories):
+        self._repositories = []
+        for repo in repositories:
+            if repo is not None and all(repo is not other for other in self._repositories):
+                self._repositories.append(repo)
+
+    def __enter__(self):
+        for repo in self._repositories:
+            repo.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        finishing = [repo for repo in self._repositories if repo.end()]
+        if exc_type is not None:
+            for repo in finishing:
+                repo.rollback()
+            return False
+
+        try:
+            for repo in finishing:
+                repo.flush()
+        except Exception:
+            for repo in finishing:
+                repo.rollback()
+            raise
+
+        for repo in finishing:
+            repo.commit()
+        return False
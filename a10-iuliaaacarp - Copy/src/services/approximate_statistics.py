@@ -0,0 +1,101 @@
+import math
+
+from src.repository.book_repository import BookNotFoundError
+from src.services.sketches import CountMinSketch, SpaceSaving, HyperLogLog
+
+
+DEFAULT_EPSILON = 0.001
+DEFAULT_DELTA = 0.01
+DEFAULT_PRECISION = 12
+
+
+class ApproximateRentalStatistics:
+    """
+    Most rented books and authors, and the number of distinct clients, kept in sketches of
+    a fixed size whatever the number of rentals.
+
+    The sketches are filled from get_all_rentals() once and then follow the events of
+    RentalService: every rented book is added, and removed rentals are taken back so the
+    estimates track the same rentals as the exact statistics. A removed rental is taken back
+    from the author its book has at that moment, looked up like on add, so nothing is kept
+    per rental; rentals are always removed before their book. The distinct client count
+    only grows, since a HyperLogLog cannot forget a client.
+
+    Results are (key, estimate, error) triples: the estimate is never below the true count
+    and exceeds it by at most error, deterministically for the Space-Saving bound and with
+    probability 1 - delta for the Count-Min one.
+    """
+    def __init__(self, rental_service, author_of, epsilon: float = DEFAULT_EPSILON, delta: float = DEFAULT_DELTA,
+                 precision: int = DEFAULT_PRECISION):
+        """
+        :param author_of: book id -> author; rentals of books it cannot find count for no author
+        :param epsilon: the error bound, as a fraction of all rentals
+        :param delta: the probability of exceeding the Count-Min error bound
+        :param precision: log2 of the HyperLogLog registers
+        """
+        self._author_of = author_of
+        capacity = math.ceil(1 / epsilon)
+        self._book_counts = CountMinSketch(epsilon, delta)
+        self._book_hitters = SpaceSaving(capacity)
+        self._author_counts = CountMinSketch(epsilon, delta)
+        self._author_hitters = SpaceSaving(capacity)
+        self._clients = HyperLogLog(precision)
+        for rental in rental_service.get_all_rentals():
+            self._add(rental)
+        rental_service.subscribe(self.on_rental_event)
+
+    def top_books(self, k: int = None) -> list[tuple]:
+        """
+        :return: (book id, estimated rentals, error) triples, most rented first
+        """
+        return self.__top(self._book_hitters, self._book_counts, k)
+
+    def top_authors(self, k: int = None) -> list[tuple]:
+        """
+        :return: (author, estimated rentals, error) triples, most rented first
+        """
+        return self.__top(self._author_hitters, self._author_counts, k)
+
+    def distinct_clients(self) -> tuple:
+        """
+        :return: (estimated number of clients who rented a book, standard error)
+        """
+        estimate = self._clients.estimate()
+        return estimate, math.ceil(estimate * self._clients.relative_error)
+
+    def on_rental_event(self, event: str, rental, version):
+        if event == "added":
+            self._add(rental)
+        elif event == "removed":
+            self._book_counts.add(rental.get_book_id, -1)
+            self._book_hitters.remove(rental.get_book_id)
+            author = self.__author(rental.get_book_id)
+            if author is not None:
+                self._author_counts.add(author, -1)
+                self._author_hitters.remove(author)
+
+    def _add(self, rental):
+        self._book_counts.add(rental.get_book_id)
+        self._book_hitters.add(rental.get_book_id)
+        author = self.__author(rental.get_book_id)
+        if author is not None:
+            self._author_counts.add(author)
+            self._author_hitters.add(author)
+        self._clients.add(rental.get_client_id)
+
+    def __author(self, book_id):
+        try:
+            return self._author_of(book_id)
+        except BookNotFoundError:
+            return None
+
+    @staticmethod
+    def __top(hitters: SpaceSaving, counts: CountMinSketch, k: int = None) -> list[tuple]:
+        """
+        Candidates come from Space-Saving; each one keeps the tighter of the two estimates.
+        Keys that may have no rentals left (a count within its error) are not reported.
+        """
+        result = [(key, min(count, counts.estimate(key)), min(error, counts.error_bound))
+                  for key, count, error in hitters.top() if count > error]
+        result.sort(key=lambda item: item[1], reverse=True)
+        return result if k is None else result[:k]
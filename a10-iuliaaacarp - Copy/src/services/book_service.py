@@ -1,18 +1,32 @@
 import random
 from src.domain.book_domain import Book
-from src.services.undo_service import UndoService, Operation, FunctionCall, CascadedOperation
+from src.domain.rental_domain import Rental
+from src.repository.book_repository import DuplicateIDError
+from src.services.record_import import read_records, read_batches, describe_ids
+from src.services.undo_service import UndoService, Operation, FunctionCall, CascadedOperation, CommandOperation, \
+    intern_id
 from src.services.rental_service import RentalService
+from src.repository.unit_of_work import UnitOfWork
 
 
 class BookService:
+    IMPORT_COLUMNS = ("book_id", "title", "author")
+
     def __init__(self, book_repo, undo_service: UndoService, rental_service: RentalService):
         self._book_repo = book_repo
         self._undo_service = undo_service
         self._rental_service = rental_service
+        undo_service.register("add_book", self._add_operation)
+        undo_service.register("remove_book", self._remove_operation)
+        undo_service.register("update_book", self._update_operation)
+        undo_service.register("import_books", self._import_operation)
 
     def get_book(self, book_id):
         return self._book_repo.get_book(book_id)
 
+    def get_books(self, book_ids) -> dict:
+        return self._book_repo.get_books(book_ids)
+
     @staticmethod
     def generate_book_id():
         return str(random.randint(1000, 9999))
@@ -27,10 +41,8 @@ class BookService:
         book = Book(book_id, book_title, book_author, True)
         self._book_repo.add_book(book)
 
-        undo_function = FunctionCall(self._book_repo.remove_book, book_title)
-        redo_function = FunctionCall(self._book_repo.add_book, book)
-
-        self._undo_service.record(Operation(undo_function, redo_function))
+        self._undo_service.record(CommandOperation({"name": "add_book", "book": self.book_fields(book)},
+                                                   self._add_operation))
 
     def remove_book(self, book_title):
         book_id = self.search_title_id(book_title)
@@ -38,70 +50,130 @@ class BookService:
         if book_id is None:
             pass
         rentals_to_remove = []
-        if self._rental_service:
-            rentals_to_remove = self._rental_service.get_rentals_by_book_id(book_id)
-            self._rental_service.delete_rentals_for_book(book_id)
+        rental_repo = self._rental_service.rental_repo if self._rental_service else None
+        with UnitOfWork(self._book_repo, rental_repo):
+            if self._rental_service:
+                rentals_to_remove = self._rental_service.get_rentals_by_book_id(book_id)
+                self._rental_service.delete_rentals_for_book(book_id)
+
+            deleted_book = self._book_repo.remove_book(book_title)
+
+        command = {"name": "remove_book", "book": self.book_fields(deleted_book),
+                   "rentals": [(intern_id(rental.get_rental_id), intern_id(rental.get_client_id),
+                                rental.get_rented_date, rental.get_returned_date) for rental in rentals_to_remove]}
+        self._undo_service.record(CommandOperation(command, self._remove_operation))
+
+    def update_book(self, book_id, book_title, book_author):
+        original_book = self._book_repo.get_book(book_id)
+        before, after = {}, {}
+        for field, old, new in (("title", original_book.get_title, book_title),
+                                ("author", original_book.get_author, book_author)):
+            if old != new:
+                before[field], after[field] = old, new
+
+        self._book_repo.update_book(book_id, book_title, book_author)
+
+        if not after:
+            return
+        book_id = intern_id(book_id)
+        self._undo_service.record(CommandOperation({"name": "update_book", "book_id": book_id,
+                                                    "before": before, "after": after},
+                                                   self._update_operation, ("book", book_id)))
+
+    def import_books(self, filename: str, file_format: str = None) -> int:
+        """
+        Adds the books of a CSV or JSON Lines file with book_id, title and author fields. The
+        records are read and checked against the repository a batch at a time, inside one
+        unit of work, so the repository is written once; the import is undone in one step.
+        Nothing is added if an id is already taken or repeated in the file.
+        :return: the number of books imported
+        """
+        books = []
+        seen = set()
+        with UnitOfWork(self._book_repo):
+            for batch in read_batches(read_records(filename, self.IMPORT_COLUMNS, file_format)):
+                book_ids = [book_id for book_id, _, _ in batch]
+                duplicates = self._book_repo.find_existing(book_ids)
+                duplicates.update(book_id for book_id in book_ids if book_id in seen)
+                if duplicates:
+                    raise DuplicateIDError(f"Duplicate Book ID: {describe_ids(duplicates)}")
+                seen.update(book_ids)
+                for book_id, title, author in batch:
+                    book = Book(book_id, title, author, True)
+                    self._book_repo.add_book(book)
+                    books.append(self.book_fields(book))
+        if books:
+            self._undo_service.record(CommandOperation({"name": "import_books", "books": books},
+                                                       self._import_operation))
+        return len(books)
 
-        deleted_book = self._book_repo.remove_book(book_title)
+    @staticmethod
+    def book_fields(book) -> tuple:
+        return intern_id(book.get_book_id), book.get_title, book.get_author, book.get_is_available
 
+    def _add_operation(self, command: dict) -> Operation:
+        book = Book(*command["book"])
+        return Operation(FunctionCall(self._book_repo.remove_book, book.get_title),
+                         FunctionCall(self._book_repo.add_book, book), command=command)
+
+    def _remove_operation(self, command: dict) -> CascadedOperation:
+        book = Book(*command["book"])
         all_ops = []
 
-        for rental in rentals_to_remove:
+        for rental_id, client_id, rented_date, returned_date in command["rentals"]:
+            rental = Rental(rental_id, book.get_book_id, client_id, rented_date, returned_date)
             undo_rental = FunctionCall(self._rental_service.add_rental_object, rental)
             redo_rental = FunctionCall(self._rental_service.delete_rental_by_id, rental.get_rental_id)
             all_ops.append(Operation(undo_rental, redo_rental))
 
-        undo_book = FunctionCall(self._book_repo.add_book, deleted_book)
-        redo_book = FunctionCall(self._book_repo.remove_book, book_title)
+        undo_book = FunctionCall(self._book_repo.add_book, book)
+        redo_book = FunctionCall(self._book_repo.remove_book, book.get_title)
         all_ops.append(Operation(undo_book, redo_book))
 
-        self._undo_service.record(CascadedOperation(*reversed(all_ops)))
+        return CascadedOperation(*all_ops, command=command)
 
-    def update_book(self, book_id, book_title, book_author):
-        original_book = self._book_repo.get_book(book_id)
-        original_title = original_book.get_title
-        original_author = original_book.get_author
+    def _import_operation(self, command: dict) -> Operation:
+        books = [Book(*fields) for fields in command["books"]]
+        return Operation(FunctionCall(self._remove_books, [book.get_book_id for book in books]),
+                         FunctionCall(self._add_books, books), command=command)
 
-        self._book_repo.update_book(book_id, book_title, book_author)
+    def _add_books(self, books):
+        with UnitOfWork(self._book_repo):
+            for book in books:
+                self._book_repo.add_book(book)
+
+    def _remove_books(self, book_ids):
+        with UnitOfWork(self._book_repo):
+            for book_id in reversed(book_ids):
+                self._book_repo.remove_book_by_id(book_id)
 
-        undo_function = FunctionCall(self._book_repo.update_book, book_id, original_title, original_author)
-        redo_function = FunctionCall(self._book_repo.update_book, book_id, book_title, book_author)
+    def _update_operation(self, command: dict) -> Operation:
+        book_id = command["book_id"]
+        return Operation(FunctionCall(self._set_book_fields, book_id, command["before"]),
+                         FunctionCall(self._set_book_fields, book_id, command["after"]),
+                         ("book", book_id), command)
 
-        self._undo_service.record(Operation(undo_function, redo_function))
+    def _set_book_fields(self, book_id, fields: dict):
+        """
+        Applies a field-level delta; the fields it does not name keep their current value.
+        """
+        book = self._book_repo.get_book(book_id)
+        self._book_repo.update_book(book_id, fields.get("title", book.get_title), fields.get("author", book.get_author))
 
     def display_all_books(self):
         return list(self._book_repo)
 
     def search_book_id(self, book_id):
-        search = []
-        book_id_str = str(book_id).lower()
-        for book in self._book_repo:
-            if book_id_str in str(book.get_book_id).lower():
-                search.append(book)
-        return search
+        return self._book_repo.search_by_id(book_id)
 
     def search_book_title(self, book_title):
-        search = []
-        book_title_str = str(book_title).lower()
-        for book in self._book_repo:
-            if book_title_str in book.get_title.lower():
-                search.append(book)
-        return search
+        return self._book_repo.search_by_title(book_title)
 
     def search_book_author(self, book_author):
-        search = []
-        book_author_str = str(book_author).lower()
-        for book in self._book_repo:
-            if book_author_str in book.get_author.lower():
-                search.append(book)
-        return search
+        return self._book_repo.search_by_author(book_author)
 
     def search_title_id(self, book_title):
-        book_title_str = str(book_title).lower()
-        for book in self._book_repo:
-            if book_title_str == book.get_title.lower():
-                return book.get_book_id
-        return None
+        return self._book_repo.find_book_id_by_title(book_title)
 
     def search_author_id(self, book_id):
         book_id_str = str(book_id).lower()
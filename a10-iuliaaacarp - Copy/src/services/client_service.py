@@ -1,16 +1,28 @@
 import random
 from src.domain.client_domain import Client
-from src.services.undo_service import UndoService, Operation, FunctionCall
+from src.repository.client_repository import DuplicateIDError
+from src.repository.unit_of_work import UnitOfWork
+from src.services.undo_service import UndoService, Operation, FunctionCall, CommandOperation, intern_id
+from src.services.record_import import read_records, read_batches, describe_ids
 
 
 class ClientService:
+    IMPORT_COLUMNS = ("client_id", "client_name")
+
     def __init__(self, client_repo, undo_service: UndoService):
         self._client_repo = client_repo
         self._undo_service = undo_service
+        undo_service.register("add_client", self._add_operation)
+        undo_service.register("remove_client", self._remove_operation)
+        undo_service.register("update_client", self._update_operation)
+        undo_service.register("import_clients", self._import_operation)
 
     def get_client(self, client_id):
         return self._client_repo.get_client(client_id)
 
+    def get_clients(self, client_ids) -> dict:
+        return self._client_repo.get_clients(client_ids)
+
     @staticmethod
     def generate_client_id():
         return str(random.randint(10000, 99999))
@@ -19,48 +31,101 @@ class ClientService:
         client = Client(client_id, client_name)
         self._client_repo.add_client(client)
 
-        undo_function = FunctionCall(self._client_repo.remove_client, client_name)
-        redo_function = FunctionCall(self._client_repo.add_client, client)
-
-        self._undo_service.record(Operation(undo_function, redo_function))
+        self._undo_service.record(CommandOperation({"name": "add_client", "client": (intern_id(client_id), client_name)},
+                                                   self._add_operation))
 
     def remove_client(self, client_id):
         deleted_client = self._client_repo.remove_client(client_id)
 
-        undo_function = FunctionCall(self._client_repo.add_client, deleted_client)
-        redo_function = FunctionCall(self._client_repo.remove_client, client_id)
-
-        self._undo_service.record(Operation(undo_function, redo_function))
+        self._undo_service.record(CommandOperation({
+            "name": "remove_client", "client": (intern_id(deleted_client.get_client_id), deleted_client.get_client_name),
+            "client_id": intern_id(client_id)}, self._remove_operation))
 
     def update_client(self, client_id, client_name):
         original_client = self._client_repo.get_client(client_id)
-        original_name = original_client.get_client_name
+        before, after = {}, {}
+        if original_client.get_client_name != client_name:
+            before["client_name"], after["client_name"] = original_client.get_client_name, client_name
 
         self._client_repo.update_client(client_id, client_name)
 
-        undo_function = FunctionCall(self._client_repo.update_client, client_id, original_name)
-        redo_function = FunctionCall(self._client_repo.update_client, client_id, client_name)
-
-        self._undo_service.record(Operation(undo_function, redo_function))
+        if not after:
+            return
+        client_id = intern_id(client_id)
+        self._undo_service.record(CommandOperation({"name": "update_client", "client_id": client_id,
+                                                    "before": before, "after": after},
+                                                   self._update_operation, ("client", client_id)))
+
+    def import_clients(self, filename: str, file_format: str = None) -> int:
+        """
+        Adds the clients of a CSV or JSON Lines file with client_id and client_name fields,
+        like BookService.import_books: one unit of work, one undo step, and nothing added if
+        an id is already taken or repeated in the file.
+        :return: the number of clients imported
+        """
+        clients = []
+        seen = set()
+        with UnitOfWork(self._client_repo):
+            for batch in read_batches(read_records(filename, self.IMPORT_COLUMNS, file_format)):
+                client_ids = [client_id for client_id, _ in batch]
+                duplicates = self._client_repo.find_existing(client_ids)
+                duplicates.update(client_id for client_id in client_ids if client_id in seen)
+                if duplicates:
+                    raise DuplicateIDError(f"Duplicate Client ID: {describe_ids(duplicates)}")
+                seen.update(client_ids)
+                for client_id, client_name in batch:
+                    self._client_repo.add_client(Client(client_id, client_name))
+                    clients.append((intern_id(client_id), client_name))
+        if clients:
+            self._undo_service.record(CommandOperation({"name": "import_clients", "clients": clients},
+                                                       self._import_operation))
+        return len(clients)
+
+    def _add_operation(self, command: dict) -> Operation:
+        client = Client(*command["client"])
+        return Operation(FunctionCall(self._client_repo.remove_client, client.get_client_id),
+                         FunctionCall(self._client_repo.add_client, client), command=command)
+
+    def _remove_operation(self, command: dict) -> Operation:
+        return Operation(FunctionCall(self._client_repo.add_client, Client(*command["client"])),
+                         FunctionCall(self._client_repo.remove_client, command["client_id"]), command=command)
+
+    def _import_operation(self, command: dict) -> Operation:
+        clients = [Client(*fields) for fields in command["clients"]]
+        return Operation(FunctionCall(self._remove_clients, [client.get_client_id for client in clients]),
+                         FunctionCall(self._add_clients, clients), command=command)
+
+    def _add_clients(self, clients):
+        with UnitOfWork(self._client_repo):
+            for client in clients:
+                self._client_repo.add_client(client)
+
+    def _remove_clients(self, client_ids):
+        with UnitOfWork(self._client_repo):
+            for client_id in reversed(client_ids):
+                self._client_repo.remove_client(client_id)
+
+    def _update_operation(self, command: dict) -> Operation:
+        client_id = command["client_id"]
+        return Operation(FunctionCall(self._set_client_fields, client_id, command["before"]),
+                         FunctionCall(self._set_client_fields, client_id, command["after"]),
+                         ("client", client_id), command)
+
+    def _set_client_fields(self, client_id, fields: dict):
+        """
+        Applies a field-level delta; the fields it does not name keep their current value.
+        """
+        if "client_name" in fields:
+            self._client_repo.update_client(client_id, fields["client_name"])
 
     def display_all_clients(self):
         return list(self._client_repo)
 
     def search_client_id(self, client_id):
-        search = []
-        client_id_str = str(client_id).lower()
-        for client in self._client_repo:
-            if client_id_str in str(client.get_client_id).lower():
-                search.append(client)
-        return search
+        return self._client_repo.search_by_id(client_id)
 
     def search_client_name(self, client_name):
-        search = []
-        client_name_str = str(client_name).lower()
-        for client in self._client_repo:
-            if client_name_str in client.get_client_name.lower():
-                search.append(client)
-        return search
+        return self._client_repo.search_by_name(client_name)
 
     def search_client_name_id(self, client_name):
         client_name_str = str(client_name).lower()
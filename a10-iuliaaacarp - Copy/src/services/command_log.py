@@ -0,0 +1,131 @@
+import json
+import os
+
+
+DEFAULT_COMPACT_THRESHOLD = 1024 * 1024
+PAGE_BYTES = 64 * 1024
+
+
+class CommandLog:
+    """
+    Undo history kept on disk as JSON Lines, so it survives a restart.
+
+    Two kinds of lines are appended:
+        {"seq": 3, "command": {...}, "floor": 1}    the operation at history position 3; the history now ends there
+        {"cursor": 2, "top": 3, "floor": 1}         undo/redo moved; positions floor..cursor can be undone and
+                                                    cursor+1..top redone; the ones below floor
+                                                    were dropped by the bounds of the history
+    A command line for a position that was already written replaces the older one, which is
+    how recording after an undo drops the redo entries and how a coalesced operation is
+    rewritten. The valid command lines are therefore in position order in the file, and the
+    history is read backwards from the end, one page at a time, as far as undo goes.
+    """
+    def __init__(self, filename: str, compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        """
+        :param compact_threshold: log size in bytes after which compact() rewrites it on startup
+        """
+        self._filename = filename
+        self.compact_threshold = compact_threshold
+        self.__repair()
+
+    @property
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self._filename)
+        except FileNotFoundError:
+            return 0
+
+    def position(self) -> tuple:
+        """
+        :return: (cursor, top, floor) as of the last line; (0, 0, 1) for a new log
+        """
+        for record in self.__records_backward():
+            if "seq" in record:
+                return record["seq"], record["seq"], record["floor"]
+            return record["cursor"], record["top"], record["floor"]
+        return 0, 0, 1
+
+    def commands(self, top: int, floor: int = 1):
+        """
+        Yields (position, command) from top down to floor, reading the file backwards only
+        as far as the caller iterates. command is None for an operation that could not be
+        written as data.
+        """
+        need = top
+        for record in self.__records_backward():
+            if need < floor:
+                return
+            if record.get("seq") == need:
+                yield need, record["command"]
+                need -= 1
+
+    def append_command(self, seq: int, command, floor: int):
+        self.__append({"seq": seq, "command": command, "floor": floor})
+
+    def append_position(self, cursor: int, top: int, floor: int):
+        self.__append({"cursor": cursor, "top": top, "floor": floor})
+
+    def compact(self, limit: int = None):
+        """
+        Rewrites the log with only the lines still in the history, keeping at most the
+        newest limit positions.
+        """
+        cursor, top, floor = self.position()
+        kept = []
+        for seq, command in self.commands(top, floor):
+            if command is None or (limit is not None and len(kept) >= limit):
+                break
+            kept.append((seq, command))
+        floor = kept[-1][0] if kept else top + 1
+        tmp_filename = self._filename + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as fout:
+            for seq, command in reversed(kept):
+                fout.write(json.dumps({"seq": seq, "command": command, "floor": floor}) + "\n")
+            fout.write(json.dumps({"cursor": cursor, "top": top, "floor": floor}) + "\n")
+        os.replace(tmp_filename, self._filename)
+
+    def __append(self, record: dict):
+        with open(self._filename, "a", encoding="utf-8") as fout:
+            fout.write(json.dumps(record) + "\n")
+
+    def __repair(self):
+        """
+        Cuts a last line left incomplete by a crash, so the next append starts a new line.
+        """
+        try:
+            with open(self._filename, "rb+") as fout:
+                end = fout.seek(0, os.SEEK_END)
+                position = end
+                while position > 0:
+                    start = max(0, position - PAGE_BYTES)
+                    fout.seek(start)
+                    newline = fout.read(position - start).rfind(b"\n")
+                    if newline != -1:
+                        position = start + newline + 1
+                        break
+                    position = start
+                if position != end:
+                    fout.truncate(position)
+        except FileNotFoundError:
+            pass
+
+    def __records_backward(self):
+        """
+        Yields the parsed lines from the last one to the first, reading PAGE_BYTES at a time.
+        """
+        try:
+            fin = open(self._filename, "rb")
+        except FileNotFoundError:
+            return
+        with fin:
+            position = fin.seek(0, os.SEEK_END)
+            tail = b""
+            while position > 0:
+                start = max(0, position - PAGE_BYTES)
+                fin.seek(start)
+                lines = (fin.read(position - start) + tail).split(b"\n")
+                position = start
+                tail = lines.pop(0) if position > 0 else b""
+                for line in reversed(lines):
+                    if line.strip():
+                        yield json.loads(line)
@@ -0,0 +1,171 @@
+from collections import namedtuple
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from src.repository.rental_columns import RAW_DATE
+
+
+RentalArrays = namedtuple("RentalArrays", "book book_ids client client_ids returned days date_error")
+
+
+class NumpyRentalStatistics:
+    """
+    The statistics of RentalStatisticsEngine computed with NumPy over integer-coded rental
+    columns, for rental histories too large for per-object loops.
+
+    The columns are taken straight from a repository that has rental_columns(), or built in
+    one pass over get_all_rentals() otherwise, and are rebuilt only when the repository
+    version changes. Counts and day sums come from unique/bincount, and keys are ordered by
+    their first rental with a stable lexsort, so every result equals the pure-Python one.
+    """
+    def __init__(self, rental_service):
+        if np is None:
+            raise ImportError("NumPy is not installed")
+        self._rental_service = rental_service
+        self._version = None
+        self._arrays = None
+        self._cache = {}
+
+    def book_counts(self) -> list[tuple]:
+        """
+        :return: (book id, number of rentals) pairs, in the order of each book's first rental
+        """
+        arrays = self._load()
+        codes, first, counts = self._books()
+        order = np.argsort(first, kind="stable")
+        return [(arrays.book_ids[codes[i]], int(counts[i])) for i in order]
+
+    def client_days(self) -> list[tuple]:
+        """
+        :return: (client id, days rented) pairs over the returned rentals, in the order of
+                 each client's first returned rental
+        """
+        arrays = self._load()
+        codes, first, days = self._clients()
+        order = np.argsort(first, kind="stable")
+        return [(arrays.client_ids[codes[i]], int(days[i])) for i in order]
+
+    def author_counts(self, author_of) -> list[tuple]:
+        """
+        :param author_of: book id -> author
+        :return: (author, number of rentals) pairs, in the order of each author's first rental
+        """
+        arrays = self._load()
+        codes, first, counts = self._books()
+        authors = []
+        author_codes = {}
+        book_authors = np.empty(len(codes), dtype=np.int64)
+        for i in np.argsort(first, kind="stable"):
+            author = author_of(arrays.book_ids[codes[i]])
+            code = author_codes.setdefault(author, len(authors))
+            if code == len(authors):
+                authors.append(author)
+            book_authors[i] = code
+        totals = np.bincount(book_authors, weights=counts, minlength=len(authors))
+        return [(author, int(totals[code])) for code, author in enumerate(authors)]
+
+    def top_books(self, k: int = None) -> list[tuple]:
+        arrays = self._load()
+        codes, first, counts = self._books()
+        return self.__top(codes, first, counts, arrays.book_ids, k)
+
+    def top_clients(self, k: int = None) -> list[tuple]:
+        arrays = self._load()
+        codes, first, days = self._clients()
+        return self.__top(codes, first, days, arrays.client_ids, k)
+
+    def _books(self):
+        """
+        :return: (book codes, row of each book's first rental, rentals per book)
+        """
+        if "books" not in self._cache:
+            self._cache["books"] = np.unique(self._arrays.book, return_index=True, return_counts=True)
+        return self._cache["books"]
+
+    def _clients(self):
+        """
+        :return: (client codes, row of each client's first returned rental, days per client)
+        """
+        if "clients" not in self._cache:
+            arrays = self._arrays
+            if arrays.date_error is not None:
+                raise arrays.date_error
+            rows = np.flatnonzero(arrays.returned)
+            codes, first, inverse = np.unique(arrays.client[rows], return_index=True, return_inverse=True)
+            days = np.bincount(inverse, weights=arrays.days[rows], minlength=len(codes)).astype(np.int64)
+            self._cache["clients"] = (codes, rows[first], days)
+        return self._cache["clients"]
+
+    def _load(self) -> RentalArrays:
+        repository = self._rental_service.rental_repo
+        version = repository.version
+        if self._arrays is None or self._version != version:
+            if hasattr(repository, "rental_columns"):
+                self._arrays = self.__from_columns(repository)
+            else:
+                self._arrays = self.__from_rentals(self._rental_service.get_all_rentals())
+            self._version = version
+            self._cache = {}
+        return self._arrays
+
+    @staticmethod
+    def __from_columns(repository) -> RentalArrays:
+        columns = repository.rental_columns()
+        book, client, rented, returned = (np.frombuffer(column, dtype=np.dtype(f"i{column.itemsize}")).astype(np.int64)
+                                          for column in (columns.book_codes, columns.client_codes,
+                                                         columns.rented, columns.returned))
+        is_returned = (returned > 0) | (returned == RAW_DATE)
+        known = (rented > 0) & (returned > 0)
+        days = np.where(known, returned - rented, 0)
+        date_error = None
+        for row in np.flatnonzero(is_returned & ~known):
+            rental = repository.get_rental(columns.rental_ids[row])
+            try:
+                days[row] = (datetime.fromisoformat(rental.get_returned_date) -
+                             datetime.fromisoformat(rental.get_rented_date)).days
+            except ValueError as e:
+                date_error = date_error or e
+        return RentalArrays(book, list(columns.book_ids), client, list(columns.client_ids), is_returned, days,
+                            date_error)
+
+    @staticmethod
+    def __from_rentals(rentals) -> RentalArrays:
+        book_ids, book_lookup, client_ids, client_lookup = [], {}, [], {}
+        book, client, is_returned, days = [], [], [], []
+        date_error = None
+        for rental in rentals:
+            book.append(book_lookup.setdefault(rental.get_book_id, len(book_lookup)))
+            if book[-1] == len(book_ids):
+                book_ids.append(rental.get_book_id)
+            client.append(client_lookup.setdefault(rental.get_client_id, len(client_lookup)))
+            if client[-1] == len(client_ids):
+                client_ids.append(rental.get_client_id)
+
+            returned = rental.get_returned_date
+            is_returned.append(bool(returned) and returned != "Not returned")
+            if not is_returned[-1]:
+                days.append(0)
+            elif rental.get_returned_day is not None and rental.get_rented_day is not None:
+                days.append(rental.get_returned_day - rental.get_rented_day)
+            else:
+                try:
+                    days.append((datetime.fromisoformat(returned) - datetime.fromisoformat(rental.get_rented_date)).days)
+                except ValueError as e:
+                    days.append(0)
+                    date_error = date_error or e
+        return RentalArrays(np.array(book, dtype=np.int64), book_ids, np.array(client, dtype=np.int64), client_ids,
+                            np.array(is_returned, dtype=bool), np.array(days, dtype=np.int64), date_error)
+
+    @staticmethod
+    def __top(codes, first, values, ids: list, k: int = None) -> list[tuple]:
+        """
+        Highest value first; equal values keep the order of the first rental.
+        """
+        order = np.lexsort((first, -values))
+        if k is not None:
+            order = order[:k]
+        return [(ids[codes[i]], int(values[i])) for i in order]
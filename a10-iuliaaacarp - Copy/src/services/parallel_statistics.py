@@ -0,0 +1,122 @@
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from src.services.statistics_engine import select_top, sum_by_author
+
+
+DEFAULT_PARALLEL_THRESHOLD = 50000
+
+
+def aggregate_shard(rows: list) -> tuple:
+    """
+    Runs in a worker process.
+    :param rows: (book id, client id, rented date, returned date, rented day, returned day) tuples
+    :return: (rentals per book, days per client over the returned rentals, first date error or None);
+             keys are in the order of their first rental in the shard
+    """
+    book_counts = Counter()
+    client_days = Counter()
+    date_error = None
+    for book_id, client_id, rented, returned, rented_day, returned_day in rows:
+        book_counts[book_id] += 1
+        if not returned or returned == "Not returned":
+            continue
+        if rented_day is not None and returned_day is not None:
+            client_days[client_id] += returned_day - rented_day
+        else:
+            try:
+                client_days[client_id] += (datetime.fromisoformat(returned) - datetime.fromisoformat(rented)).days
+            except ValueError as e:
+                date_error = date_error or e
+    return book_counts, client_days, date_error
+
+
+class ParallelRentalStatistics:
+    """
+    The statistics of RentalStatisticsEngine computed by splitting the rentals into
+    contiguous shards that worker processes aggregate on their own.
+
+    Shards are merged in repository order, so every key keeps the position of its first
+    rental and the results equal the single-process ones. Below threshold rentals the
+    shard is aggregated in this process, since pickling the rows costs more than it saves.
+    The worker processes are started on the first parallel aggregation and reused until
+    close(). Results are kept until the repository version changes.
+    """
+    def __init__(self, rental_service, workers: int = None, threshold: int = None):
+        """
+        :param workers: worker processes; None uses one per CPU
+        :param threshold: smallest number of rentals worth sending to worker processes;
+            None uses DEFAULT_PARALLEL_THRESHOLD
+        """
+        self._rental_service = rental_service
+        self._workers = workers or os.cpu_count() or 1
+        self._threshold = DEFAULT_PARALLEL_THRESHOLD if threshold is None else threshold
+        self._version = None
+        self._aggregates = None
+        self._pool = None
+
+    def book_counts(self) -> list[tuple]:
+        """
+        :return: (book id, number of rentals) pairs, in the order of each book's first rental
+        """
+        return list(self._load()[0].items())
+
+    def client_days(self) -> list[tuple]:
+        """
+        :return: (client id, days rented) pairs over the returned rentals, in the order of
+                 each client's first returned rental
+        """
+        _, client_days, date_error = self._load()
+        if date_error is not None:
+            raise date_error
+        return list(client_days.items())
+
+    def author_counts(self, author_of) -> list[tuple]:
+        """
+        :param author_of: book id -> author
+        :return: (author, number of rentals) pairs, in the order of each author's first rental
+        """
+        return sum_by_author(self.book_counts(), author_of)
+
+    def top_books(self, k: int = None) -> list[tuple]:
+        return select_top(self.book_counts(), k)
+
+    def top_clients(self, k: int = None) -> list[tuple]:
+        return select_top(self.client_days(), k)
+
+    def _load(self) -> tuple:
+        version = self._rental_service.rental_repo.version
+        if self._aggregates is None or self._version != version:
+            rows = [(rental.get_book_id, rental.get_client_id, rental.get_rented_date, rental.get_returned_date,
+                     rental.get_rented_day, rental.get_returned_day)
+                    for rental in self._rental_service.get_all_rentals()]
+            if self._workers < 2 or not rows or len(rows) < self._threshold:
+                self._aggregates = aggregate_shard(rows)
+            else:
+                self._aggregates = self.__map_reduce(rows)
+            self._version = version
+        return self._aggregates
+
+    def close(self):
+        """
+        Shuts the worker processes down; a later parallel aggregation starts new ones.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __map_reduce(self, rows: list) -> tuple:
+        size = -(-len(rows) // self._workers)
+        shards = [rows[start:start + size] for start in range(0, len(rows), size)]
+        book_counts = Counter()
+        client_days = Counter()
+        date_error = None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self._workers)
+        for shard_books, shard_clients, shard_error in self._pool.map(aggregate_shard, shards):
+            book_counts.update(shard_books)
+            client_days.update(shard_clients)
+            date_error = date_error or shard_error
+        return book_counts, client_days, date_error
@@ -0,0 +1,68 @@
+from bisect import bisect_left, insort
+
+
+class RankedCounter:
+    """
+    Keys grouped in buckets by value, with the distinct values kept sorted, so the k keys
+    with the highest values are read in O(k) instead of sorting every key. Inside a bucket
+    keys are kept by the order number they were given, which breaks ties deterministically.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._buckets = {}
+        self._values = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set(self, key, value, order):
+        """
+        Moves key to the bucket of value; order numbers have to be unique.
+        """
+        self.discard(key)
+        bucket = self._buckets.get(value)
+        if bucket is None:
+            bucket = self._buckets[value] = []
+            insort(self._values, value)
+        insort(bucket, (order, key))
+        self._entries[key] = (value, order)
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        value, order = entry
+        bucket = self._buckets[value]
+        del bucket[bisect_left(bucket, (order,))]
+        if not bucket:
+            del self._buckets[value]
+            del self._values[bisect_left(self._values, value)]
+
+    def lowest(self):
+        """
+        :return: (key, value) of the key with the lowest value, the latest order among equal values
+        """
+        value = self._values[0]
+        return self._buckets[value][-1][1], value
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._entries = {}
+        self._buckets = {}
+        self._values = []
+
+    def top(self, k: int = None) -> list[tuple]:
+        """
+        :return: (key, value) pairs, highest value first and lowest order first among equal values
+        :param k: stop after k pairs; None returns every key
+        """
+        result = []
+        for value in reversed(self._values):
+            for order, key in self._buckets[value]:
+                if k is not None and len(result) >= k:
+                    return result
+                result.append((key, value))
+        return result
@@ -0,0 +1,49 @@
+import csv
+import json
+
+from src.services.statistics_export import export_format
+
+
+IMPORT_BATCH = 500
+
+
+def read_records(filename: str, columns, file_format: str = None):
+    """
+    Yields the records of a CSV file with a header row or of a JSON Lines file, one at a
+    time, as tuples of the values of columns.
+    :param file_format: "csv" or "jsonl"; None takes it from the extension of filename
+    :raises ValueError: for a record that lacks one of the columns
+    """
+    file_format = export_format(filename, file_format)
+    with open(filename, "r", newline="", encoding="utf-8") as fin:
+        if file_format == "csv":
+            rows = csv.DictReader(fin)
+        else:
+            rows = (json.loads(line) for line in fin if line.strip())
+        for number, row in enumerate(rows, 1):
+            values = tuple(row.get(column) for column in columns)
+            if any(value is None or str(value).strip() == "" for value in values):
+                raise ValueError(f"Record {number} of '{filename}' needs the fields {', '.join(columns)}")
+            yield tuple(str(value).strip() for value in values)
+
+
+def describe_ids(ids, limit: int = 10) -> str:
+    """
+    :return: the first limit ids in sorted order, for an error message
+    """
+    ids = sorted(ids)
+    return ", ".join(ids[:limit]) + (f" and {len(ids) - limit} more" if len(ids) > limit else "")
+
+
+def read_batches(records, size: int = IMPORT_BATCH):
+    """
+    Groups records in lists of at most size, so each list can be checked with one bulk lookup.
+    """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
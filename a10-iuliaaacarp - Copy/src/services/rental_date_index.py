@@ -0,0 +1,151 @@
+from bisect import bisect_left
+
+from src.services.statistics_engine import rental_days
+
+
+class RentalDateIndex:
+    """
+    Rentals sorted by rented date, so statistics over a date window are computed from the
+    rentals inside the window only, which are located with bisect.
+
+    Like RentalStatisticsEngine, the index follows the events published by RentalService,
+    gives every rental a sequence number in repository order and is rebuilt when the
+    repository changed in a way it could not follow. Rentals whose rented date is not an
+    ISO date cannot be placed in a window and are left out of the sorted entries.
+
+    Added rentals are buffered and merged into the sorted entries by the next query, with
+    one sort that only has two sorted runs to combine, so a burst of rentals costs no more
+    than a single one.
+    """
+    def __init__(self, rental_service):
+        self._rental_service = rental_service
+        self._synced_version = None
+        self._next_seq = 0
+        self._entries = []
+        self._pending = set()
+        self._rentals = {}
+        rental_service.subscribe(self.on_rental_event)
+
+    def book_counts(self, since: int = None, until: int = None) -> list[tuple]:
+        """
+        :param since: first day ordinal of the window; None leaves it open
+        :param until: last day ordinal of the window; None leaves it open
+        :return: (book id, number of rentals) pairs over the rentals rented in the window, in
+                 the order of each book's first rental
+        """
+        counts = {}
+        for seq, book_id, _, _ in self.__window(since, until):
+            first, count = counts.get(book_id, (seq, 0))
+            counts[book_id] = (min(first, seq), count + 1)
+        return self.__in_rental_order(counts)
+
+    def client_days(self, since: int = None, until: int = None) -> list[tuple]:
+        """
+        :return: (client id, days rented) pairs over the returned rentals rented in the window,
+                 in the order of each client's first returned rental
+        """
+        days_by_client = {}
+        for seq, _, client_id, days in self.__window(since, until):
+            if isinstance(days, ValueError):
+                raise days
+            if days is not None:
+                first, total = days_by_client.get(client_id, (seq, 0))
+                days_by_client[client_id] = (min(first, seq), total + days)
+        return self.__in_rental_order(days_by_client)
+
+    def on_rental_event(self, event: str, rental, version):
+        """
+        Applies one change published by RentalService.
+        :param event: "added", "removed" or "updated"
+        :param version: the rental repository version the change started from
+        """
+        if self._synced_version is None:
+            return
+        if version != self._synced_version or (event != "added" and rental.get_rental_id not in self._rentals):
+            self._synced_version = None
+            return
+
+        if event == "added":
+            self._add(rental, self._next_seq)
+            self._next_seq += 1
+        elif event == "removed":
+            self._remove(rental.get_rental_id)
+        else:
+            self._add(rental, self._remove(rental.get_rental_id))
+        self._synced_version = self._rental_service.rental_repo.version
+
+    def _sync(self):
+        version = self._rental_service.rental_repo.version
+        if self._synced_version is not None and self._synced_version == version:
+            return
+        self._next_seq = 0
+        self._entries = []
+        self._pending = set()
+        self._rentals = {}
+        for rental in self._rental_service.get_all_rentals():
+            entry = self._track(rental, self._next_seq)
+            if entry is not None:
+                self._entries.append(entry)
+            self._next_seq += 1
+        self._entries.sort()
+        self._synced_version = version
+
+    def _add(self, rental, seq: int):
+        entry = self._track(rental, seq)
+        if entry is not None:
+            self._pending.add(entry)
+
+    def _track(self, rental, seq: int):
+        """
+        Remembers the rental under its id.
+        :return: its (rented day, sequence number, rental id) entry, or None for a rental
+                 without an ISO rented date
+        """
+        try:
+            days = rental_days(rental)
+        except ValueError as e:
+            days = e
+        rented_day = rental.get_rented_day
+        self._rentals[rental.get_rental_id] = (rented_day, seq, rental.get_book_id, rental.get_client_id, days)
+        return None if rented_day is None else (rented_day, seq, rental.get_rental_id)
+
+    def _remove(self, rental_id) -> int:
+        """
+        :return: the sequence number the rental had
+        """
+        rented_day, seq, _, _, _ = self._rentals.pop(rental_id)
+        entry = (rented_day, seq, rental_id)
+        if entry in self._pending:
+            self._pending.remove(entry)
+        elif rented_day is not None:
+            del self._entries[bisect_left(self._entries, (rented_day, seq))]
+        return seq
+
+    def _merge(self):
+        """
+        Moves the buffered entries into the sorted ones.
+        """
+        if self._pending:
+            self._entries.extend(sorted(self._pending))
+            self._entries.sort()
+            self._pending = set()
+
+    def __window(self, since: int = None, until: int = None):
+        """
+        Yields (sequence number, book id, client id, days or date error) for the rentals rented
+        in the window, in rented date order.
+        """
+        self._sync()
+        self._merge()
+        start = 0 if since is None else bisect_left(self._entries, (since,))
+        stop = len(self._entries) if until is None else bisect_left(self._entries, (until + 1,))
+        for index in range(start, stop):
+            _, seq, book_id, client_id, days = self._rentals[self._entries[index][2]]
+            yield seq, book_id, client_id, days
+
+    @staticmethod
+    def __in_rental_order(values: dict) -> list[tuple]:
+        """
+        :param values: key -> (sequence number of its first rental, value)
+        """
+        return [(key, value) for key, (_, value) in sorted(values.items(), key=lambda item: item[1][0])]
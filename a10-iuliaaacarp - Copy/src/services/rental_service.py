@@ -1,7 +1,10 @@
 # rental_service.py
 import random
 from src.domain.rental_domain import Rental
-from src.services.undo_service import UndoService, Operation, FunctionCall, CascadedOperation
+from src.services.undo_service import UndoService, Operation, FunctionCall, CascadedOperation, CommandOperation, \
+    intern_id
+from src.repository.unit_of_work import UnitOfWork
+from src.repository.rental_repository import RentalNotFoundError
 
 class RentalError(Exception):
     pass
@@ -12,6 +15,17 @@ class RentalService:
         self._book_service = book_service
         self._client_service = client_service
         self._undo_service = undo_service
+        self._listeners = []
+        undo_service.register("rent_book", self._rent_operation)
+        undo_service.register("return_book", self._return_operation)
+
+    def subscribe(self, listener):
+        """
+        Registers listener(event, rental, version), called after every change of the rentals made
+        through this service, including the ones made by undo and redo. event is "added",
+        "removed" or "updated" and version is the rental repository version before the change.
+        """
+        self._listeners.append(listener)
 
     @staticmethod
     def generate_rental_id():
@@ -24,63 +38,118 @@ class RentalService:
         return list(self._rental_repo)
 
     def rent_book(self, rental_id, client_id, book_title, rented_date, returned_date):
+        rental_id = intern_id(str(rental_id))
         book_id = self._book_service.search_title_id(book_title)
         if book_id is None:
             raise RentalError("Book not found")
         if not self._book_service.is_book_available(book_id):
             raise RentalError("Book not available")
         rental = Rental(rental_id, book_id, client_id, rented_date, returned_date)
-        self._rental_repo.add_rental(rental)
-        self._book_service.set_book_availability(book_id, False)
-        rental_operation = Operation(FunctionCall(self._rental_repo.remove_rental, rental_id),
-                                     FunctionCall(self._rental_repo.add_rental, rental))
-        book_operation = Operation(FunctionCall(self._book_service.set_book_availability, book_id, True),
-                                   FunctionCall(self._book_service.set_book_availability, book_id, False))
-        self._undo_service.record(CascadedOperation(rental_operation, book_operation))
+        with UnitOfWork(self._rental_repo, self._book_service.book_repo):
+            self._add_rental(rental)
+            self._book_service.set_book_availability(book_id, False)
+        self._undo_service.record(CommandOperation({
+            "name": "rent_book",
+            "rental": (rental_id, intern_id(book_id), intern_id(client_id), rented_date, returned_date)},
+            self._rent_operation))
 
     def return_book(self, book_title):
         book_id = self._book_service.search_title_id(book_title)
         if book_id is None:
             raise RentalError("Book not found.")
         active_rental = None
-        for rental in self._rental_repo:
-            if rental.get_book_id == book_id and not rental.get_returned_date:
+        for rental in self._rental_repo.get_rentals_for_book(book_id):
+            if not rental.get_returned_date:
                 active_rental = rental
                 break
         if active_rental is None:
             raise RentalError(f"Book '{book_title}' is not currently rented.")
         rental_id = active_rental.get_rental_id
-        original_returned_date = active_rental.get_returned_date
-        self._rental_repo.return_book(rental_id)
-        self._book_service.set_book_availability(book_id, True)
+        with UnitOfWork(self._rental_repo, self._book_service.book_repo):
+            self._return_rental(rental_id)
+            self._book_service.set_book_availability(book_id, True)
+        self._undo_service.record(CommandOperation({
+            "name": "return_book",
+            "rental": (intern_id(rental_id), intern_id(book_id), intern_id(active_rental.get_client_id),
+                       active_rental.get_rented_date, active_rental.get_returned_date)},
+            self._return_operation))
+
+    def _rent_operation(self, command: dict) -> CascadedOperation:
+        rental_id, book_id, client_id, rented_date, returned_date = command["rental"]
+        book_id = str(book_id)
+        rental = Rental(str(rental_id), book_id, str(client_id), rented_date, returned_date)
+        rental_operation = Operation(FunctionCall(self._remove_rental, rental.get_rental_id),
+                                     FunctionCall(self._add_rental, rental))
+        book_operation = Operation(FunctionCall(self._book_service.set_book_availability, book_id, True),
+                                   FunctionCall(self._book_service.set_book_availability, book_id, False))
+        return CascadedOperation(rental_operation, book_operation, command=command)
+
+    def _return_operation(self, command: dict) -> CascadedOperation:
+        """
+        Returning a book deletes its rental, so the undo adds the rental back from the command.
+        """
+        rental_id, book_id, client_id, rented_date, returned_date = command["rental"]
+        book_id = str(book_id)
+        rental = Rental(str(rental_id), book_id, str(client_id), rented_date, returned_date)
         op_rental = Operation(
-            FunctionCall(self._rental_repo.reset_returned_date, rental_id, original_returned_date),
-            FunctionCall(self._rental_repo.return_book, rental_id)
+            FunctionCall(self._add_rental, rental),
+            FunctionCall(self._return_rental, rental.get_rental_id)
         )
         op_book_status = Operation(
             FunctionCall(self._book_service.set_book_availability, book_id, False),
             FunctionCall(self._book_service.set_book_availability, book_id, True)
         )
-        self._undo_service.record(CascadedOperation(op_rental, op_book_status))
+        return CascadedOperation(op_rental, op_book_status, command=command)
 
     def get_rentals_by_book_id(self, book_id):
-        return [r for r in self._rental_repo if r.get_book_id == book_id]
+        return self._rental_repo.get_rentals_for_book(book_id)
+
+    def get_rentals_by_client_id(self, client_id):
+        return self._rental_repo.get_rentals_for_client(client_id)
 
     def delete_rentals_for_book(self, book_id):
         rentals_to_delete = self.get_rentals_by_book_id(book_id)
-        for rental in rentals_to_delete:
-            self._rental_repo.remove_rental(rental.get_rental_id)
+        with UnitOfWork(self._rental_repo):
+            for rental in rentals_to_delete:
+                self._remove_rental(rental.get_rental_id)
 
     def add_rental_object(self, rental_object):
-        self._rental_repo.add_rental(rental_object)
+        self._add_rental(rental_object)
 
     def delete_rental_by_id(self, rental_id):
-        self._rental_repo.remove_rental(rental_id)
+        self._remove_rental(rental_id)
 
     def delete_rental_book(self, book_id):
-        for rental in self._rental_repo:
-            if rental.get_book_id == book_id:
-                self._rental_repo.remove_rental(rental.get_rental_id)
+        for rental in self._rental_repo.get_rentals_for_book(book_id):
+            self._remove_rental(rental.get_rental_id)
+
+    def _add_rental(self, rental):
+        version = self._rental_repo.version
+        self._rental_repo.add_rental(rental)
+        self._publish("added", rental, version)
+
+    def _remove_rental(self, rental_id):
+        rental = self._rental_repo.get_rental(rental_id)
+        version = self._rental_repo.version
+        self._rental_repo.remove_rental(rental_id)
+        self._publish("removed", rental, version)
+
+    def _return_rental(self, rental_id):
+        try:
+            rental = self._rental_repo.get_rental(rental_id)
+        except RentalNotFoundError:
+            return
+        version = self._rental_repo.version
+        self._rental_repo.return_book(rental_id)
+        self._publish("removed", rental, version)
+
+    def _publish(self, event, rental, version):
+        for listener in self._listeners:
+            listener(event, rental, version)
+
+    @property
+    def rental_repo(self):
+        return self._rental_repo
 
     def list_rentals(self):
         rentals_display = []
@@ -0,0 +1,131 @@
+import math
+from array import array
+from hashlib import blake2b
+
+from src.services.ranked_counter import RankedCounter
+
+
+def hash64(key) -> int:
+    """
+    A 64 bit hash of str(key) that is the same in every process, unlike hash().
+    """
+    return int.from_bytes(blake2b(str(key).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class CountMinSketch:
+    """
+    Approximate counts in width * depth counters. An estimate is never below the true
+    count and exceeds it by at most epsilon * total with probability 1 - delta.
+    """
+    def __init__(self, epsilon: float, delta: float):
+        self.epsilon = epsilon
+        self.delta = delta
+        self._width = math.ceil(math.e / epsilon)
+        self._depth = math.ceil(math.log(1 / delta))
+        self._counters = [array("q", bytes(8 * self._width)) for _ in range(self._depth)]
+        self.total = 0
+
+    def add(self, key, count: int = 1):
+        """
+        Adds count to key; a negative count removes occurrences that were added before.
+        """
+        for row, column in zip(self._counters, self.__columns(key)):
+            row[column] += count
+        self.total += count
+
+    def estimate(self, key) -> int:
+        return max(0, min(row[column] for row, column in zip(self._counters, self.__columns(key))))
+
+    @property
+    def error_bound(self) -> int:
+        """
+        :return: how far above the true count an estimate can be, with probability 1 - delta
+        """
+        return math.ceil(self.epsilon * self.total)
+
+    def __columns(self, key):
+        """
+        The column of key in every row, from two halves of one hash (double hashing).
+        """
+        value = hash64(key)
+        first, second = value & 0xFFFFFFFF, (value >> 32) | 1
+        return [(first + row * second) % self._width for row in range(self._depth)]
+
+
+class SpaceSaving:
+    """
+    The heavy hitters of a stream in a fixed number of counters. A key that is not tracked
+    takes over the counter with the lowest count and inherits that count as its error, so a
+    tracked count is never below the true one and exceeds it by at most its error, which is
+    at most total / capacity. Every key occurring more than total / capacity times is tracked.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._counts = RankedCounter()
+        self._errors = {}
+        self._next_order = 0
+        self.total = 0
+
+    def add(self, key):
+        self.total += 1
+        count = self._counts.get(key)
+        if count is None:
+            count = 0
+            if len(self._counts) >= self.capacity:
+                evicted, count = self._counts.lowest()
+                self._counts.discard(evicted)
+                del self._errors[evicted]
+            self._errors[key] = count
+        self.__set(key, count + 1)
+
+    def remove(self, key):
+        """
+        Takes back one occurrence of key; untracked keys only lower the total.
+        """
+        self.total -= 1
+        count = self._counts.get(key)
+        if count is not None:
+            self.__set(key, count - 1)
+            self._errors[key] = min(self._errors[key], count - 1)
+
+    def top(self, k: int = None) -> list[tuple]:
+        """
+        :return: (key, count, error) triples, highest count first
+        """
+        return [(key, count, self._errors[key]) for key, count in self._counts.top(k)]
+
+    def __set(self, key, count: int):
+        self._counts.set(key, count, self._next_order)
+        self._next_order += 1
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct keys in 2 ** precision small registers, with a
+    relative standard error of about 1.04 / sqrt(2 ** precision).
+    """
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self._size = 1 << precision
+        self._registers = bytearray(self._size)
+
+    def add(self, key):
+        value = hash64(key)
+        register = value & (self._size - 1)
+        rest = value >> self.precision
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self._registers[register]:
+            self._registers[register] = rank
+
+    def estimate(self) -> int:
+        size = self._size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        raw = alpha * size * size / sum(2.0 ** -rank for rank in self._registers)
+        zeros = self._registers.count(0)
+        if raw <= 2.5 * size and zeros:
+            return round(size * math.log(size / zeros))
+        return round(raw)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self._size)
@@ -0,0 +1,234 @@
+import heapq
+from datetime import datetime
+from operator import itemgetter
+
+from src.services.ranked_counter import RankedCounter
+
+
+def rental_days(rental):
+    """
+    :return: the days between the rented and returned dates, or None if the book was not returned
+    :raises ValueError: a date that is not in ISO format
+    """
+    returned = rental.get_returned_date
+    if not returned or returned == "Not returned":
+        return None
+    if rental.get_returned_day is not None and rental.get_rented_day is not None:
+        return rental.get_returned_day - rental.get_rented_day
+    return (datetime.fromisoformat(returned) - datetime.fromisoformat(rental.get_rented_date)).days
+
+
+def select_top(pairs: list, k: int = None) -> list:
+    """
+    Sorts (key, value) pairs by value, highest first, keeping the given order among equal
+    values; with k, a heap keeps only the k largest, with the same result as sorting and slicing.
+    """
+    if k is None:
+        return sorted(pairs, key=itemgetter(1), reverse=True)
+    return heapq.nlargest(k, pairs, key=itemgetter(1))
+
+
+def sum_by_author(book_counts: list, author_of) -> list[tuple]:
+    """
+    :param book_counts: (book id, number of rentals) pairs
+    :param author_of: book id -> author
+    :return: (author, number of rentals) pairs, in the order each author first appears
+    """
+    counts = {}
+    for book_id, count in book_counts:
+        author = author_of(book_id)
+        counts[author] = counts.get(author, 0) + count
+    return list(counts.items())
+
+
+class RentalStatisticsEngine:
+    """
+    Rental aggregates kept up to date from the events published by RentalService, so that
+    reading the statistics does not go over every rental again.
+
+    Every rental gets a sequence number in repository order; readers get their keys in the
+    order of each key's first rental, which is the order a full recount would produce. When
+    the rental repository changed without an event the engine could apply (a rolled back
+    unit of work, a direct repository call), the aggregates are rebuilt on the next read.
+
+    With ranked=True the books and clients are also kept in RankedCounters, so the top k
+    is read in O(k) instead of being selected from every key.
+    """
+    def __init__(self, rental_service, ranked: bool = False):
+        self._rental_service = rental_service
+        self._ranked_books = RankedCounter() if ranked else None
+        self._ranked_clients = RankedCounter() if ranked else None
+        self._synced_version = None
+        self._next_seq = 0
+        self._rentals = {}
+        self._book_rentals = {}
+        self._client_rentals = {}
+        self._client_days = {}
+        self._date_errors = {}
+        rental_service.subscribe(self.on_rental_event)
+
+    def book_counts(self) -> list[tuple]:
+        """
+        :return: (book id, number of rentals) pairs, in the order of each book's first rental
+        """
+        self._sync()
+        self._book_rentals = self.__in_rental_order(self._book_rentals)
+        return [(book_id, len(rentals)) for book_id, rentals in self._book_rentals.items()]
+
+    def client_days(self) -> list[tuple]:
+        """
+        :return: (client id, days rented) pairs over the returned rentals, in the order of
+                 each client's first returned rental
+        """
+        self._sync()
+        if self._date_errors:
+            raise next(iter(self._date_errors.values()))
+        self._client_rentals = self.__in_rental_order(self._client_rentals)
+        return [(client_id, self._client_days[client_id]) for client_id in self._client_rentals]
+
+    def author_counts(self, author_of) -> list[tuple]:
+        """
+        :param author_of: book id -> author
+        :return: (author, number of rentals) pairs, in the order of each author's first rental
+        """
+        return sum_by_author(self.book_counts(), author_of)
+
+    def top_books(self, k: int = None) -> list[tuple]:
+        """
+        :return: (book id, number of rentals) pairs, most rented first; equal counts keep the
+                 order of each book's first rental
+        :param k: keep only the first k pairs
+        """
+        if self._ranked_books is not None:
+            self._sync()
+            return self._ranked_books.top(k)
+        return select_top(self.book_counts(), k)
+
+    def top_clients(self, k: int = None) -> list[tuple]:
+        """
+        :return: (client id, days rented) pairs, most days first; equal values keep the order
+                 of each client's first returned rental
+        :param k: keep only the first k pairs
+        """
+        if self._ranked_clients is not None:
+            self._sync()
+            if self._date_errors:
+                raise next(iter(self._date_errors.values()))
+            return self._ranked_clients.top(k)
+        return select_top(self.client_days(), k)
+
+    def on_rental_event(self, event: str, rental, version):
+        """
+        Applies one change published by RentalService.
+        :param event: "added", "removed" or "updated"
+        :param version: the rental repository version the change started from
+        """
+        if self._synced_version is None:
+            return
+        if version != self._synced_version or (event != "added" and rental.get_rental_id not in self._rentals):
+            self._synced_version = None
+            return
+
+        if event == "added":
+            self._add(rental, self._next_seq)
+            self._next_seq += 1
+        elif event == "removed":
+            self._remove(rental.get_rental_id)
+        else:
+            self._add(rental, self._remove(rental.get_rental_id))
+        self._synced_version = self._rental_service.rental_repo.version
+
+    def _sync(self):
+        version = self._rental_service.rental_repo.version
+        if self._synced_version is not None and self._synced_version == version:
+            return
+        self._next_seq = 0
+        self._rentals = {}
+        self._book_rentals = {}
+        self._client_rentals = {}
+        self._client_days = {}
+        self._date_errors = {}
+        for ranked in (self._ranked_books, self._ranked_clients):
+            if ranked is not None:
+                ranked.clear()
+        for rental in self._rental_service.get_all_rentals():
+            self._add(rental, self._next_seq)
+            self._next_seq += 1
+        self._synced_version = version
+
+    def _add(self, rental, seq: int):
+        rental_id = rental.get_rental_id
+        try:
+            days = rental_days(rental)
+        except ValueError as e:
+            days = None
+            self._date_errors[rental_id] = e
+
+        self._rentals[rental_id] = (seq, rental.get_book_id, rental.get_client_id, days)
+        self.__insert(self._book_rentals, rental.get_book_id, rental_id, seq)
+        self.__rank_book(rental.get_book_id)
+        if days is not None:
+            self.__insert(self._client_rentals, rental.get_client_id, rental_id, seq)
+            self._client_days[rental.get_client_id] = self._client_days.get(rental.get_client_id, 0) + days
+            self.__rank_client(rental.get_client_id)
+
+    def _remove(self, rental_id) -> int:
+        """
+        :return: the sequence number the rental had
+        """
+        seq, book_id, client_id, days = self._rentals.pop(rental_id)
+        self._date_errors.pop(rental_id, None)
+        self.__discard(self._book_rentals, book_id, rental_id)
+        self.__rank_book(book_id)
+        if days is not None:
+            self.__discard(self._client_rentals, client_id, rental_id)
+            if client_id in self._client_rentals:
+                self._client_days[client_id] -= days
+            else:
+                del self._client_days[client_id]
+            self.__rank_client(client_id)
+        return seq
+
+    def __rank_book(self, book_id):
+        if self._ranked_books is None:
+            return
+        rentals = self._book_rentals.get(book_id)
+        if rentals is None:
+            self._ranked_books.discard(book_id)
+        else:
+            self._ranked_books.set(book_id, len(rentals), next(iter(rentals.values())))
+
+    def __rank_client(self, client_id):
+        if self._ranked_clients is None:
+            return
+        rentals = self._client_rentals.get(client_id)
+        if rentals is None:
+            self._ranked_clients.discard(client_id)
+        else:
+            self._ranked_clients.set(client_id, self._client_days[client_id], next(iter(rentals.values())))
+
+    @staticmethod
+    def __insert(index: dict, key, rental_id, seq: int):
+        rentals = index.setdefault(key, {})
+        last_seq = next(reversed(rentals.values()), seq)
+        rentals[rental_id] = seq
+        if seq < last_seq:
+            index[key] = dict(sorted(rentals.items(), key=lambda item: item[1]))
+
+    @staticmethod
+    def __discard(index: dict, key, rental_id):
+        rentals = index[key]
+        del rentals[rental_id]
+        if not rentals:
+            del index[key]
+
+    @staticmethod
+    def __in_rental_order(index: dict) -> dict:
+        """
+        Keys move out of order only when a key's first rental is removed or updated; the
+        index is re-sorted by first rental then.
+        """
+        firsts = [next(iter(rentals.values())) for rentals in index.values()]
+        if all(a < b for a, b in zip(firsts, firsts[1:])):
+            return index
+        return dict(sorted(index.items(), key=lambda item: next(iter(item[1].values()))))
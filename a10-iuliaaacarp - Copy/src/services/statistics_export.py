@@ -0,0 +1,60 @@
+import csv
+import json
+import os
+
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+def export_format(filename: str, file_format: str = None) -> str:
+    """
+    :return: file_format, or the format named by the extension of filename
+    """
+    if file_format is None:
+        file_format = os.path.splitext(filename)[1].lstrip(".").lower()
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{file_format}', expected one of {', '.join(EXPORT_FORMATS)}")
+    return file_format
+
+
+def write_rows(rows, columns, fout, file_format: str) -> int:
+    """
+    Writes rows to fout as they are produced, so only the current row is held in memory.
+    :return: the number of rows written
+    """
+    count = 0
+    if file_format == "csv":
+        writer = csv.DictWriter(fout, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            fout.write(json.dumps(row, ensure_ascii=False))
+            fout.write("\n")
+            count += 1
+    return count
+
+
+def export_statistics(statistics_service, kind: str, filename: str, file_format: str = None, k: int = None,
+                      since: str = None, until: str = None) -> int:
+    """
+    Streams one statistic of StatisticsService.iter_rows into a CSV or JSON Lines file. The
+    rows go to a temporary file that replaces filename once complete, so a failed export
+    leaves an older file untouched.
+    :param file_format: "csv" or "jsonl"; None takes it from the extension of filename
+    :return: the number of rows written
+    """
+    file_format = export_format(filename, file_format)
+    rows = statistics_service.iter_rows(kind, k, since, until)
+    tmp_filename = filename + ".tmp"
+    try:
+        with open(tmp_filename, "w", newline="", encoding="utf-8") as fout:
+            count = write_rows(rows, statistics_service.EXPORT_COLUMNS[kind], fout, file_format)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    return count
@@ -1,23 +1,77 @@
-from collections import Counter
-from datetime import datetime
+from collections import OrderedDict
+from datetime import date, datetime
 
 from src.domain.statistics_domain import RentalStats
-from src.domain.rental_domain import Rental
+from src.domain.rental_domain import day_ordinal
+
+from src.services.statistics_engine import RentalStatisticsEngine, select_top, sum_by_author
+from src.services.rental_date_index import RentalDateIndex
+from src.services.numpy_statistics import NumpyRentalStatistics, np
+from src.services.parallel_statistics import ParallelRentalStatistics
+from src.services.approximate_statistics import ApproximateRentalStatistics, DEFAULT_EPSILON, DEFAULT_DELTA
 
 from src.services.book_service import BookService
 from src.services.client_service import ClientService
 from src.services.rental_service import RentalService
 
-from typing import List, Tuple, Dict
-
 class StatisticsService:
-    def __init__(self, rental_service: RentalService, book_service: BookService, client_service: ClientService):
+    EXPORT_COLUMNS = {
+        "books": ("title", "author", "rentals"),
+        "clients": ("client", "days_rented"),
+        "authors": ("author", "rentals"),
+    }
+    EXPORT_BATCH = 500
+    CACHE_SIZE = 64
+
+    def __init__(self, rental_service: RentalService, book_service: BookService, client_service: ClientService,
+                 ranked: bool = False, backend: str = "python", workers: int = None,
+                 parallel_threshold: int = None, approximate: bool = False,
+                 error_bounds: tuple = (DEFAULT_EPSILON, DEFAULT_DELTA)):
+        """
+        :param ranked: keep the books and clients ranked as rentals change, so a top k is read
+            in O(k); otherwise the top k is selected with a heap on every call
+        :param backend: "python" for the event-maintained aggregates, "numpy" for bulk
+            computation over rental columns; "numpy" falls back to "python" without NumPy;
+            "parallel" to aggregate shards of the rentals in worker processes
+        :param workers: worker processes for the "parallel" backend; None uses one per CPU
+        :param parallel_threshold: below this many rentals "parallel" stays in this process;
+            None uses DEFAULT_PARALLEL_THRESHOLD
+        :param approximate: answer the all-time most rented books and authors from fixed-size
+            sketches, with the error of each estimate in RentalStats.error
+        :param error_bounds: (epsilon, delta) of the sketches: estimates exceed the true count by
+            at most epsilon * rentals, with probability 1 - delta
+        """
         self._rental_service = rental_service
         self._book_service = book_service
         self._client_service = client_service
+        if backend == "numpy" and np is not None:
+            self._engine = NumpyRentalStatistics(rental_service)
+        elif backend == "parallel":
+            self._engine = ParallelRentalStatistics(rental_service, workers, parallel_threshold)
+        else:
+            self._engine = RentalStatisticsEngine(rental_service, ranked)
+        self._date_index = RentalDateIndex(rental_service)
+        self._sketches = None
+        if approximate:
+            self._sketches = ApproximateRentalStatistics(
+                rental_service, lambda book_id: book_service.get_book(book_id).get_author, *error_bounds)
+        self._cache = OrderedDict()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._author_map = {}
+        self._author_map_version = None
 
     @staticmethod
-    def _calculate_days_rented(rental):
+    def _calculate_days_rented(rental, today: int = None):
+        """
+        :param today: today's day ordinal, read once by callers that go over many rentals
+        """
+        if rental.get_rented_day is not None:
+            if rental.get_returned_date == "Not returned" or rental.get_returned_date == "":
+                return (date.today().toordinal() if today is None else today) - rental.get_rented_day
+            if rental.get_returned_day is not None:
+                return rental.get_returned_day - rental.get_rented_day
+
         rented_date = datetime.strptime(rental.get_rented_date, "%Y-%m-%d")
         if rental.get_returned_date == "Not returned" or rental.get_returned_date == "":
             returned_date = datetime.now()
@@ -27,60 +81,189 @@ class StatisticsService:
         time_span = returned_date - rented_date
         return time_span.days
 
-    def get_most_rented_books(self):
-        rentals = self._rental_service.get_all_rentals()
+    @staticmethod
+    def _window(since: str = None, until: str = None):
+        """
+        :return: the (since, until) day ordinals of an inclusive "YYYY-MM-DD" date window, or
+                 None when the window is open on both sides
+        """
+        if since is None and until is None:
+            return None
+        window = []
+        for value in (since, until):
+            ordinal = None if value is None else day_ordinal(value)
+            if value is not None and ordinal is None:
+                raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD")
+            window.append(ordinal)
+        return tuple(window)
 
-        counts = {}
-        for rental in rentals:
-            book_id = rental.get_book_id
-            counts[book_id] = counts.get(book_id, 0) + 1
+    def get_most_rented_books(self, k: int = None, since: str = None, until: str = None):
+        """
+        :param k: return only the k most rented books; ties keep the order of the first rental
+        :param since: count only the rentals rented on or after this "YYYY-MM-DD" date
+        :param until: count only the rentals rented on or before this "YYYY-MM-DD" date
+        """
+        return self._cached(("books", k, since, until),
+                            (self._book_service.book_repo, self._rental_service.rental_repo),
+                            self._most_rented_books, k, since, until)
 
-        result = []
-        for book_id, count in counts.items():
-            book = self._book_service.get_book(book_id)
-            result.append(RentalStats(book.get_title, count, book.get_author))
+    def get_most_active_clients(self, k: int = None, since: str = None, until: str = None):
+        """
+        :param k: return only the k most active clients; ties keep the order of the first rental
+        :param since, until: count only the rentals rented in this window, like get_most_rented_books
+        """
+        return self._cached(("clients", k, since, until),
+                            (self._client_service.client_repo, self._rental_service.rental_repo),
+                            self._most_active_clients, k, since, until)
 
-        result.sort(key=lambda x: x.value, reverse=True)
-        return result
+    def get_most_rented_authors(self, k: int = None, since: str = None, until: str = None):
+        """
+        :param k: return only the k most rented authors; ties keep the order of the first rental
+        :param since, until: count only the rentals rented in this window, like get_most_rented_books
+        """
+        return self._cached(("authors", k, since, until),
+                            (self._book_service.book_repo, self._rental_service.rental_repo),
+                            self._most_rented_authors, k, since, until)
 
-    def get_most_active_clients(self):
-        rentals = self._rental_service.get_all_rentals()
-        client_days = {}
+    def get_distinct_clients(self) -> RentalStats:
+        """
+        :return: the number of clients with rentals; estimated with a HyperLogLog in approximate
+                 mode, where it also counts clients whose rentals were removed
+        """
+        if self._sketches is not None:
+            estimate, error = self._sketches.distinct_clients()
+            return RentalStats("Distinct clients", estimate, error=error)
+        clients = {rental.get_client_id for rental in self._rental_service.get_all_rentals()}
+        return RentalStats("Distinct clients", len(clients), error=0)
 
-        for rental in rentals:
-            returned = rental.get_returned_date
-            if returned and returned != "Not returned":
-                start = datetime.fromisoformat(rental.get_rented_date)
-                end = datetime.fromisoformat(rental.get_returned_date)
-                days = (end - start).days
+    def close(self):
+        """
+        Stops the worker processes of the "parallel" backend, if it started any.
+        """
+        if isinstance(self._engine, ParallelRentalStatistics):
+            self._engine.close()
 
-                client_days[rental.get_client_id] = (
-                        client_days.get(rental.get_client_id, 0) + days
-                )
+    @property
+    def cache_hits(self) -> int:
+        return self._cache_hits
 
-        result = []
-        for client_id, days in client_days.items():
-            client = self._client_service.get_client(client_id)
-            result.append(RentalStats(client.get_client_name, days))
+    @property
+    def cache_misses(self) -> int:
+        return self._cache_misses
 
-        result.sort(key=lambda x: x.value, reverse=True)
-        return result
+    def _cached(self, key: tuple, repositories: tuple, compute, *args) -> list:
+        """
+        Returns the result stored under key while the versions of the repositories it was
+        computed from are unchanged; any write to one of them, undo and redo included,
+        bumps its version and the result is computed again. At most CACHE_SIZE results are
+        kept, the least recently used one being dropped first.
+        """
+        versions = tuple(repository.version for repository in repositories)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == versions:
+            self._cache_hits += 1
+            self._cache.move_to_end(key)
+        else:
+            self._cache_misses += 1
+            entry = self._cache[key] = (versions, compute(*args))
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return list(entry[1])
+
+    def _authors(self, book_counts: list) -> dict:
+        """
+        :return: the book id -> author map, memoized until a book is added, removed or edited,
+                 so renting and returning, which only flip availability, keep it; the books of
+                 book_counts that are not in it yet are read in one batch
+        """
+        version = self._book_service.book_repo.catalog_version
+        if self._author_map_version != version:
+            self._author_map = {}
+            self._author_map_version = version
+        missing = [book_id for book_id, _ in book_counts if book_id not in self._author_map]
+        if missing:
+            for book_id, book in self._book_service.get_books(missing).items():
+                self._author_map[book_id] = book.get_author
+        return self._author_map
+
+    def iter_rows(self, kind: str, k: int = None, since: str = None, until: str = None):
+        """
+        Yields the rows of one statistic as dicts keyed by EXPORT_COLUMNS[kind], best first,
+        without building the RentalStats list; books and clients are read EXPORT_BATCH at a
+        time, so only one batch of entities is held while the rows are consumed.
+        :param kind: "books", "clients" or "authors"
+        :param k, since, until: as for get_most_rented_books
+        """
+        if kind not in self.EXPORT_COLUMNS:
+            raise ValueError(f"Unknown statistic '{kind}', expected one of {', '.join(self.EXPORT_COLUMNS)}")
+        return self._rows(kind, k, since, until)
 
-    def get_most_rented_authors(self):
-        rentals = self._rental_service.get_all_rentals()
-        author_counts = {}
+    def _rows(self, kind: str, k: int = None, since: str = None, until: str = None):
+        if kind == "authors":
+            for author, count in self._top_authors(k, since, until):
+                yield {"author": author, "rentals": count}
+            return
 
-        for rental in rentals:
-            book = self._book_service.get_book(rental.get_book_id)
-            author = book.get_author
-            author_counts[author] = author_counts.get(author, 0) + 1
+        pairs = self._top_books(k, since, until) if kind == "books" else self._top_clients(k, since, until)
+        for start in range(0, len(pairs), self.EXPORT_BATCH):
+            batch = pairs[start:start + self.EXPORT_BATCH]
+            ids = [key for key, _ in batch]
+            if kind == "books":
+                books = self._book_service.get_books(ids)
+                for book_id, count in batch:
+                    yield {"title": books[book_id].get_title, "author": books[book_id].get_author, "rentals": count}
+            else:
+                clients = self._client_service.get_clients(ids)
+                for client_id, days in batch:
+                    yield {"client": clients[client_id].get_client_name, "days_rented": days}
 
-        result = [
-            RentalStats(author, count)
-            for author, count in author_counts.items()
-        ]
+    def _top_books(self, k: int = None, since: str = None, until: str = None) -> list[tuple]:
+        window = self._window(since, until)
+        if window is None:
+            return self._engine.top_books(k)
+        return select_top(self._date_index.book_counts(*window), k)
+
+    def _top_clients(self, k: int = None, since: str = None, until: str = None) -> list[tuple]:
+        window = self._window(since, until)
+        if window is None:
+            return self._engine.top_clients(k)
+        return select_top(self._date_index.client_days(*window), k)
+
+    def _top_authors(self, k: int = None, since: str = None, until: str = None) -> list[tuple]:
+        window = self._window(since, until)
+        if window is None:
+            book_counts = self._engine.book_counts()
+            author_counts = self._engine.author_counts(self._authors(book_counts).__getitem__)
+        else:
+            book_counts = self._date_index.book_counts(*window)
+            author_counts = sum_by_author(book_counts, self._authors(book_counts).__getitem__)
+        return select_top(author_counts, k)
 
-        result.sort(key=lambda x: x.value, reverse=True)
+    def _most_rented_books(self, k: int = None, since: str = None, until: str = None):
+        if self._sketches is not None and since is None and until is None:
+            estimates = self._sketches.top_books(k)
+            books = self._book_service.get_books([book_id for book_id, _, _ in estimates])
+            return [RentalStats(books[book_id].get_title, count, books[book_id].get_author, error)
+                    for book_id, count, error in estimates]
+        top_books = self._top_books(k, since, until)
+        books = self._book_service.get_books([book_id for book_id, _ in top_books])
+        result = []
+        for book_id, count in top_books:
+            book = books[book_id]
+            result.append(RentalStats(book.get_title, count, book.get_author))
         return result
 
+    def _most_active_clients(self, k: int = None, since: str = None, until: str = None):
+        top_clients = self._top_clients(k, since, until)
+        clients = self._client_service.get_clients([client_id for client_id, _ in top_clients])
+        result = []
+        for client_id, days in top_clients:
+            client = clients[client_id]
+            result.append(RentalStats(client.get_client_name, days))
+        return result
 
+    def _most_rented_authors(self, k: int = None, since: str = None, until: str = None):
+        if self._sketches is not None and since is None and until is None:
+            return [RentalStats(author, count, error=error) for author, count, error in self._sketches.top_authors(k)]
+        return [RentalStats(author, count) for author, count in self._top_authors(k, since, until)]
@@ -1,3 +1,53 @@
+import sys
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from src.repository.unit_of_work import UnitOfWork
+
+
+def estimate_size(value, depth: int = 2) -> int:
+    """
+    Rough number of bytes kept alive by value: its own size plus, depth levels down, the
+    items of containers and the attributes of objects. Functions and bound methods are
+    shared with the rest of the program and count for nothing.
+    """
+    if callable(value):
+        return 0
+    size = sys.getsizeof(value)
+    if depth == 0 or isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        items = list(value.keys()) + list(value.values())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = value
+    else:
+        items = [getattr(value, name) for name in getattr(type(value), "__slots__", ()) if hasattr(value, name)]
+        items += list(getattr(value, "__dict__", {}).values())
+    return size + sum(estimate_size(item, depth - 1) for item in items)
+
+
+def intern_id(value):
+    """
+    :return: value, with string ids interned so every history entry naming an entity shares
+             one copy of its id
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def merged_command(first: dict, later: dict) -> dict:
+    """
+    Combines the commands of two consecutive updates of one entity: the state before first and
+    the state after later. Field-level deltas (dicts) are merged field by field, so a field
+    changed only by later still gets its earlier value back.
+    """
+    before, after = first["before"], later["after"]
+    if isinstance(before, dict):
+        before = {**later["before"], **before}
+        after = {**first["after"], **after}
+    return dict(first, before=before, after=after)
+
+
 class FunctionCall:
     def __init__(self, function_name, *function_params):
         self._function_name = function_name
@@ -6,10 +56,21 @@ class FunctionCall:
     def call(self):
         self._function_name(*self._function_params)
 
+    def estimated_size(self) -> int:
+        return sys.getsizeof(self) + estimate_size(self._function_params)
+
 class Operation:
-    def __init__(self, func_undo: FunctionCall, func_redo: FunctionCall):
+    def __init__(self, func_undo: FunctionCall, func_redo: FunctionCall, coalesce_key=None, command: dict = None):
+        """
+        :param coalesce_key: identifies the entity an update operation overwrites; UndoService
+            can merge consecutive operations with the same key
+        :param command: the operation as data, {"name": ..., entity ids, before/after values},
+            from which the service registered under that name rebuilds it after a restart
+        """
         self._func_undo = func_undo
         self._func_redo = func_redo
+        self.coalesce_key = coalesce_key
+        self.command = command
 
     def undo(self):
         self._func_undo.call()
@@ -17,6 +78,20 @@ class Operation:
     def redo(self):
         self._func_redo.call()
 
+    def merged(self, later: "Operation") -> "Operation":
+        """
+        :return: one operation that undoes to the state before self and redoes to the state
+                 after later
+        """
+        command = None
+        if self.command is not None and later.command is not None:
+            command = merged_command(self.command, later.command)
+        return Operation(self._func_undo, later._func_redo, self.coalesce_key, command)
+
+    def estimated_size(self) -> int:
+        return (sys.getsizeof(self) + self._func_undo.estimated_size() + self._func_redo.estimated_size()
+                + estimate_size(self.command))
+
 class UndoRedoException(Exception):
     pass
 
@@ -26,12 +101,16 @@ class NoOperationsToUndo(UndoRedoException):
 class NoOperationsToRedo(UndoRedoException):
     pass
 
+class UndoFailed(UndoRedoException):
+    pass
+
 class CascadedOperation:
     """
     Groups multiple Operation objects into a single undoable/redoable unit.
     """
-    def __init__(self, *operations):
+    def __init__(self, *operations, command: dict = None):
         self._operations = operations
+        self.command = command
 
     def undo(self):
         """
@@ -47,37 +126,265 @@ class CascadedOperation:
         for op in self._operations:
             op.redo()
 
+    def estimated_size(self) -> int:
+        return sys.getsizeof(self) + sum(op.estimated_size() for op in self._operations) + estimate_size(self.command)
+
+class CommandOperation:
+    """
+    An operation kept as its command only. The Operation or CascadedOperation it stands for is
+    built by the registered builder each time undo or redo runs, so the history holds no
+    domain objects and no FunctionCall until they are needed.
+    """
+    __slots__ = ("command", "coalesce_key", "_build")
+
+    def __init__(self, command: dict, build, coalesce_key=None):
+        """
+        :param build: command -> the Operation or CascadedOperation it describes
+        """
+        self.command = command
+        self.coalesce_key = coalesce_key
+        self._build = build
+
+    def undo(self):
+        self._build(self.command).undo()
+
+    def redo(self):
+        self._build(self.command).redo()
+
+    def merged(self, later: "CommandOperation") -> "CommandOperation":
+        return CommandOperation(merged_command(self.command, later.command), self._build, self.coalesce_key)
+
+    def estimated_size(self) -> int:
+        return sys.getsizeof(self) + estimate_size(self.command, depth=4)
+
+HistoryEntry = namedtuple("HistoryEntry", "operation size recorded_at batch seq")
+
+LOG_PAGE = 100
+
+
 class UndoService:
-    def __init__(self):
-        self.__history = []
-        self.__index = 0
+    """
+    Undo and redo stacks kept as deques, so recording, undoing and redoing are O(1).
+
+    The history can be bounded by a number of operations, an estimated number of bytes, or
+    both; when recording goes over a bound the oldest operations are dropped first, though
+    the latest one is always kept, and dropped_operations / dropped_bytes report how much
+    history was lost.
+
+    Coalescing is opt-in: an operation with a coalesce_key is merged into the previous one
+    when both have the same key and they were recorded within coalesce_window seconds of
+    each other or inside the same batch(). The merged operation keeps only the original
+    and the final state, so undoing it reverts the whole run of edits at once.
+
+    With a CommandLog, the command of every recorded operation and every undo/redo move is
+    appended to it, and the history of a previous run is read back lazily: the redo entries
+    on the first undo, redo or record, and the older undo entries LOG_PAGE at a time when
+    undo reaches the oldest one in memory. They come back as CommandOperations, built by the
+    builders the services register() only when they run. An operation without a command is logged as a
+    gap, and a later run cannot undo past it.
+    """
+    def __init__(self, *repositories, max_operations: int = None, max_bytes: int = None,
+                 coalesce_window: float = None, command_log=None):
+        """
+        :param repositories: the repositories touched by the recorded operations; every undo/redo
+            runs as one unit of work over them, so a cascaded operation writes each file once
+        :param max_operations: the most operations kept for undo and redo; None for no limit
+        :param max_bytes: the most bytes, as estimated by estimated_size(), kept for undo and
+            redo; None for no limit
+        :param coalesce_window: seconds within which updates of the same entity are merged;
+            None merges only inside a batch
+        :param command_log: a CommandLog the history is kept in across runs; None keeps it in
+            memory only
+        """
+        self.__undo = deque()
+        self.__redo = []
+        self.__repositories = repositories
+        self.__max_operations = max_operations
+        self.__max_bytes = max_bytes
+        self.__bytes = 0
+        self.__dropped_operations = 0
+        self.__dropped_bytes = 0
+        self.__coalesce_window = coalesce_window
+        self.__batch = None
+        self.__builders = {}
+        self.__log = command_log
+        self.__cursor = 0
+        self.__top = 0
+        self.__floor = 1
+        self.__logged = None
+        if command_log is not None:
+            if command_log.size >= command_log.compact_threshold:
+                command_log.compact(max_operations)
+            self.__cursor, self.__top, self.__floor = command_log.position()
+            self.__logged = command_log.commands(self.__top, self.__floor)
+
+    def __len__(self):
+        """
+        :return: the number of operations kept, undoable and redoable; logged operations count
+                 once they have been read back
+        """
+        return len(self.__undo) + len(self.__redo)
+
+    @property
+    def dropped_operations(self) -> int:
+        return self.__dropped_operations
+
+    @property
+    def dropped_bytes(self) -> int:
+        return self.__dropped_bytes
+
+    @property
+    def history_bytes(self) -> int:
+        """
+        :return: the estimated size of the kept operations; 0 unless max_bytes is set
+        """
+        return self.__bytes
+
+    def register(self, name: str, build):
+        """
+        :param build: command -> the Operation or CascadedOperation it describes, used for
+            the commands read back from the log
+        """
+        self.__builders[name] = build
+
+    @contextmanager
+    def batch(self, name: str):
+        """
+        Merges the updates of the same entity recorded inside the with block, whatever the
+        time between them.
+        """
+        outer = self.__batch
+        self.__batch = name
+        try:
+            yield self
+        finally:
+            self.__batch = outer
 
     def undo(self):
         """
-        Reverts the last recorded operation.
+        Reverts the last recorded operation. An operation that cannot be reverted is still
+        moved to the redo stack, so it does not block the older history, and UndoFailed is
+        raised.
         """
-        if self.__index == 0:
+        self.__read_redo()
+        if not self.__undo:
+            self.__read_undo()
+        if not self.__undo:
             raise NoOperationsToUndo("No operations to undo.")
-        self.__index -= 1
-        operation = self.__history[self.__index]
-        operation.undo()
+        entry = self.__undo[-1]
+        try:
+            with UnitOfWork(*self.__repositories):
+                entry.operation.undo()
+        except Exception as e:
+            self.__redo.append(self.__undo.pop())
+            self.__move(entry.seq - 1)
+            raise UndoFailed(f"The last operation could not be undone and was skipped: {e}") from e
+        self.__redo.append(self.__undo.pop())
+        self.__move(entry.seq - 1)
 
     def redo(self):
         """
         Re-performs the last undone operation.
         """
-        if self.__index == len(self.__history):
+        self.__read_redo()
+        if not self.__redo:
             raise NoOperationsToRedo("No operations to redo.")
-        operation = self.__history[self.__index]
-        operation.redo()
-        self.__index += 1
+        entry = self.__redo[-1]
+        with UnitOfWork(*self.__repositories):
+            entry.operation.redo()
+        self.__undo.append(self.__redo.pop())
+        self.__move(entry.seq)
 
     def record(self, operation):
         """
-        Records a new operation, discarding any operations that were in the redo stack.
+        Records a new operation, discarding any operations that were in the redo stack, then
+        drops the oldest operations until the history is within its bounds.
         :param operation: An Operation or CascadedOperation object.
         """
-        self.__history = self.__history[:self.__index]
-        self.__history.append(operation)
-        self.__index = len(self.__history)
+        self.__read_redo()
+        now = time.monotonic()
+        seq = self.__cursor + 1
+        if not self.__redo and self.__coalesces(operation, now):
+            previous = self.__undo.pop()
+            self.__bytes -= previous.size
+            operation = previous.operation.merged(operation)
+            seq = previous.seq
+        while self.__redo:
+            self.__bytes -= self.__redo.pop().size
+        size = operation.estimated_size() if self.__max_bytes is not None else 0
+        self.__undo.append(HistoryEntry(operation, size, now, self.__batch, seq))
+        self.__bytes += size
+        self.__cursor = self.__top = seq
+        if self.__max_operations is not None:
+            self.__floor = max(self.__floor, seq - self.__max_operations + 1)
+        if self.__log is not None:
+            self.__log.append_command(seq, getattr(operation, "command", None), self.__floor)
+        while len(self.__undo) > 1 and self.__over_budget(len(self)):
+            dropped = self.__undo.popleft().size
+            self.__logged = None
+            self.__floor = self.__undo[0].seq
+            self.__bytes -= dropped
+            self.__dropped_operations += 1
+            self.__dropped_bytes += dropped
+
+    def __move(self, cursor: int):
+        self.__cursor = cursor
+        if self.__log is not None:
+            self.__log.append_position(cursor, self.__top, self.__floor)
+
+    def __read_redo(self):
+        """
+        Reads back the redo entries of the previous run, which come first in the log.
+        """
+        while self.__logged is not None and self.__top > self.__cursor + len(self.__redo):
+            entry = self.__read_entry()
+            if entry is None:
+                self.__redo.clear()
+                self.__top = self.__cursor
+                return
+            self.__redo.append(entry)
+
+    def __read_undo(self):
+        """
+        Reads back up to LOG_PAGE older entries, as far as the bounds allow.
+        """
+        for _ in range(LOG_PAGE):
+            if self.__logged is None or self.__over_budget(len(self) + 1):
+                return
+            entry = self.__read_entry()
+            if entry is None:
+                return
+            if self.__max_bytes is not None and self.__bytes + entry.size > self.__max_bytes:
+                self.__logged = None
+                return
+            self.__undo.appendleft(entry)
+            self.__bytes += entry.size
+
+    def __read_entry(self):
+        """
+        :return: the next older logged entry, or None at the start of the log or at a gap,
+                 after which nothing more is read
+        """
+        seq, command = next(self.__logged, (None, None))
+        if command is None or seq < self.__floor:
+            self.__logged = None
+            return None
+        operation = CommandOperation(command, self.__builders[command["name"]])
+        size = operation.estimated_size() if self.__max_bytes is not None else 0
+        return HistoryEntry(operation, size, float("-inf"), None, seq)
+
+    def __coalesces(self, operation, now: float) -> bool:
+        key = getattr(operation, "coalesce_key", None)
+        if key is None or not self.__undo:
+            return False
+        previous = self.__undo[-1]
+        if getattr(previous.operation, "coalesce_key", None) != key:
+            return False
+        if self.__batch is not None and previous.batch == self.__batch:
+            return True
+        return self.__coalesce_window is not None and now - previous.recorded_at <= self.__coalesce_window
 
+    def __over_budget(self, operations: int) -> bool:
+        if self.__max_operations is not None and operations > self.__max_operations:
+            return True
+        return self.__max_bytes is not None and self.__bytes > self.__max_bytes
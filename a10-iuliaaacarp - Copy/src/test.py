@@ -1,18 +1,36 @@
+import csv
+import json
+import os
+import pickle
+import tempfile
 import unittest
+from datetime import date
 from unittest.mock import MagicMock
 
 from src.domain.book_domain import Book
 from src.domain.client_domain import Client
 from src.domain.rental_domain import Rental
 
-from src.repository.book_repository import BookMemoryRepository, DuplicateIDError, BookNotFoundError
-from src.repository.client_repository import ClientMemoryRepository
-from src.repository.rental_repository import RentalMemoryRepository, RentalNotFoundError
+from src.repository.book_repository import BookMemoryRepository, BookJournalFileRepository, BookTextFileRepository, \
+    BookSqliteRepository, BookRecordFileRepository, DuplicateIDError, BookNotFoundError
+from src.repository.client_repository import ClientMemoryRepository, ClientSqliteRepository, ClientNotFoundError
+from src.repository.rental_repository import RentalMemoryRepository, RentalTextFileRepository, RentalSqliteRepository, \
+    RentalColumnarRepository, RentalRecordFileRepository, RentalNotFoundError, DuplicateIDError as RentalDuplicateIDError
+from src.repository.unit_of_work import UnitOfWork
+from src.repository.repository_iterator import ConcurrentModificationError
 
 from src.services.book_service import BookService
+from src.services.client_service import ClientService
 from src.services.rental_service import RentalService, RentalError
-from src.services.undo_service import UndoService, Operation, FunctionCall, NoOperationsToUndo
+from src.services.undo_service import UndoService, Operation, FunctionCall, NoOperationsToUndo, UndoFailed, \
+    merged_command
+from src.services.command_log import CommandLog
 from src.services.statistics_service import StatisticsService
+from src.services.approximate_statistics import ApproximateRentalStatistics
+from src.services.rental_date_index import RentalDateIndex
+from src.services.numpy_statistics import np
+from src.services.statistics_export import export_statistics
+from src.services.sketches import CountMinSketch, SpaceSaving, HyperLogLog
 
 
 class TestDomain(unittest.TestCase):
@@ -38,6 +56,16 @@ class TestDomain(unittest.TestCase):
         self.assertEqual(client.get_client_name, "John Doe")
         self.assertIn("John Doe", str(client))
 
+    def test_pickle_compatibility(self):
+        old_state = {'_book_id': '9', '_title': 'Old', '_author': 'Pickle', '_is_available': False}
+        book = Book.__new__(Book)
+        book.__setstate__(old_state)
+        self.assertEqual(book.get_title, "Old")
+        self.assertFalse(book.get_is_available)
+        self.assertFalse(hasattr(book, "__dict__"))
+        copied = pickle.loads(pickle.dumps(book))
+        self.assertEqual(str(copied), str(book))
+
     def test_rental_creation(self):
         rental = Rental("100", "B1", "C1", "2023-01-01", "2023-01-10")
         self.assertEqual(rental.get_rental_id, "100")
@@ -45,6 +73,19 @@ class TestDomain(unittest.TestCase):
         self.assertEqual(rental.get_client_id, "C1")
         self.assertEqual(rental.get_rented_date, "2023-01-01")
 
+    def test_rental_day_ordinals(self):
+        rental = Rental("100", "B1", "C1", "2023-01-01", "2023-01-10")
+        self.assertEqual(rental.get_returned_day - rental.get_rented_day, 9)
+        rental.get_returned_date = "Not returned"
+        self.assertIsNone(rental.get_returned_day)
+        self.assertIsNone(Rental("101", "B1", "C1", "2023-1-1", "").get_rented_day)
+
+        old_state = {'_rental_id': '9', '_book_id': 'B', '_client_id': 'C', '_rented_date': '2023-01-01',
+                     '_returned_date': '2023-01-03'}
+        rental = Rental.__new__(Rental)
+        rental.__setstate__(old_state)
+        self.assertEqual(rental.get_returned_day - rental.get_rented_day, 2)
+
 
 class TestBookRepository(unittest.TestCase):
     def setUp(self):
@@ -70,6 +111,262 @@ class TestBookRepository(unittest.TestCase):
         book = self.repo.get_book("1")
         self.assertEqual(book.get_title, "New Title")
 
+    def test_iteration_detects_modification(self):
+        self.repo.add_book(Book("2", "Second", "Author", True))
+        with self.assertRaises(ConcurrentModificationError):
+            for book in self.repo:
+                self.repo.set_availability(book.get_book_id, False)
+        for book in self.repo.snapshot():
+            self.repo.remove_book(book.get_title)
+        self.assertEqual(len(self.repo), 0)
+
+    def test_title_index_follows_mutations(self):
+        self.assertEqual(self.repo.find_book_id_by_title("TEST BOOK"), "1")
+        self.repo.update_book("1", "Renamed", "Test Author")
+        self.assertIsNone(self.repo.find_book_id_by_title("Test Book"))
+        self.assertEqual(self.repo.find_book_id_by_title("renamed"), "1")
+
+        undo_service = UndoService()
+        service = BookService(self.repo, undo_service, None)
+        service.remove_book("Renamed")
+        self.assertIsNone(self.repo.find_book_id_by_title("Renamed"))
+        undo_service.undo()
+        self.assertEqual(service.search_title_id("RENAMED"), "1")
+
+
+class TestTrigramSearch(unittest.TestCase):
+    def setUp(self):
+        self.repo = BookMemoryRepository()
+        self.repo.add_book(Book("1001", "The Hobbit", "J.R.R. Tolkien", True))
+        self.repo.add_book(Book("1002", "Hobbit Tales", "Someone Else", True))
+        self.repo.add_book(Book("2001", "Dune", "Frank Herbert", True))
+
+    def test_matches_substring_semantics(self):
+        self.assertEqual([b.get_book_id for b in self.repo.search_by_title("HOBBIT")], ["1001", "1002"])
+        self.assertEqual([b.get_book_id for b in self.repo.search_by_title("bit t")], ["1002"])
+        self.assertEqual([b.get_book_id for b in self.repo.search_by_author("EL")], ["1002"])
+        self.assertEqual([b.get_book_id for b in self.repo.search_by_id("00")], ["1001", "1002", "2001"])
+        self.assertEqual(self.repo.search_by_title("hobbits"), [])
+
+    def test_follows_updates(self):
+        self.repo.update_book("1001", "The Silmarillion", "J.R.R. Tolkien")
+        self.assertEqual([b.get_book_id for b in self.repo.search_by_title("hobbit")], ["1002"])
+        self.assertEqual([b.get_book_id for b in self.repo.search_by_title("silma")], ["1001"])
+        self.repo.remove_book("Dune")
+        self.assertEqual(self.repo.search_by_author("herbert"), [])
+
+
+class TestBookJournalRepository(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "books.txt")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_replay_after_restart(self):
+        repo = BookJournalFileRepository(self.filename)
+        repo.add_book(Book("1", "Kept", "Author", True))
+        repo.add_book(Book("2", "Removed", "Author", True))
+        repo.set_availability("1", False)
+        repo.update_book("1", "Kept Updated", "Author")
+        repo.remove_book("Removed")
+        repo.close()
+
+        self.assertFalse(os.path.exists(self.filename))
+        reloaded = BookJournalFileRepository(self.filename)
+        self.assertEqual(len(reloaded), 1)
+        self.assertEqual(reloaded.find_book_id_by_title("kept updated"), "1")
+        self.assertEqual(reloaded.get_book("1").get_title, "Kept Updated")
+        self.assertFalse(reloaded.is_available("1"))
+        reloaded.close()
+
+    def test_compaction_truncates_journal(self):
+        repo = BookJournalFileRepository(self.filename, compact_threshold=200)
+        for i in range(20):
+            repo.add_book(Book(str(i), f"Title {i}", "Author", True))
+        repo.compact()
+        repo.set_availability("3", False)
+        repo.close()
+
+        self.assertLess(os.path.getsize(self.filename + ".journal"), 200)
+        reloaded = BookJournalFileRepository(self.filename)
+        self.assertEqual(len(reloaded), 20)
+        self.assertFalse(reloaded.is_available("3"))
+        reloaded.close()
+
+
+class TestUnitOfWork(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.book_repo = BookTextFileRepository(os.path.join(self.directory.name, "books.txt"))
+        self.rental_repo = RentalTextFileRepository(os.path.join(self.directory.name, "rentals.txt"))
+        self.book_repo.add_book(Book("B1", "Cascade", "Author", True))
+        for i in range(50):
+            self.book_repo.add_book(Book(f"X{i}", f"Other {i}", "Author", True))
+            self.rental_repo.add_rental(Rental(f"R{i}", f"X{i}", "C1", "2023-01-01", ""))
+        self.flushes = []
+        for repo in (self.book_repo, self.rental_repo):
+            repo._flush = self._counting(repo._flush)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _counting(self, flush):
+        def counted():
+            self.flushes.append(flush)
+            flush()
+        return counted
+
+    def test_each_file_flushed_once(self):
+        with UnitOfWork(self.book_repo, self.rental_repo):
+            for i in range(50):
+                self.rental_repo.remove_rental(f"R{i}")
+                self.book_repo.set_availability(f"X{i}", False)
+        self.assertEqual(len(self.flushes), 2)
+        self.assertEqual(len(RentalTextFileRepository(self.rental_repo._filename)), 0)
+
+    def test_failed_flush_rolls_back(self):
+        def failing():
+            raise OSError("disk full")
+        self.rental_repo._flush = failing
+        with self.assertRaises(OSError):
+            with UnitOfWork(self.book_repo, self.rental_repo):
+                self.rental_repo.remove_rental("R1")
+                self.book_repo.update_book("X1", "Changed", "Someone")
+                self.book_repo.remove_book("Cascade")
+        self.assertEqual(len(self.rental_repo), 50)
+        self.assertEqual(self.book_repo.get_book("X1").get_title, "Other 1")
+        self.assertEqual(self.book_repo.get_book("B1").get_title, "Cascade")
+
+
+class TestSqliteRepository(unittest.TestCase):
+    def setUp(self):
+        self.book_repo = BookSqliteRepository(":memory:")
+        self.rental_repo = RentalSqliteRepository(":memory:")
+        self.book_repo.add_book(Book("1", "Test Book", "Test Author", True))
+        self.rental_repo.add_rental(Rental("R1", "1", "C1", "2023-01-01", ""))
+
+    def test_book_round_trip(self):
+        with self.assertRaises(DuplicateIDError):
+            self.book_repo.add_book(Book("1", "Other", "Other", True))
+        self.book_repo.set_availability("1", False)
+        self.assertFalse(self.book_repo.is_available("1"))
+        removed = self.book_repo.remove_book("TEST book")
+        self.assertEqual(removed.get_book_id, "1")
+        self.assertEqual(len(self.book_repo), 0)
+
+    def test_get_books_in_chunks(self):
+        self.book_repo.MAX_PARAMETERS = 2
+        for i in range(2, 6):
+            self.book_repo.add_book(Book(str(i), f"Book {i}", f"Author {i}", True))
+        books = self.book_repo.get_books(["5", "1", "3", "5", "4"])
+        self.assertEqual(list(books), ["5", "1", "3", "4"])
+        self.assertEqual(books["3"].get_author, "Author 3")
+        with self.assertRaises(BookNotFoundError):
+            self.book_repo.get_books(["1", "9"])
+
+        client_repo = ClientSqliteRepository(":memory:")
+        client_repo.add_client(Client("C1", "Client"))
+        self.assertEqual(client_repo.get_clients(["C1"])["C1"].get_client_name, "Client")
+        with self.assertRaises(ClientNotFoundError):
+            client_repo.get_clients(["C1", "C2"])
+
+    def test_rental_duplicate_book(self):
+        with self.assertRaises(RentalDuplicateIDError):
+            self.rental_repo.add_rental(Rental("R2", "1", "C2", "2023-01-02", ""))
+        self.rental_repo.remove_rental("R1")
+        with self.assertRaises(RentalNotFoundError):
+            self.rental_repo.remove_rental("R1")
+
+    def test_unit_of_work_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with UnitOfWork(self.book_repo, self.rental_repo):
+                self.rental_repo.remove_rental("R1")
+                self.book_repo.update_book("1", "Changed", "Someone")
+                raise RuntimeError()
+        self.assertEqual(len(self.rental_repo), 1)
+        self.assertEqual(self.book_repo.get_book("1").get_title, "Test Book")
+
+    def test_search_reads_trigram_candidates_only(self):
+        for i in range(2, 500):
+            self.book_repo.add_book(Book(str(i), f"Book {i}", f"Author {i % 7}", True))
+        self.book_repo.update_book("250", "Renamed Tome", "Author 5")
+        self.book_repo.set_availability("251", False)
+        checked = []
+        self.book_repo._connection.create_function("py_lower", 1, lambda text: checked.append(text) or str(text).lower())
+        self.assertEqual([book.get_book_id for book in self.book_repo.search_by_title("OK 25")],
+                         ["25", "251", "252", "253", "254", "255", "256", "257", "258", "259"])
+        self.assertEqual([book.get_book_id for book in self.book_repo.search_by_title("tome")], ["250"])
+        self.assertLess(len(checked), 20)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "clients.db")
+            client_repo = ClientSqliteRepository(filename)
+            client_repo.add_client(Client("C1", "Ann Smith"))
+            client_repo._connection.execute("DROP TABLE clients_search")
+            client_repo.close()
+            client_repo = ClientSqliteRepository(filename)
+            client_repo.update_client("C1", "Ann Jones")
+            self.assertEqual([client.get_client_id for client in client_repo.search_by_name("JONES")], ["C1"])
+            self.assertEqual(client_repo.search_by_name("smith"), [])
+            client_repo.close()
+
+
+class TestRecordFileRepository(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "books.rec")
+        self.repo = BookRecordFileRepository(self.filename)
+        for i in range(40):
+            self.repo.add_book(Book(str(i), f"Title {i}", "Author", True))
+
+    def tearDown(self):
+        self.repo.close()
+        self.directory.cleanup()
+
+    def reopen(self):
+        self.repo.close()
+        self.repo = BookRecordFileRepository(self.filename)
+
+    def test_records_survive_reopen(self):
+        self.repo.set_availability("3", False)
+        self.repo.update_book("4", "A much longer title " * 30, "Someone")
+        self.repo.remove_book("title 5")
+        self.reopen()
+        self.assertEqual(len(self.repo), 39)
+        self.assertFalse(self.repo.is_available("3"))
+        self.assertEqual(self.repo.get_book("4").get_author, "Someone")
+        self.assertEqual(self.repo.find_book_id_by_title("TITLE 6"), "6")
+        self.assertEqual([b.get_book_id for b in self.repo][:6], ["0", "1", "2", "3", "4", "6"])
+        with self.assertRaises(BookNotFoundError):
+            self.repo.get_book("5")
+        with self.assertRaises(DuplicateIDError):
+            self.repo.add_book(Book("6", "Other", "Other", True))
+
+    def test_unit_of_work_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with UnitOfWork(self.repo):
+                self.repo.remove_book("Title 1")
+                self.repo.add_book(Book("new", "New", "New", True))
+                self.repo.set_availability("2", False)
+                raise RuntimeError()
+        self.assertEqual(len(self.repo), 40)
+        self.assertTrue(self.repo.is_available("2"))
+        self.assertEqual(self.repo.find_book_id_by_title("new"), None)
+        self.assertIn("1", [b.get_book_id for b in self.repo.search_by_title("title 1")])
+
+    def test_convert_from_pickle(self):
+        pickle_filename = os.path.join(self.directory.name, "rentals.bin")
+        with open(pickle_filename, "wb") as fout:
+            pickle.dump({"R1": Rental("R1", "B1", "C1", "2023-01-01", "")}, fout)
+        rental_repo = RentalRecordFileRepository.from_pickle(pickle_filename,
+                                                             os.path.join(self.directory.name, "rentals.rec"))
+        self.assertEqual(rental_repo.get_rental("R1").get_client_id, "C1")
+        with self.assertRaises(RentalDuplicateIDError):
+            rental_repo.add_rental(Rental("R2", "B1", "C2", "2023-01-02", ""))
+        rental_repo.close()
+
 
 class TestRentalRepository(unittest.TestCase):
     def setUp(self):
@@ -88,6 +385,38 @@ class TestRentalRepository(unittest.TestCase):
         with self.assertRaises(RentalNotFoundError):
             self.repo.remove_rental("Z99")
 
+    def test_book_and_client_indexes(self):
+        self.repo.add_rental(Rental("R2", "B2", "C1", "2023-01-02", ""))
+        with self.assertRaises(RentalDuplicateIDError):
+            self.repo.add_rental(Rental("R3", "B1", "C2", "2023-01-03", ""))
+        self.assertEqual([r.get_rental_id for r in self.repo.get_rentals_for_client("C1")], ["R1", "R2"])
+        self.repo.remove_rental("R1")
+        self.assertEqual(self.repo.get_rentals_for_book("B1"), [])
+        self.assertEqual([r.get_rental_id for r in self.repo.get_rentals_for_client("C1")], ["R2"])
+        self.repo.add_rental(Rental("R3", "B1", "C2", "2023-01-03", ""))
+        self.assertEqual([r.get_rental_id for r in self.repo.get_rentals_for_book("B1")], ["R3"])
+
+
+class TestRentalColumnarRepository(TestRentalRepository):
+    def setUp(self):
+        self.repo = RentalColumnarRepository()
+        self.rental = Rental("R1", "B1", "C1", "2023-01-01", "Not returned")
+        self.repo.add_rental(self.rental)
+
+    def test_columns_round_trip(self):
+        self.repo.add_rental(Rental("R2", "B2", "C1", "2023-01-02", ""))
+        self.repo.add_rental(Rental("R3", "B3", "C2", "2023-1-3", "2023-02-01"))
+        self.repo.reset_returned_date("R1", "2023-01-10")
+        self.assertEqual([str(r) for r in self.repo], [
+            str(Rental("R1", "B1", "C1", "2023-01-01", "2023-01-10")),
+            str(Rental("R2", "B2", "C1", "2023-01-02", "")),
+            str(Rental("R3", "B3", "C2", "2023-1-3", "2023-02-01"))])
+
+        self.repo.remove_rental("R2")
+        columns = self.repo.rental_columns()
+        self.assertEqual([columns.book_ids[code] for code in columns.book_codes], ["B1", "B3"])
+        self.assertEqual(columns.returned[0] - columns.rented[0], 9)
+
 
 class TestUndoService(unittest.TestCase):
     def setUp(self):
@@ -114,10 +443,81 @@ class TestUndoService(unittest.TestCase):
         self.undo_service.redo()
         self.assertEqual(self.test_list, ["A"])
 
+    def test_bounded_history(self):
+        undo_service = UndoService(max_operations=3)
+        for item in "ABCDE":
+            self._add_to_list(item)
+            undo_service.record(Operation(FunctionCall(self._remove_from_list), FunctionCall(self._add_to_list, item)))
+        self.assertEqual((len(undo_service), undo_service.dropped_operations), (3, 2))
+        for _ in range(3):
+            undo_service.undo()
+        self.assertEqual(self.test_list, ["A", "B"])
+        with self.assertRaises(NoOperationsToUndo):
+            undo_service.undo()
+        undo_service.redo()
+        self.assertEqual(self.test_list, ["A", "B", "C"])
+
+        undo_service = UndoService(max_bytes=1)
+        undo_service.record(Operation(FunctionCall(self._add_to_list, "x" * 1000), FunctionCall(self._remove_from_list)))
+        undo_service.record(Operation(FunctionCall(self._remove_from_list), FunctionCall(self._add_to_list, "y")))
+        self.assertEqual(len(undo_service), 1)
+        self.assertGreater(undo_service.dropped_bytes, 1000)
+        self.assertEqual(undo_service.history_bytes + undo_service.dropped_bytes,
+                         sum(op.estimated_size() for op in [
+                             Operation(FunctionCall(self._add_to_list, "x" * 1000), FunctionCall(self._remove_from_list)),
+                             Operation(FunctionCall(self._remove_from_list), FunctionCall(self._add_to_list, "y"))]))
+
     def test_undo_empty_raises(self):
         with self.assertRaises(NoOperationsToUndo):
             self.undo_service.undo()
 
+    def test_command_log_survives_restart(self):
+        book_repo, client_repo = BookMemoryRepository(), ClientMemoryRepository()
+
+        def start(filename):
+            undo_service = UndoService(book_repo, client_repo, command_log=CommandLog(filename))
+            return undo_service, BookService(book_repo, undo_service, None), ClientService(client_repo, undo_service)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "undo.jsonl")
+            undo_service, book_service, client_service = start(filename)
+            client_service.add_client("7", "Ann")
+            book_service.add_book("1", "Title", "Author")
+            book_service.update_book("1", "New Title", "New Author")
+            client_service.update_client("7", "Bob")
+            undo_service.undo()
+
+            undo_service, book_service, client_service = start(filename)
+            self.assertEqual(len(undo_service), 0)
+            undo_service.redo()
+            self.assertEqual(client_repo.get_client("7").get_client_name, "Bob")
+            for _ in range(3):
+                undo_service.undo()
+            self.assertEqual((len(book_repo), client_repo.get_client("7").get_client_name), (0, "Ann"))
+
+            undo_service, book_service, client_service = start(filename)
+            undo_service.redo()
+            undo_service.redo()
+            self.assertEqual(book_repo.get_book("1").get_title, "New Title")
+            book_service.remove_book("New Title")
+            undo_service, book_service, client_service = start(filename)
+            undo_service.undo()
+            undo_service.undo()
+            self.assertEqual(book_repo.get_book("1").get_title, "Title")
+
+    def test_update_client_records_changes_only(self):
+        client_repo = ClientMemoryRepository()
+        client_service = ClientService(client_repo, self.undo_service)
+        client_service.add_client("7", "Ann")
+        client_service.update_client("7", "Ann")
+        self.assertEqual(len(self.undo_service), 1)
+        client_service.update_client("7", "Bob")
+        self.assertEqual(len(self.undo_service), 2)
+        self.undo_service.undo()
+        self.assertEqual(client_repo.get_client("7").get_client_name, "Ann")
+        self.undo_service.undo()
+        self.assertEqual(len(client_repo), 0)
+
 
 class TestBookService(unittest.TestCase):
     def setUp(self):
@@ -145,6 +545,84 @@ class TestBookService(unittest.TestCase):
         self.assertEqual(len(self.repo), 0)
         self.rental_service_mock.delete_rentals_for_book.assert_called_with("1")
 
+    def test_import_books(self):
+        self.service.add_book("1", "Title", "Author")
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "catalog.csv")
+            with open(filename, "w", newline="", encoding="utf-8") as fout:
+                writer = csv.writer(fout)
+                writer.writerow(["book_id", "title", "author"])
+                writer.writerows([[str(i), f"Book {i}", "Supplier"] for i in range(2, 1200)])
+            self.assertEqual(self.service.import_books(filename), 1198)
+            self.assertEqual(len(self.repo), 1199)
+            self.assertEqual(len(self.undo_service), 2)
+            self.undo_service.undo()
+            self.assertEqual([book.get_book_id for book in self.repo], ["1"])
+            self.undo_service.redo()
+            self.assertEqual(self.repo.get_book("1199").get_title, "Book 1199")
+
+            filename = os.path.join(directory, "catalog.jsonl")
+            with open(filename, "w", encoding="utf-8") as fout:
+                fout.write(json.dumps({"book_id": "5000", "title": "New", "author": "A"}) + "\n")
+                fout.write(json.dumps({"book_id": "7", "title": "Taken", "author": "A"}) + "\n")
+            with self.assertRaises(DuplicateIDError):
+                self.service.import_books(filename)
+            self.assertEqual(len(self.repo), 1199)
+            self.assertEqual(len(self.undo_service), 2)
+
+    def test_import_undo_keeps_book_with_same_title(self):
+        self.service.add_book("1", "Dune", "Herbert")
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "catalog.csv")
+            with open(filename, "w", newline="", encoding="utf-8") as fout:
+                csv.writer(fout).writerows([["book_id", "title", "author"], ["2", "Dune", "Reprint"]])
+            self.service.import_books(filename)
+        self.undo_service.undo()
+        self.assertEqual([book.get_book_id for book in self.repo], ["1"])
+
+    def test_update_records_delta(self):
+        self.service.add_book("1", "Title", "Author")
+        self.service.update_book("1", "Title", "Author")
+        self.assertEqual(len(self.undo_service), 1)
+        self.service.update_book("1", "Title", "New Author")
+        self.repo.update_book("1", "Renamed", "New Author")
+        self.undo_service.undo()
+        book = self.repo.get_book("1")
+        self.assertEqual((book.get_title, book.get_author), ("Renamed", "Author"))
+
+        first = {"name": "update_book", "book_id": "1", "before": {"title": "A"}, "after": {"title": "B"}}
+        later = {"name": "update_book", "book_id": "1", "before": {"author": "X"}, "after": {"author": "Y"}}
+        self.assertEqual(merged_command(first, later),
+                         dict(first, before={"title": "A", "author": "X"}, after={"title": "B", "author": "Y"}))
+
+    def test_updates_coalesce(self):
+        self.service.add_book("1", "Title", "Author")
+        self.service.add_book("2", "Other", "Author")
+        with self.undo_service.batch("rename"):
+            for i in range(5):
+                self.service.update_book("1", f"Title {i}", "Author")
+        self.service.update_book("1", "Outside", "Author")
+        self.assertEqual(len(self.undo_service), 4)
+
+        self.undo_service.undo()
+        self.undo_service.undo()
+        self.assertEqual(self.repo.get_book("1").get_title, "Title")
+        self.undo_service.redo()
+        self.assertEqual(self.repo.get_book("1").get_title, "Title 4")
+
+        undo_service = UndoService(coalesce_window=60)
+        service = BookService(self.repo, undo_service, self.rental_service_mock)
+        service.update_book("1", "A", "Author")
+        service.update_book("1", "B", "Author")
+        service.update_book("2", "C", "Author")
+        service.update_book("2", "D", "Author")
+        self.assertEqual(len(undo_service), 2)
+        undo_service.undo()
+        service.update_book("1", "E", "Author")
+        self.assertEqual(len(undo_service), 2)
+        undo_service.undo()
+        self.assertEqual(self.repo.get_book("1").get_title, "B")
+
 
 class TestRentalService(unittest.TestCase):
     def setUp(self):
@@ -182,6 +660,97 @@ class TestRentalService(unittest.TestCase):
 
 #        self.service.return_book("Great Book")
 
+    def test_undo_return_then_rent(self):
+        book_repo = BookMemoryRepository()
+        undo_service = UndoService(book_repo, self.repo)
+        book_service = BookService(book_repo, undo_service, None)
+        service = RentalService(self.repo, book_service, MagicMock(), undo_service)
+        book_service.add_book("1", "Title", "Author")
+        service.rent_book("R1", "C1", "Title", "2023-01-01", "")
+        service.return_book("Title")
+
+        undo_service.undo()
+        self.assertEqual(self.repo.get_rental("R1").get_client_id, "C1")
+        self.assertFalse(book_service.is_book_available("1"))
+        undo_service.undo()
+        self.assertEqual(len(self.repo), 0)
+        self.assertTrue(book_service.is_book_available("1"))
+        undo_service.undo()
+        self.assertEqual(len(book_repo), 0)
+
+    def test_failed_undo_does_not_block_history(self):
+        calls = []
+        undo_service = UndoService()
+        undo_service.record(Operation(FunctionCall(calls.append, "first"), FunctionCall(calls.append, "redo")))
+        undo_service.record(Operation(FunctionCall(self.repo.remove_rental, "missing"), FunctionCall(calls.append, "redo")))
+        with self.assertRaises(UndoFailed):
+            undo_service.undo()
+        undo_service.undo()
+        self.assertEqual(calls, ["first"])
+
+    def test_approximate_authors_follow_book_removal(self):
+        book_repo = BookMemoryRepository()
+        undo_service = UndoService(book_repo, self.repo)
+        book_service = BookService(book_repo, undo_service, None)
+        service = RentalService(self.repo, book_service, MagicMock(), undo_service)
+        book_service._rental_service = service
+        book_repo.add_book(Book("1", "Title", "Author", True))
+        approximate = ApproximateRentalStatistics(service, lambda book_id: book_repo.get_book(book_id).get_author)
+        service.rent_book("R1", "C1", "Title", "2023-01-01", "")
+        book_service.remove_book("Title")
+        undo_service.undo()
+        self.assertEqual([author for author, _, _ in approximate.top_authors()], ["Author"])
+        undo_service.redo()
+        self.assertEqual(approximate.top_authors(), [])
+
+    def test_undo_rent_after_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def start():
+                book_repo = BookTextFileRepository(os.path.join(directory, "books.txt"))
+                rental_repo = RentalTextFileRepository(os.path.join(directory, "rentals.txt"))
+                undo_service = UndoService(book_repo, rental_repo,
+                                           command_log=CommandLog(os.path.join(directory, "undo.jsonl")))
+                book_service = BookService(book_repo, undo_service, None)
+                rental_service = RentalService(rental_repo, book_service, MagicMock(), undo_service)
+                return undo_service, book_service, rental_service
+
+            undo_service, book_service, rental_service = start()
+            book_service.add_book("1", "Title", "Author")
+            rental_service.rent_book(12345, "7", "Title", "2023-01-01", "2023-01-05")
+
+            undo_service, book_service, rental_service = start()
+            self.assertEqual(rental_service.get_rental("12345").get_book_id, "1")
+            undo_service.undo()
+            self.assertEqual(len(rental_service.rental_repo), 0)
+            self.assertTrue(book_service.is_book_available("1"))
+
+            undo_service, book_service, rental_service = start()
+            undo_service.redo()
+            self.assertEqual(rental_service.get_rental("12345").get_client_id, "7")
+
+
+
+class TestSketches(unittest.TestCase):
+    def test_error_bounds(self):
+        counts = CountMinSketch(0.01, 0.01)
+        hitters = SpaceSaving(100)
+        distinct = HyperLogLog(10)
+        true_counts = {}
+        for i in range(20000):
+            key = f"B{i % 7}" if i % 2 else f"B{i}"
+            true_counts[key] = true_counts.get(key, 0) + 1
+            counts.add(key)
+            hitters.add(key)
+            distinct.add(key)
+
+        self.assertTrue(all(counts.estimate(key) >= count for key, count in true_counts.items()))
+        exceeded = [key for key, count in true_counts.items() if counts.estimate(key) > count + counts.error_bound]
+        self.assertLess(len(exceeded), 0.01 * len(true_counts))
+        top = hitters.top(7)
+        self.assertEqual(sorted(key for key, _, _ in top), [f"B{i}" for i in range(7)])
+        for key, count, error in top:
+            self.assertTrue(count - error <= true_counts[key] <= count)
+        self.assertLess(abs(distinct.estimate() - len(true_counts)), 4 * distinct.relative_error * len(true_counts))
 
 
 class TestStatisticsService(unittest.TestCase):
@@ -216,9 +785,11 @@ class TestStatisticsService(unittest.TestCase):
 
         self.book_service = MagicMock()
         self.book_service.get_book.side_effect = self.book_repo.get_book
+        self.book_service.get_books.side_effect = self.book_repo.get_books
 
         self.client_service = MagicMock()
         self.client_service.get_client.side_effect = self.client_repo.get_client
+        self.client_service.get_clients.side_effect = self.client_repo.get_clients
 
         self.rental_service = MagicMock()
         self.rental_service.get_all_rentals.return_value = list(self.rental_repo)
@@ -253,6 +824,199 @@ class TestStatisticsService(unittest.TestCase):
         self.assertEqual(results[2].name, "Another Author")
         self.assertEqual(results[2].value, 2)
 
+    def test_statistics_follow_rental_events(self):
+        rental_service = RentalService(self.rental_repo, self.book_service, self.client_service, UndoService())
+        stats = StatisticsService(rental_service, self.book_service, self.client_service)
+        self.assertEqual(stats.get_most_active_clients()[0].value, 14)
+
+        rental_service.get_all_rentals = MagicMock(side_effect=rental_service.get_all_rentals)
+        rental_service.delete_rental_by_id("R10")
+        rental_service.add_rental_object(Rental("R12", "B6", "C2", "2023-07-01", "2023-07-21"))
+        results = stats.get_most_active_clients()
+        self.assertEqual([(r.name, r.value) for r in results], [("Lazy Client", 23), ("Active Client", 4)])
+        self.assertEqual(stats.get_most_rented_authors()[2].value, 2)
+        rental_service.get_all_rentals.assert_not_called()
+
+        with self.assertRaises(RuntimeError):
+            with UnitOfWork(self.rental_repo):
+                self.rental_repo.remove_rental("R11")
+                raise RuntimeError()
+        self.assertEqual(stats.get_most_active_clients()[0].value, 23)
+        rental_service.get_all_rentals.assert_called_once()
+
+    def test_top_k(self):
+        ranked = StatisticsService(self.rental_service, self.book_service, self.client_service, ranked=True)
+        for stats in (self.stats, ranked):
+            for method in ("get_most_rented_books", "get_most_active_clients", "get_most_rented_authors"):
+                everything = [(r.name, r.value) for r in getattr(stats, method)()]
+                for k in (0, 1, 3, 20):
+                    self.assertEqual([(r.name, r.value) for r in getattr(stats, method)(k)], everything[:k])
+        self.assertEqual([r.name for r in ranked.get_most_active_clients(1)], ["Active Client"])
+
+    def test_date_window(self):
+        self.assertEqual([(r.name, r.value) for r in self.stats.get_most_rented_books(since="2023-03-01",
+                                                                                        until="2023-04-30")],
+                         [("Extra Book 1", 1), ("Top Rented Book", 1), ("Extra Book 2", 1)])
+        self.assertEqual([(r.name, r.value) for r in self.stats.get_most_active_clients(since="2023-02-01")],
+                         [("Active Client", 13), ("Lazy Client", 2)])
+        self.assertEqual([(r.name, r.value) for r in self.stats.get_most_rented_authors(1, until="2023-02-01")],
+                         [("Famous Author", 2)])
+        self.assertEqual(self.stats.get_most_rented_books(since="2024-01-01"), [])
+        for method in ("get_most_rented_books", "get_most_active_clients", "get_most_rented_authors"):
+            self.assertEqual([(r.name, r.value) for r in getattr(self.stats, method)(since="2000-01-01")],
+                             [(r.name, r.value) for r in getattr(self.stats, method)()])
+        with self.assertRaises(ValueError):
+            self.stats.get_most_rented_books(since="last month")
+
+    def test_date_index_merges_added_rentals(self):
+        rental_service = RentalService(self.rental_repo, MagicMock(), MagicMock(), UndoService())
+        index = RentalDateIndex(rental_service)
+        index.book_counts()
+        for i in range(20):
+            rental_service.add_rental_object(Rental(f"N{i}", f"N{i}", "C1", f"2023-0{i % 9 + 1}-15", ""))
+        rental_service.delete_rental_by_id("N3")
+        rental_service.delete_rental_by_id("R3")
+        self.assertEqual(len(index._pending), 19)
+        since = date(2023, 2, 1).toordinal()
+        self.assertEqual(index.book_counts(since), RentalDateIndex(rental_service).book_counts(since))
+        self.assertEqual(index._pending, set())
+
+    def test_result_cache(self):
+        undo_service = UndoService(self.book_repo, self.client_repo, self.rental_repo)
+        book_service = BookService(self.book_repo, undo_service, None)
+        client_service = ClientService(self.client_repo, undo_service)
+        rental_service = RentalService(self.rental_repo, book_service, client_service, undo_service)
+        stats = StatisticsService(rental_service, book_service, client_service)
+
+        first = stats.get_most_rented_books(1)
+        self.assertEqual([r.name for r in stats.get_most_rented_books(1)], [r.name for r in first])
+        self.assertEqual((stats.cache_hits, stats.cache_misses), (1, 1))
+
+        book_service.update_book("B1", "Renamed Book", "Famous Author")
+        self.assertEqual(stats.get_most_rented_books(1)[0].name, "Renamed Book")
+        stats.get_most_active_clients()
+        self.assertEqual((stats.cache_hits, stats.cache_misses), (1, 3))
+
+        undo_service.undo()
+        self.assertEqual(stats.get_most_rented_books(1)[0].name, "Popular Book")
+        stats.get_most_active_clients()
+        self.assertEqual((stats.cache_hits, stats.cache_misses), (2, 4))
+
+        client_service.update_client("C1", "Renamed Client")
+        self.assertEqual(stats.get_most_active_clients()[0].name, "Renamed Client")
+        self.assertEqual(stats.cache_misses, 5)
+
+        stats.CACHE_SIZE = 2
+        for k in (1, 2, 3, 2):
+            stats.get_most_rented_books(k)
+        stats.get_most_rented_books(1)
+        self.assertEqual((stats.cache_hits, stats.cache_misses), (4, 8))
+        self.assertEqual(len(stats._cache), 2)
+
+    def test_author_map_survives_availability_changes(self):
+        undo_service = UndoService(self.book_repo, self.rental_repo)
+        book_service = BookService(self.book_repo, undo_service, None)
+        rental_service = RentalService(self.rental_repo, book_service, MagicMock(), undo_service)
+        stats = StatisticsService(rental_service, book_service, MagicMock())
+        book_service.get_books = MagicMock(side_effect=self.book_repo.get_books)
+        self.book_repo.add_book(Book("B9", "Spare Book", "Famous Author", True))
+
+        stats.get_most_rented_authors()
+        rental_service.rent_book("R20", "C1", "Spare Book", "2023-07-01", "")
+        rental_service.return_book("Spare Book")
+        stats.get_most_rented_authors()
+        self.assertEqual(book_service.get_books.call_count, 1)
+
+        book_service.update_book("B2", "Unpopular Book", "New Author")
+        self.assertIn("New Author", [r.name for r in stats.get_most_rented_authors()])
+        self.assertEqual(book_service.get_books.call_count, 2)
+
+        for repo in (BookMemoryRepository(), BookSqliteRepository(":memory:"),
+                     BookRecordFileRepository(os.path.join(tempfile.mkdtemp(), "books.rec"))):
+            repo.add_book(Book("1", "Title", "Author", True))
+            version = repo.catalog_version
+            repo.set_availability("1", False)
+            self.assertEqual(repo.catalog_version, version)
+            repo.update_book("1", "Title", "Other")
+            self.assertGreater(repo.catalog_version, version)
+
+    def test_export_streams_rows(self):
+        self.stats.EXPORT_BATCH = 3
+        rows = self.stats.iter_rows("books")
+        self.assertEqual(next(rows), {"title": "Popular Book", "author": "Famous Author", "rentals": 1})
+        self.assertEqual(len(list(rows)), 7)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "clients.csv")
+            self.assertEqual(export_statistics(self.stats, "clients", filename, k=1), 1)
+            with open(filename, newline="") as fin:
+                self.assertEqual(list(csv.DictReader(fin)), [{"client": "Active Client", "days_rented": "14"}])
+
+            filename = os.path.join(directory, "authors.jsonl")
+            self.assertEqual(export_statistics(self.stats, "authors", filename, since="2023-03-01"), 3)
+            with open(filename) as fin:
+                self.assertEqual([json.loads(line) for line in fin],
+                                 [{"author": r.name, "rentals": r.value}
+                                  for r in self.stats.get_most_rented_authors(since="2023-03-01")])
+
+            with self.assertRaises(ValueError):
+                export_statistics(self.stats, "books", os.path.join(directory, "books.txt"))
+            with self.assertRaises(ValueError):
+                export_statistics(self.stats, "rentals", filename)
+            self.assertEqual(sorted(os.listdir(directory)), ["authors.jsonl", "clients.csv"])
+
+    def test_approximate_mode(self):
+        rental_service = RentalService(self.rental_repo, self.book_service, self.client_service, UndoService())
+        exact = StatisticsService(rental_service, self.book_service, self.client_service)
+        approximate = StatisticsService(rental_service, self.book_service, self.client_service, approximate=True,
+                                        error_bounds=(0.01, 0.01))
+        rental_service.delete_rental_by_id("R10")
+        rental_service.add_rental_object(Rental("R12", "B6", "C3", "2023-07-01", ""))
+        rental_service.delete_rental_by_id("R12")
+
+        for method in ("get_most_rented_books", "get_most_rented_authors"):
+            results = getattr(approximate, method)(3)
+            self.assertEqual([(r.name, r.value) for r in results],
+                             [(r.name, r.value) for r in getattr(exact, method)(3)])
+            self.assertTrue(all(r.error == 0 for r in results))
+        self.assertEqual(approximate.get_most_rented_authors(1)[0].formatted_value, "4")
+        self.assertEqual(approximate.get_distinct_clients().value, 3)
+        self.assertEqual(exact.get_distinct_clients().value, 2)
+
+    def test_parallel_backend(self):
+        for workers, threshold in ((2, 0), (3, 0), (2, 1000)):
+            parallel = StatisticsService(self.rental_service, self.book_service, self.client_service,
+                                         backend="parallel", workers=workers, parallel_threshold=threshold)
+            for method in ("get_most_rented_books", "get_most_active_clients", "get_most_rented_authors"):
+                for k in (None, 0, 1, 3):
+                    self.assertEqual([(r.name, r.value) for r in getattr(parallel, method)(k)],
+                                     [(r.name, r.value) for r in getattr(self.stats, method)(k)])
+            pool = parallel._engine._pool
+            parallel._engine._version = None
+            parallel._engine.book_counts()
+            self.assertIs(parallel._engine._pool, pool)
+            parallel.close()
+            self.assertIsNone(parallel._engine._pool)
+
+        self.rental_service.get_all_rentals.return_value = []
+        parallel = StatisticsService(self.rental_service, self.book_service, self.client_service,
+                                     backend="parallel", workers=2, parallel_threshold=0)
+        self.assertEqual(parallel.get_most_rented_books(), [])
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_numpy_backend(self):
+        columnar = RentalColumnarRepository()
+        for rental in self.rental_repo:
+            columnar.add_rental(rental)
+        for repo in (self.rental_repo, columnar):
+            self.rental_service.rental_repo = repo
+            python = StatisticsService(self.rental_service, self.book_service, self.client_service)
+            numpy = StatisticsService(self.rental_service, self.book_service, self.client_service, backend="numpy")
+            for method in ("get_most_rented_books", "get_most_active_clients", "get_most_rented_authors"):
+                for k in (None, 0, 1, 3, 20):
+                    self.assertEqual([(r.name, r.value) for r in getattr(numpy, method)(k)],
+                                     [(r.name, r.value) for r in getattr(python, method)(k)])
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
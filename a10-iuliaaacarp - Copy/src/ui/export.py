@@ -0,0 +1,37 @@
+import argparse
+import sys
+
+from src.services.statistics_export import EXPORT_FORMATS, export_statistics
+from src.services.statistics_service import StatisticsService
+from src.ui.ui import UserInterface
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Export library statistics without starting the menu.")
+    parser.add_argument("statistic", choices=list(StatisticsService.EXPORT_COLUMNS))
+    parser.add_argument("output", help="the file to write; .csv or .jsonl unless --format is given")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, dest="file_format")
+    parser.add_argument("--top", type=int, help="keep only the top k rows")
+    parser.add_argument("--since", help="count only the rentals rented on or after this YYYY-MM-DD date")
+    parser.add_argument("--until", help="count only the rentals rented on or before this YYYY-MM-DD date")
+    return parser
+
+
+def main(argv=None) -> int:
+    """
+    python -m src.ui.export books most_rented.csv --top 10 --since 2024-01-01
+    """
+    args = build_parser().parse_args(argv)
+    try:
+        statistics_service = UserInterface.create_services()[4]
+        count = export_statistics(statistics_service, args.statistic, args.output, args.file_format, args.top,
+                                  args.since, args.until)
+    except Exception as e:
+        print(f"Export failed: {e}", file=sys.stderr)
+        return 1
+    print(f"Exported {count} rows to '{args.output}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
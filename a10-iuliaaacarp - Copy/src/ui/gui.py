@@ -2,16 +2,19 @@ import tkinter as tk
 import os
 from datetime import date
 from time import sleep
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
 
 from src.repository.change_repository import RepositoryChange
 from src.services.book_service import BookService
 from src.services.client_service import ClientService
 from src.services.rental_service import RentalService
 from src.services.undo_service import UndoService
+from src.services.command_log import CommandLog
 from src.services.statistics_service import StatisticsService
 
 class GUI:
+    STATISTICS_TOP_K = 5
+
     def __init__(self, main_window, book_service, client_service, rental_service, undo_service, statistics_service):
         self.main_window = main_window
         main_window.title("Library Management System")
@@ -46,12 +49,23 @@ class GUI:
             book_repo = repo_manager.create_repo_book()
             client_repo = repo_manager.create_repo_client()
             rental_repo = repo_manager.create_repo_rental()
+            undo_log = repo_manager.undo_log()
 
-            undo_service = UndoService()
+            undo_service = UndoService(book_repo, client_repo, rental_repo,
+                                       max_operations=repo_manager.undo_max_operations(),
+                                       max_bytes=repo_manager.undo_max_bytes(),
+                                       coalesce_window=repo_manager.undo_coalesce_window(),
+                                       command_log=CommandLog(undo_log) if undo_log else None)
             book_service = BookService(book_repo, undo_service, None)
             client_service = ClientService(client_repo, undo_service)
             rental_service = RentalService(rental_repo, book_service, client_service, undo_service)
-            statistics_service = StatisticsService(rental_service, book_service, client_service)
+            statistics_service = StatisticsService(rental_service, book_service, client_service,
+                                                   repo_manager.statistics_ranked(),
+                                                   repo_manager.statistics_backend(),
+                                                   repo_manager.statistics_workers(),
+                                                   repo_manager.statistics_parallel_threshold(),
+                                                   repo_manager.statistics_approximate(),
+                                                   repo_manager.statistics_error_bounds())
             book_service._rental_service = rental_service
 
             return book_service, client_service, rental_service, undo_service, statistics_service
@@ -77,6 +91,7 @@ class GUI:
         ttk.Button(button_frame, text="Add", command=self.add_something).pack(side="left", padx=10)
         ttk.Button(button_frame, text="Remove", command=self.remove_something).pack(side="left", padx=10)
         ttk.Button(button_frame, text="Update", command=self.update_something).pack(side="left", padx=10)
+        ttk.Button(button_frame, text="Import", command=self.import_something).pack(side="left", padx=10)
 
         # listbox to display entities
         list_frame = ttk.Frame(management_tab)
@@ -172,13 +187,13 @@ class GUI:
         statistics_frame = ttk.Frame(self.notebook, padding="10")
         self.notebook.add(statistics_frame, text="Statistics")
 
-        ttk.Label(statistics_frame, text="Most rented books (Top 5):", font=('Helvetica', 12, 'bold')).pack(pady=(10, 5))
+        ttk.Label(statistics_frame, text=f"Most rented books (Top {self.STATISTICS_TOP_K}):", font=('Helvetica', 12, 'bold')).pack(pady=(10, 5))
         self.s1_listbox = self.create_stats_listbox(statistics_frame, self.most_rented_books)
 
-        ttk.Label(statistics_frame, text="Most active clients (Top 5):", font=('Helvetica', 12, 'bold')).pack(pady=(10, 5))
+        ttk.Label(statistics_frame, text=f"Most active clients (Top {self.STATISTICS_TOP_K}):", font=('Helvetica', 12, 'bold')).pack(pady=(10, 5))
         self.s2_listbox = self.create_stats_listbox(statistics_frame, self.most_active_clients)
 
-        ttk.Label(statistics_frame, text="Most rented authors (Top 5):", font=('Helvetica', 12, 'bold')).pack(pady=(10, 5))
+        ttk.Label(statistics_frame, text=f"Most rented authors (Top {self.STATISTICS_TOP_K}):", font=('Helvetica', 12, 'bold')).pack(pady=(10, 5))
         self.s3_listbox = self.create_stats_listbox(statistics_frame, self.most_rented_authors)
 
         self.most_rented_books()
@@ -246,6 +261,21 @@ class GUI:
             messagebox.showinfo("Success!", f"Client {client_id} was added.")
         self.on_entity_change()
 
+    def import_something(self):
+        entity = self.entity_var.get()
+        filename = filedialog.askopenfilename(title=f"Import {entity.lower()}s",
+                                              filetypes=[("CSV or JSON Lines", "*.csv *.jsonl")])
+        if not filename: return
+        try:
+            if entity == "Book":
+                count = self._book_service.import_books(filename)
+            else:
+                count = self._client_service.import_clients(filename)
+            messagebox.showinfo("Success!", f"{count} {entity.lower()}s were imported.")
+        except Exception as e:
+            messagebox.showerror("Error!", f"Something went wrong! {e}")
+        self.on_entity_change()
+
     def remove_something(self):
         entity = self.entity_var.get()
         selection = self.book_listbox.curselection()
@@ -352,33 +382,30 @@ class GUI:
 
     def most_rented_books(self):
         try:
-            most_rented =self._statistics_service.get_most_rented_books()
+            most_rented =self._statistics_service.get_most_rented_books(self.STATISTICS_TOP_K)
             display_list = []
             for i, r in enumerate(most_rented):
-                if i < 5:
-                    display_list.append(f"{i+1}. {r.name} -- Rentals: {r.value}")
+                display_list.append(f"{i+1}. {r.name} -- Rentals: {r.formatted_value}")
             self.update_listbox(self.s1_listbox, display_list)
         except Exception as e:
             messagebox.showerror("Error!", f"Something went wrong! {e}")
 
     def most_active_clients(self):
         try:
-            most_active =self._statistics_service.get_most_active_clients()
+            most_active =self._statistics_service.get_most_active_clients(self.STATISTICS_TOP_K)
             display_list = []
             for i, r in enumerate(most_active):
-                if i < 5:
-                    display_list.append(f"{i+1}. {r.name} -- Days rented: {r.value}")
+                display_list.append(f"{i+1}. {r.name} -- Days rented: {r.value}")
             self.update_listbox(self.s2_listbox, display_list)
         except Exception as e:
             messagebox.showerror("Error!", f"Something went wrong! {e}")
 
     def most_rented_authors(self):
         try:
-            most_rented =self._statistics_service.get_most_rented_authors()
+            most_rented =self._statistics_service.get_most_rented_authors(self.STATISTICS_TOP_K)
             display_list = []
             for i, r in enumerate(most_rented):
-                if i < 5:
-                    display_list.append(f"{i+1}. {r.name} -- Rentals: {r.value}")
+                display_list.append(f"{i+1}. {r.name} -- Rentals: {r.formatted_value}")
             self.update_listbox(self.s3_listbox, display_list)
         except Exception as e:
             messagebox.showerror("Error!", f"Something went wrong! {e}")
@@ -414,4 +441,5 @@ if __name__ == "__main__":
         style = ttk.Style()
         style.theme_use('clam')
         app = GUI(root, *services)
-        root.mainloop()
\ No newline at end of file
+        root.mainloop()
+        services[4].close()
\ No newline at end of file
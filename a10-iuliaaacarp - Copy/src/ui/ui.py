@@ -1,4 +1,4 @@
-from datetime import date
+from datetime import date, timedelta
 import os
 
 from src.repository.change_repository import RepositoryChange
@@ -6,10 +6,15 @@ from src.services.book_service import BookService
 from src.services.client_service import ClientService
 from src.services.rental_service import RentalService
 from src.services.undo_service import UndoService
+from src.services.command_log import CommandLog
 from src.services.statistics_service import StatisticsService
+from src.services.statistics_export import export_statistics
 
 
 class UserInterface:
+    STATISTICS_TOP_K = 5
+    STATISTICS_RECENT_DAYS = 30
+
     def __init__(self, book_service: BookService, client_service: ClientService, rental_service: RentalService,
                  undo_service: UndoService, statistics_service: StatisticsService):
         self.running = True
@@ -27,6 +32,7 @@ class UserInterface:
         print("     b. Remove")
         print("     c. Update")
         print("     d. List all")
+        print("     e. Import from a CSV or JSON Lines file")
         print(" 2. Rent a book")
         print(" 3. Return a book")
         print(" 4. Search for a book")
@@ -39,34 +45,55 @@ class UserInterface:
         print(" s1. Most rented books")
         print(" s2. Most active clients")
         print(" s3. Most rented authors")
+        print(" s4. Most rented books in the last 30 days")
+        print(" s5. Most active clients this quarter")
+        print(" s6. Export statistics to a CSV or JSON Lines file")
+        print(" s7. Number of distinct clients")
 
     @staticmethod
-    def user_run():
+    def create_services():
+        """
+        :return: (book, client, rental, undo, statistics) services over the repositories
+                 chosen in settings.properties
+        """
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         settings_path = os.path.join(base_dir, "repository", "settings.properties")
 
         if not os.path.exists(settings_path):
             settings_path = "settings.properties"
 
-        try:
-            repo_manager = RepositoryChange(settings_path)
-
-            book_repo = repo_manager.create_repo_book()
-            client_repo = repo_manager.create_repo_client()
-            rental_repo = repo_manager.create_repo_rental()
+        repo_manager = RepositoryChange(settings_path)
 
-            undo_service = UndoService()
+        book_repo = repo_manager.create_repo_book()
+        client_repo = repo_manager.create_repo_client()
+        rental_repo = repo_manager.create_repo_rental()
+        undo_log = repo_manager.undo_log()
 
-            book_service = BookService(book_repo, undo_service, None)
-            client_service = ClientService(client_repo, undo_service)
-            rental_service = RentalService(rental_repo, book_service, client_service, undo_service)
+        undo_service = UndoService(book_repo, client_repo, rental_repo,
+                                   max_operations=repo_manager.undo_max_operations(),
+                                   max_bytes=repo_manager.undo_max_bytes(),
+                                   coalesce_window=repo_manager.undo_coalesce_window(),
+                                   command_log=CommandLog(undo_log) if undo_log else None)
 
-            statistics_service = StatisticsService(rental_service, book_service, client_service)
+        book_service = BookService(book_repo, undo_service, None)
+        client_service = ClientService(client_repo, undo_service)
+        rental_service = RentalService(rental_repo, book_service, client_service, undo_service)
 
-            book_service._rental_service = rental_service
+        statistics_service = StatisticsService(rental_service, book_service, client_service,
+                                               repo_manager.statistics_ranked(),
+                                               repo_manager.statistics_backend(),
+                                               repo_manager.statistics_workers(),
+                                               repo_manager.statistics_parallel_threshold(),
+                                               repo_manager.statistics_approximate(),
+                                               repo_manager.statistics_error_bounds())
 
-            return UserInterface(book_service, client_service, rental_service, undo_service, statistics_service)
+        book_service._rental_service = rental_service
+        return book_service, client_service, rental_service, undo_service, statistics_service
 
+    @staticmethod
+    def user_run():
+        try:
+            return UserInterface(*UserInterface.create_services())
         except Exception as e:
             print(f"Error initializing repositories or services: {e}")
             return None
@@ -79,10 +106,12 @@ class UserInterface:
         options = {
             "1Ba": self.add_book, "1Bb": self.remove_book, "1Bc": self.update_book, "1Bd": self.display_all_books,
             "1Ca": self.add_client, "1Cb": self.remove_client, "1Cc": self.update_client,
-            "1Cd": self.display_all_clients,
+            "1Cd": self.display_all_clients, "1Be": self.import_books, "1Ce": self.import_clients,
             "2": self.rent_book, "3": self.return_book, "4": self.search_book, "5": self.search_client,
             "6": self.display_all_rentals, "u": self.undo_operation, "r": self.redo_operation,
-            "s1": self.most_rented_books, "s2": self.most_active_clients, "s3": self.most_rented_authors
+            "s1": self.most_rented_books, "s2": self.most_active_clients, "s3": self.most_rented_authors,
+            "s4": self.recently_rented_books, "s5": self.quarter_active_clients,
+            "s6": self.export_statistics, "s7": self.distinct_clients
         }
 
         while self.running:
@@ -96,6 +125,7 @@ class UserInterface:
             elif choice == 'x':
                 print("Exiting the application. Goodbye!")
                 self.running = False
+                self._statistics_service.close()
             else:
                 print("Invalid choice. Please try again.")
 
@@ -114,31 +144,47 @@ class UserInterface:
             print(e)
 
     def most_rented_books(self):
-        most_rented = self._statistics_service.get_most_rented_books()
-        top = 0
+        most_rented = self._statistics_service.get_most_rented_books(self.STATISTICS_TOP_K)
         print("----Most rented books----")
         for r in most_rented:
-            if top < 5:
-                print(f"Title: {r.name}: | No. of rentals: {r.value}")
-            top += 1
+            print(f"Title: {r.name}: | No. of rentals: {r.formatted_value}")
 
     def most_active_clients(self):
-        most_active = self._statistics_service.get_most_active_clients()
-        top = 0
+        most_active = self._statistics_service.get_most_active_clients(self.STATISTICS_TOP_K)
         print("----Most active clients----")
         for r in most_active:
-            if top < 5:
-                print(f"Name: {r.name}: | Days rented: {r.value}")
-            top += 1
+            print(f"Name: {r.name}: | Days rented: {r.value}")
 
     def most_rented_authors(self):
-        most_rented = self._statistics_service.get_most_rented_authors()
-        top = 0
+        most_rented = self._statistics_service.get_most_rented_authors(self.STATISTICS_TOP_K)
         print("----Most rented authors----")
         for r in most_rented:
-            if top < 5:
-                print(f"Name: {r.name}: | No. of rentals: {r.value}")
-            top += 1
+            print(f"Name: {r.name}: | No. of rentals: {r.formatted_value}")
+
+    def distinct_clients(self):
+        print(f"Clients with rentals: {self._statistics_service.get_distinct_clients().formatted_value}")
+
+    def recently_rented_books(self):
+        since = (date.today() - timedelta(days=self.STATISTICS_RECENT_DAYS)).isoformat()
+        most_rented = self._statistics_service.get_most_rented_books(self.STATISTICS_TOP_K, since)
+        print(f"----Most rented books in the last {self.STATISTICS_RECENT_DAYS} days----")
+        for r in most_rented:
+            print(f"Title: {r.name}: | No. of rentals: {r.value}")
+
+    def quarter_active_clients(self):
+        today = date.today()
+        since = date(today.year, (today.month - 1) // 3 * 3 + 1, 1).isoformat()
+        most_active = self._statistics_service.get_most_active_clients(self.STATISTICS_TOP_K, since)
+        print("----Most active clients this quarter----")
+        for r in most_active:
+            print(f"Name: {r.name}: | Days rented: {r.value}")
+
+    def export_statistics(self):
+        kind = input(f"Statistic to export ({', '.join(StatisticsService.EXPORT_COLUMNS)}): ").strip().lower()
+        filename = input("File name (.csv or .jsonl): ").strip()
+        top = input("Keep only the top k rows (empty for all): ").strip()
+        count = export_statistics(self._statistics_service, kind, filename, k=int(top) if top else None)
+        print(f"Exported {count} rows to '{filename}'.")
 
     def add_book(self):
         book_id = self._book_service.generate_book_id()
@@ -215,6 +261,16 @@ class UserInterface:
         for r in results:
             print(r)
 
+    def import_books(self):
+        filename = input(f"File to import ({', '.join(BookService.IMPORT_COLUMNS)} fields, .csv or .jsonl): ").strip()
+        count = self._book_service.import_books(filename)
+        print(f"{count} books imported from '{filename}'.")
+
+    def import_clients(self):
+        filename = input(f"File to import ({', '.join(ClientService.IMPORT_COLUMNS)} fields, .csv or .jsonl): ").strip()
+        count = self._client_service.import_clients(filename)
+        print(f"{count} clients imported from '{filename}'.")
+
     def add_client(self):
         client_id = self._client_service.generate_client_id()
         client_name = input("Please enter the client name: ")